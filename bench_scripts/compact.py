@@ -0,0 +1,122 @@
+import argparse
+import conllu
+import os.path
+import sys
+import time
+import tracemalloc
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "talbanken_scripts"))
+from corrupt import CompactSent, DepIndex, phrase, plan, site_perm, SWELL_LABELS, ADV_RELS, base_deprel, dephead, find_subj, is_finv, is_imp
+
+# benchmark the corruption operations (building every candidate S-Adv,
+# S-FinV and S-WO word order of a sentence and re-indexing it) on CompactSent
+# permutations against the previous implementation on conllu Token dicts.
+# Reports time and the allocations traced by tracemalloc (peak and retained
+# memory for a batch of sentences, as a worker holds them)
+
+# previous implementation, kept here as the reference
+def adjust_indices(sent):
+    # map old IDs to new, sequential ones
+    old_new = {}
+    new_sent = sent.copy()
+    for i in range(len(new_sent)):
+        old_new[new_sent[i]["id"]] = i + 1
+    for i in range(len(new_sent)):
+        if not new_sent[i]["head"] == 0:
+            new_sent[i]["head"] = old_new[new_sent[i]["head"]]
+        new_sent[i]["id"] = old_new[new_sent[i]["id"]]
+    return new_sent
+
+def move_phrase(sent, phrase, pivot):
+    indices = [token["id"] for token in phrase]
+    start,end = min(indices),max(indices)
+    prefix = [token for token in sent if token["id"] < start and token["id"] != pivot["id"]]
+    postfix = [token for token in sent if token["id"] > end and token["id"] != pivot["id"]]
+    if end < pivot["id"]:
+        return prefix + [pivot] + phrase + postfix
+    else:
+        return prefix + phrase + [pivot] + postfix
+
+def old_moves(sent, index):
+    moves = []
+    for adv in [tok for tok in sent if base_deprel(tok["deprel"]) in ADV_RELS]:
+        try:
+            moves.append(move_phrase(sent, phrase(adv, sent, index), dephead(adv, sent, index)))
+        except:
+            continue
+    for finv in [tok for tok in sent if is_finv(tok) and not is_imp(tok)]:
+        try:
+            (subj, finv) = find_subj(sent, finv, index)
+            moves.append(move_phrase(sent, phrase(subj, sent, index), finv))
+        except:
+            continue
+    for i in range(len(sent) - 1):
+        swo_sent = sent.copy()
+        swo_sent[i] = sent[i + 1]
+        swo_sent[i + 1] = sent[i]
+        moves.append(swo_sent)
+    return moves
+
+# candidate corruptions of a sentence, re-indexed: Token dict copies with new
+# IDs and heads
+def old_corruptions(sent, index):
+    return [adjust_indices([tok.copy() for tok in move]) for move in old_moves(sent, index)]
+
+# the same as permutations and head arrays
+def new_corruptions(sent, index):
+    compact = CompactSent(sent, index.positions)
+    sites = plan(sent, index)
+    moves = [site_perm(compact, index, label, site) for label in SWELL_LABELS for site in sites[label]]
+    return [(move, compact.reindex(move)) for move in moves]
+
+def run(f, sents_indices):
+    return [f(sent, index) for (sent, index) in sents_indices]
+
+def best_time(f, sents_indices, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        run(f, sents_indices)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+# (peak, retained) bytes allocated while corrupting a batch of sentences and
+# keeping the results
+def traced_memory(f, sents_indices):
+    tracemalloc.start()
+    tracemalloc.reset_peak()
+    result = run(f, sents_indices)
+    (retained, peak) = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return (peak, retained)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("treebank", help=".conllu treebank to run the benchmark on")
+    parser.add_argument("--batch_size", type=int, default=1000, help="number of sentences whose corruptions are held in memory at once")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    with open(args.treebank) as f:
+        sents = conllu.parse(f.read())
+    sents_indices = [(sent, DepIndex(sent)) for sent in sents]
+
+    # sanity check: both implementations produce the same word orders and heads
+    for (sent, index) in sents_indices:
+        old = [[(tok["id"], tok["head"]) for tok in move] for move in old_corruptions(sent, index)]
+        new = [[(k + 1, head) for (k, head) in enumerate(heads)] for (_, heads) in new_corruptions(sent, index)]
+        assert old == new, sent.metadata.get("sent_id")
+        old = [[tok["id"] for tok in move] for move in old_moves(sent, index)]
+        new = [[sent[i]["id"] for i in move] for (move, _) in new_corruptions(sent, index)]
+        assert old == new, sent.metadata.get("sent_id")
+
+    n_moves = sum(len(new_corruptions(sent, index)) for (sent, index) in sents_indices)
+    print("{} sentences, {} candidate corruptions".format(len(sents), n_moves))
+    batch = sents_indices[:args.batch_size]
+    for (name, f) in [("Token dicts", old_corruptions), ("CompactSent", new_corruptions)]:
+        t = best_time(f, sents_indices, args.repeat)
+        (peak, retained) = traced_memory(f, batch)
+        print("{:<12} {:.3f}s ({:.0f} corruptions/s), {} sentences: {:.1f}MB peak, {:.1f}MB retained".format(
+            name, t, n_moves / t, len(batch), peak / (1 << 20), retained / (1 << 20)))
@@ -0,0 +1,76 @@
+import argparse
+import conllu
+import itertools
+import os.path
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "talbanken_scripts"))
+from corrupt import ADV_RELS, DepIndex, base_deprel, is_finv, is_imp, phrase, find_subj
+
+# benchmark phrase lookup with the precomputed DepIndex against the previous
+# implementation, which rebuilt the tree and round-tripped the subtree through
+# serialize/parse on every call
+
+# previous implementation, kept here as the reference
+def all_subtrees(tree):
+    return [tree] + list(itertools.chain.from_iterable([all_subtrees(child) for child in tree.children]))
+
+def find_subtree(head, tree):
+    return [subtree for subtree in all_subtrees(tree) if subtree.token["id"] == head["id"]][0]
+
+def phrase_to_tree(token, sent):
+    tree = sent.to_tree()
+    return conllu.parse(find_subtree(token, tree).serialize())[0]
+
+# all S-Adv and S-FinV phrase heads of a sentence
+def candidates(sent):
+    index = DepIndex(sent)
+    heads = [tok for tok in sent if base_deprel(tok["deprel"]) in ADV_RELS]
+    for finv in [tok for tok in sent if is_finv(tok) and not is_imp(tok)]:
+        found = find_subj(sent, finv, index)
+        if found:
+            heads.append(found[0])
+    return heads
+
+def time_it(f, sents_heads, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for (sent, heads) in sents_heads:
+            f(sent, heads)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def old_phrases(sent, heads):
+    return [phrase_to_tree(head, sent) for head in heads]
+
+# one index per sentence, as in corrupt()
+def new_phrases(sent, heads):
+    index = DepIndex(sent)
+    return [phrase(head, sent, index) for head in heads]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("treebank", help=".conllu treebank to run the benchmark on")
+    parser.add_argument("--repeat", type=int, default=3, help="number of runs, the best one is reported")
+    args = parser.parse_args()
+
+    with open(args.treebank) as f:
+        sents = conllu.parse(f.read())
+    sents_heads = [(sent, candidates(sent)) for sent in sents]
+    n_phrases = sum(len(heads) for (_, heads) in sents_heads)
+
+    # sanity check: both implementations find the same phrases
+    for (sent, heads) in sents_heads:
+        old = [[tok["id"] for tok in p] for p in old_phrases(sent, heads)]
+        new = [[tok["id"] for tok in p] for p in new_phrases(sent, heads)]
+        assert old == new, sent.metadata.get("sent_id")
+
+    old_time = time_it(old_phrases, sents_heads, args.repeat)
+    new_time = time_it(new_phrases, sents_heads, args.repeat)
+    print("{} sentences, {} phrases".format(len(sents), n_phrases))
+    print("to_tree + serialize/parse: {:.3f}s ({:.0f} phrases/s)".format(old_time, n_phrases / old_time))
+    print("DepIndex:                  {:.3f}s ({:.0f} phrases/s)".format(new_time, n_phrases / new_time))
+    print("speedup: {:.1f}x".format(old_time / new_time))
@@ -0,0 +1,66 @@
+import argparse
+import os.path
+import sys
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "swell_scripts"))
+from extract_sentence_pairs import align_essays, iter_essays, iter_pairs, placeholder_map, replace_all
+
+# microbenchmark placeholder replacement over all the sentence pairs of the
+# SweLL-gold corpus, against the previous implementation
+
+# previous implementation, kept here as the reference. It rebuilt the
+# filtered sentence at every token and, as a consequence, could replace the
+# wrong token (or fail with an IndexError) once a token had been filtered out
+def replace_placeholders_old(sentence, placeholder_map, essay_id):
+    for i, word in enumerate(sentence):
+        if 'A-' in word or 'B-' in word or 'C-' in word or 'D-' in word:
+            try:
+                sentence[i] = placeholder_map[word[2:]]
+            except KeyError:
+                continue
+        sentence = [word for word in sentence if '␤' not in word and essay_id not in word]
+    return sentence
+
+def replace_pair_old(sent1, sent2, essay_id, labels, placeholder_map):
+    try:
+        return (
+            ' '.join(replace_placeholders_old(list(sent1), placeholder_map, essay_id)),
+            ' '.join(replace_placeholders_old(list(sent2), placeholder_map, essay_id)),
+            essay_id,
+            ",".join(labels))
+    except IndexError:
+        return None
+
+def replace_all_old(pairs, placeholder_map):
+    return [replace_pair_old(*pair, placeholder_map) for pair in pairs]
+
+def best_time(f, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = f()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument('source', help='The path to the sourceSweLL.xml file')
+    parser.add_argument('target', help='The path to the targetSweLL.xml file')
+    parser.add_argument('--repeat', type=int, default=5, help='Number of runs, the best one is reported.')
+    args = parser.parse_args()
+
+    pairs = list(iter_pairs(align_essays(iter_essays(args.source), iter_essays(args.target))))
+    n_tokens = sum(len(sent1) + len(sent2) for (sent1, sent2, _, _) in pairs)
+
+    old_time, old = best_time(lambda: replace_all_old(pairs, placeholder_map), args.repeat)
+    new_time, new = best_time(lambda: list(replace_all(pairs, placeholder_map)), args.repeat)
+    failed = sum(o is None for o in old)
+    different = sum(o is not None and o != n for (o, n) in zip(old, new))
+
+    print(f'{len(pairs)} sentence pairs, {n_tokens} tokens')
+    print(f'old: {old_time:.3f}s ({n_tokens / old_time:.0f} tokens/s)')
+    print(f'new: {new_time:.3f}s ({n_tokens / new_time:.0f} tokens/s)')
+    print(f'speedup: {old_time / new_time:.1f}x')
+    print(f'{different} pairs differ (old implementation replacing the wrong token), {failed} failed with the old implementation')
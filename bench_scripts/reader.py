@@ -0,0 +1,57 @@
+import argparse
+import glob
+import multiprocessing
+import os.path
+import resource
+import sys
+import time
+import conllu
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from seapass import reader
+
+# benchmark seapass.reader against conllu.parse: parse time and peak RSS.
+# Each measurement runs in a fresh process so that peak RSS is not affected
+# by the previous ones, and without the on-disk cache (see seapass.cache),
+# which would otherwise time unpickling instead of parsing
+
+def load(method, path):
+    if method == "conllu.parse":
+        with open(path) as f:
+            return conllu.parse(f.read())
+    if method == "reader.read":
+        return reader.read(path, cache=False)
+    if method == "reader.read(mmap)":
+        return reader.read(path, mmap=True, cache=False)
+    if method == "reader.read(head,deprel)":
+        return reader.read(path, columns=["head", "deprel"], metadata=False, cache=False)
+
+# peak RSS in MB (ru_maxrss is in KB on Linux)
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def measure(method, path, queue):
+    rss_before = peak_rss()
+    start = time.perf_counter()
+    treebank = load(method, path)
+    elapsed = time.perf_counter() - start
+    queue.put((elapsed, peak_rss() - rss_before, len(treebank)))
+
+METHODS = ["conllu.parse", "reader.read", "reader.read(mmap)", "reader.read(head,deprel)"]
+
+if __name__ == "__main__":
+    default_paths = sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "data", "corrupted_talbanken", "*.conllu")))
+    parser = argparse.ArgumentParser()
+    parser.add_argument("treebanks", nargs="*", default=default_paths, help=".conllu files to read (default: the Talbanken files in data/)")
+    args = parser.parse_args()
+
+    ctx = multiprocessing.get_context("spawn")
+    for path in args.treebanks:
+        print(os.path.basename(path))
+        for method in METHODS:
+            queue = ctx.Queue()
+            proc = ctx.Process(target=measure, args=(method, path, queue))
+            proc.start()
+            (elapsed, rss, n) = queue.get()
+            proc.join()
+            print("  {:<26} {:>6} sentences {:8.3f}s {:8.1f}MB peak RSS increase".format(method, n, elapsed, rss))
@@ -0,0 +1,249 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import multiprocessing
+import os
+import os.path
+import platform
+import queue as queue_module
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+for path in ["", "talbanken_scripts", "swell_scripts", "eval_scripts", "bench_scripts"]:
+    sys.path.append(os.path.join(ROOT, path))
+
+import mix_treebanks
+import synthetic
+from corrupt import corrupt_treebank
+from prune import prune
+from seapass import cache, reader
+from sentence_eval import TreebankArrays, score
+from transfer_annotation import transfer_all
+
+# benchmark suite for the core function of each script, on synthetic
+# treebanks of any size and on the treebanks shipped in data/. For each
+# (benchmark, dataset) it records throughput, peak RSS and the time spent in
+# each stage, and saves everything as JSON. A previous JSON can be given with
+# --compare to flag regressions.
+#
+# Each benchmark runs in a fresh process, so that peak RSS is its own. Most of
+# them need a corrupted version of the dataset, which the corrupt benchmark
+# writes to the working directory: that one always runs first, unless the
+# dataset comes with its own corrupted treebank. The scripts are imported
+# before measuring, so that throughput and peak RSS are those of the work
+# itself (stage times only).
+
+SHIPPED = {
+    # name: (uncorrupted/target treebank, corrupted/original treebank or None
+    # to use the output of the corrupt benchmark)
+    "talbanken-test": ("data/corrupted_talbanken/sv_talbanken-ud-test.conllu", None),
+    "swell": ("data/swell/corrected.conllu", "data/swell/original.conllu"),
+}
+BENCHMARKS = ["read", "corrupt", "mix", "transfer", "prune", "eval"]
+
+# per-stage wall clock times
+class Stages:
+    def __init__(self):
+        self.times = {}
+
+    @contextlib.contextmanager
+    def __call__(self, name):
+        start = time.perf_counter()
+        yield
+        self.times[name] = self.times.get(name, 0) + time.perf_counter() - start
+
+def bench_read(trg, org, workdir, stages):
+    with stages("read"):
+        treebank = reader.read(trg, cache=False)
+    return len(treebank)
+
+def bench_corrupt(trg, org, workdir, stages):
+    with open(trg) as infile, open(org, "w") as outfile:
+        with stages("corrupt"):
+            corrupt_treebank(reader.iter_blocks(infile), outfile)
+    return len(reader.OffsetIndex(trg))
+
+def bench_mix(trg, org, workdir, stages):
+    with stages("index"):
+        indices = [reader.index(trg, ("sent_id", "variant_id"), cache=False), reader.index(org, ("sent_id", "variant_id"), cache=False)]
+    with stages("mix"):
+        mix = mix_treebanks.shuffle_and_recombine_indices(indices, 0.15)
+    with stages("write"):
+        mix_treebanks.save_indexed(mix, os.path.join(workdir, "mix.conllu"))
+    return len(mix)
+
+def bench_transfer(trg, org, workdir, stages):
+    with stages("read"):
+        trg_sents = reader.read_tokenlists(trg, cache=False)
+        org_treebank = reader.read(org, columns=["form"], metadata=False, cache=False)
+        org_sents = [" ".join(org_treebank.column("form", i)) for i in range(len(org_treebank))]
+    with stages("transfer"):
+        transferred = transfer_all(trg_sents, org_sents)
+    with stages("write"):
+        with open(os.path.join(workdir, "transferred.conllu"), "w") as f:
+            for sent in transferred:
+                f.write(sent.serialize())
+    return len(transferred)
+
+def bench_prune(trg, org, workdir, stages):
+    trg_copy = os.path.join(workdir, "prune-trg.conllu")
+    org_copy = os.path.join(workdir, "prune-org.conllu")
+    for (src, dst) in [(trg, trg_copy), (org, org_copy)]:
+        with open(src, "rb") as f, open(dst, "wb") as out:
+            out.write(f.read())
+    with stages("prune"):
+        prune(trg_copy, org_copy)
+    return len(reader.OffsetIndex(trg))
+
+def bench_eval(trg, org, workdir, stages):
+    with stages("read"):
+        vocab = {}
+        gold = TreebankArrays.from_file(trg, vocab)
+        pred = TreebankArrays.from_file(org, vocab)
+    with stages("score"):
+        score(pred, gold)
+    return len(gold)
+
+# peak RSS of the current process in MB (ru_maxrss is in KB on Linux)
+def peak_rss():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def run_bench(bench, trg, org, workdir, queue):
+    cache.default.enabled = False
+    stages = Stages()
+    rss_before = peak_rss()
+    try:
+        # the scripts report skipped sentences etc. on stdout
+        with contextlib.redirect_stdout(io.StringIO()):
+            n_sents = globals()["bench_" + bench](trg, org, workdir, stages)
+    except Exception as e:
+        queue.put({"error": repr(e)})
+        return
+    seconds = sum(stages.times.values())
+    queue.put({
+        "sentences": n_sents,
+        "seconds": seconds,
+        "sents_per_sec": n_sents / seconds if seconds else None,
+        "peak_rss_mb": peak_rss() - rss_before,
+        "stages": stages.times,
+    })
+
+# run a benchmark in a fresh process. If the process dies without a result
+# (crash, OOM kill) or takes more than timeout seconds, the result is an error
+# instead of waiting forever
+def run_in_process(ctx, bench, trg, org, workdir, timeout=None):
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run_bench, args=(bench, trg, org, workdir, queue))
+    proc.start()
+    deadline = None if timeout is None else time.monotonic() + timeout
+    result = None
+    while result is None:
+        try:
+            result = queue.get(timeout=1)
+        except queue_module.Empty:
+            if not proc.is_alive():
+                # the result may have been put just before exiting
+                try:
+                    result = queue.get(timeout=1)
+                except queue_module.Empty:
+                    how = "killed by signal {}".format(-proc.exitcode) if proc.exitcode < 0 else "exited with code {}".format(proc.exitcode)
+                    result = {"error": "benchmark process {} without a result".format(how)}
+            elif deadline is not None and time.monotonic() > deadline:
+                proc.kill()
+                result = {"error": "timed out after {}s".format(timeout)}
+    proc.join()
+    return result
+
+# [(dataset name, target treebank, original treebank or None)]
+def datasets(sizes, data, workdir):
+    result = []
+    for size in sizes:
+        path = os.path.join(workdir, "synthetic-{}.conllu".format(size))
+        synthetic.generate(path, synthetic.parse_size(size))
+        result.append(("synthetic-{}".format(size), path, None))
+    if data:
+        for (name, (trg, org)) in SHIPPED.items():
+            result.append((name, os.path.join(ROOT, trg), org and os.path.join(ROOT, org)))
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=ROOT, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return None
+
+# flag (benchmark, dataset) pairs that got slower or use more memory than in
+# a previous run by more than threshold (relative)
+def regressions(old_results, new_results, threshold):
+    old = {(r["bench"], r["dataset"]): r for r in old_results if "error" not in r}
+    found = []
+    for r in new_results:
+        previous = old.get((r["bench"], r["dataset"]))
+        if previous is None or "error" in r:
+            continue
+        if r["sents_per_sec"] < previous["sents_per_sec"] * (1 - threshold):
+            found.append("{} on {}: {:.0f} -> {:.0f} sentences/s".format(r["bench"], r["dataset"], previous["sents_per_sec"], r["sents_per_sec"]))
+        # ignore differences of less than 1MB, which are mostly noise
+        if r["peak_rss_mb"] > max(previous["peak_rss_mb"] * (1 + threshold), previous["peak_rss_mb"] + 1):
+            found.append("{} on {}: {:.1f} -> {:.1f}MB peak RSS".format(r["bench"], r["dataset"], previous["peak_rss_mb"], r["peak_rss_mb"]))
+    return found
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1k,10k,100k", help="comma-separated sizes (in tokens) of the synthetic treebanks, e.g. 1k,100k,1M,10M; empty for none")
+    parser.add_argument("--no_data", action="store_true", help="do not run on the treebanks in data/")
+    parser.add_argument("--benchmarks", default=",".join(BENCHMARKS), help="comma-separated benchmarks to run, among " + ", ".join(BENCHMARKS))
+    parser.add_argument("--output", default="bench_results.json", help="JSON file to save the results to")
+    parser.add_argument("--compare", help="JSON results of a previous run to compare with")
+    parser.add_argument("--threshold", type=float, default=0.1, help="relative slowdown or memory increase flagged as a regression")
+    parser.add_argument("--timeout", type=float, help="seconds after which a benchmark is stopped and reported as failed (default: none)")
+    args = parser.parse_args()
+
+    sizes = [size for size in args.sizes.split(",") if size]
+    benchmarks = [bench for bench in args.benchmarks.split(",") if bench]
+    ctx = multiprocessing.get_context("spawn")
+    results = []
+    with tempfile.TemporaryDirectory() as workdir:
+        for (dataset, trg, org) in datasets(sizes, not args.no_data, workdir):
+            tokens = sum(reader.OffsetIndex(trg).lengths)
+            corrupted = os.path.join(workdir, dataset + "-corrupted.conllu")
+            # the corrupt benchmark is needed by the others
+            to_run = [bench for bench in benchmarks if bench != "corrupt"]
+            if org is None:
+                to_run = ["corrupt"] + to_run
+            for bench in to_run:
+                result = run_in_process(ctx, bench, trg, corrupted if bench == "corrupt" else (org or corrupted), workdir, args.timeout)
+                if bench not in benchmarks:
+                    continue
+                result = dict(bench=bench, dataset=dataset, tokens=tokens, **result)
+                results.append(result)
+                if "error" in result:
+                    print("{:<10} {:<20} failed: {}".format(bench, dataset, result["error"]))
+                    continue
+                stages = " ".join("{}={:.3f}s".format(stage, t) for (stage, t) in result["stages"].items())
+                print("{:<10} {:<20} {:>10.0f} sentences/s {:>8.1f}MB  {}".format(bench, dataset, result["sents_per_sec"], result["peak_rss_mb"], stages))
+
+    run = {
+        "date": datetime.datetime.now().isoformat(),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(run, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            previous = json.load(f)
+        found = regressions(previous["results"], results, args.threshold)
+        for regression in found:
+            print("REGRESSION", regression)
+        if found:
+            sys.exit(1)
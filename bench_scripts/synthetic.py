@@ -0,0 +1,90 @@
+import argparse
+import random
+
+# synthetic CoNLL-U treebanks for benchmarking, of any size. Sentences are
+# random projective trees with a finite verb as root and a mix of the
+# relations the corruption cares about (adverbials, subjects), so that all
+# error types can be generated. Not linguistically meaningful!
+
+FORMS = {
+    "NOUN": ["bil", "skola", "hund", "pension", "system", "miljö", "bok", "stad"],
+    "PRON": ["jag", "du", "han", "hon", "det", "vi", "som"],
+    "VERB": ["tycker", "kom", "läser", "har", "går", "visade", "börjar"],
+    "ADV": ["inte", "ofta", "där", "också", "helt", "alltid"],
+    "ADJ": ["stor", "ny", "allmänna", "strängt", "svensk"],
+    "DET": ["en", "den", "ett", "det"],
+    "ADP": ["från", "av", "i", "om", "på"],
+    "PUNCT": [",", ":"],
+}
+# (upos, deprel) of non-root tokens, with repetitions as rough frequencies
+DEPENDENTS = [
+    ("NOUN", "nsubj"), ("PRON", "nsubj"), ("NOUN", "obj"), ("NOUN", "obl"),
+    ("ADV", "advmod"), ("ADV", "advmod"), ("VERB", "advcl"), ("VERB", "acl"),
+    ("ADJ", "amod"), ("DET", "det"), ("DET", "det"), ("ADP", "case"),
+    ("PUNCT", "punct"),
+]
+FIN_FEATS = "Mood=Ind|Tense=Pres|VerbForm=Fin|Voice=Act"
+
+# heads (1-based, 0 for the root) of a random projective tree of n tokens:
+# pick a root for the interval, then recurse on its left and right parts
+def projective_heads(rng, n):
+    heads = [0] * n
+    stack = [(0, n, 0)]
+    while stack:
+        (lo, hi, parent) = stack.pop()
+        if lo >= hi:
+            continue
+        root = rng.randrange(lo, hi)
+        heads[root] = parent
+        stack.append((lo, root, root + 1))
+        stack.append((root + 1, hi, root + 1))
+    return heads
+
+def sentence(rng, sent_id, n):
+    heads = projective_heads(rng, n)
+    rows = []
+    for (i, head) in enumerate(heads):
+        if head == 0:
+            (upos, deprel) = ("VERB", "root")
+        else:
+            (upos, deprel) = rng.choice(DEPENDENTS)
+        form = rng.choice(FORMS[upos])
+        feats = FIN_FEATS if upos == "VERB" else "_"
+        rows.append([str(i + 1), form, form, upos, "_", feats, str(head), deprel, "_", "_"])
+    rows[0][1] = rows[0][1].title()
+    rows.append([str(n + 1), ".", ".", "PUNCT", "_", "_", str(heads.index(0) + 1), "punct", "_", "_"])
+    lines = [
+        "# sent_id = synthetic-{}".format(sent_id),
+        "# text = {}".format(" ".join(row[1] for row in rows))]
+    lines += ["\t".join(row) for row in rows]
+    return "\n".join(lines) + "\n\n"
+
+# write a synthetic treebank of (about) n_tokens tokens to path, with
+# sentences of 3 to max_len tokens. Returns the number of sentences
+def generate(path, n_tokens, seed=0, max_len=30):
+    rng = random.Random(seed)
+    tokens = 0
+    n_sents = 0
+    with open(path, "w") as f:
+        while tokens < n_tokens:
+            n = rng.randint(2, max_len - 1)
+            f.write(sentence(rng, n_sents + 1, n))
+            tokens += n + 1
+            n_sents += 1
+    return n_sents
+
+# "10k" -> 10000, "1M" -> 1000000
+def parse_size(size):
+    multipliers = {"k": 10 ** 3, "M": 10 ** 6}
+    if size[-1] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("outfile", help="path of the .conllu file to write")
+    parser.add_argument("--tokens", default="10k", help="approximate number of tokens, e.g. 1k, 100k, 10M")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    print(generate(args.outfile, parse_size(args.tokens), args.seed), "sentences")
@@ -0,0 +1,62 @@
+import argparse
+import csv
+import sys
+from collections import Counter
+from seapass import instrument, leakage
+
+# check training treebanks (e.g. the train split of a mix, or a corrupted
+# treebank) for sentences that also appear in evaluation treebanks (the dev
+# and test splits, the SweLL evaluation set), exactly, as a word order variant
+# (e.g. the corrupted version of an evaluation sentence) or, with --near, as a
+# near duplicate, and for exact duplicates within each of them. See
+# seapass/leakage.py. --drop writes copies of the training treebanks without
+# the overlapping sentences
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("treebanks", nargs="+", help="treebanks to check: .conllu, shard folders, .mix or .store")
+    parser.add_argument("--against", nargs="+", required=True, help="evaluation treebanks they should not overlap with")
+    parser.add_argument("--near", action="store_true", help="also look for near duplicates, with MinHash LSH over the sets of forms")
+    parser.add_argument("--bands", type=int, default=8, help="number of LSH bands (with --near)")
+    parser.add_argument("--rows", type=int, default=8, help="number of MinHash values per band (with --near); sentences with a Jaccard similarity above about (1/bands)^(1/rows) are found")
+    parser.add_argument("--report", help="write every overlap to this TSV file")
+    parser.add_argument("--drop", action="store_true", help="write each treebank without its overlapping sentences to <name>-noleak.conllu")
+    parser.add_argument("--strict", action="store_true", help="exit with an error if any overlap is found")
+    parser.add_argument("--chunk_size", type=int, default=2000, help="number of sentences fingerprinted at a time")
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.configure(args)
+
+    minhash = leakage.MinHash(args.bands, args.rows) if args.near else None
+    with instrument.timer("leakage.index"):
+        index = leakage.Index(args.against, minhash, args.chunk_size)
+    print("{} evaluation sentences in {} treebanks".format(len(index), len(args.against)))
+    kinds = leakage.KINDS if args.near else leakage.KINDS[:2]
+
+    rows = []
+    total = 0
+    for path in args.treebanks:
+        with instrument.timer("leakage.check"):
+            (n, overlaps, duplicates) = leakage.check(path, index, args.chunk_size)
+        total += len(overlaps)
+        counts = Counter((overlap.kind, overlap.eval_path) for overlap in overlaps)
+        print("\n{}: {} sentences, {} overlapping with evaluation sentences, {} repeating an earlier sentence".format(
+            path, n, len(overlaps), duplicates))
+        print("  {:<40} ".format("") + " ".join("{:>8}".format(kind) for kind in kinds))
+        for eval_path in args.against:
+            print("  {:<40} ".format(eval_path) + " ".join("{:>8}".format(counts[(kind, eval_path)]) for kind in kinds))
+        for overlap in overlaps:
+            rows.append([path, overlap.number, overlap.sent_id, overlap.kind, overlap.eval_path, overlap.eval_number, overlap.eval_sent_id])
+        if args.drop:
+            output = leakage.drop_path(path)
+            with instrument.timer("leakage.drop"):
+                leakage.drop(path, [overlap.number for overlap in overlaps], output)
+            print("  {} sentences dropped, the others written to {}".format(len(overlaps), output))
+
+    if args.report:
+        with open(args.report, "w", newline="") as f:
+            writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+            writer.writerow(["treebank", "sentence", "sent_id", "kind", "eval_treebank", "eval_sentence", "eval_sent_id"])
+            writer.writerows(rows)
+    if args.strict and total:
+        sys.exit("{} overlapping sentences".format(total))
@@ -1,19 +1,149 @@
+import os.path
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from seapass import lazy, reader, sidecar
+
+np = lazy.module("numpy")
+
+# heads and deprels of a whole treebank as flat arrays: token j of sentence i
+# is at position offsets[i] + j. Deprels are stored as integer codes of
+# deprel_vocab, which must be shared by the treebanks being compared.
+# error_labels has one entry per sentence ("_" if the sentence has none)
+class TreebankArrays:
+    def __init__(self, heads, deprels, offsets, error_labels, deprel_vocab):
+        self.heads = heads
+        self.deprels = deprels
+        self.offsets = offsets
+        self.error_labels = error_labels
+        self.deprel_vocab = deprel_vocab
+
+    @classmethod
+    def from_columns(cls, heads, deprels, lengths, error_labels, deprel_vocab):
+        codes = [deprel_vocab.setdefault(deprel, len(deprel_vocab)) for deprel in deprels]
+        offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        return cls(
+            np.array(heads, dtype=np.int32),
+            np.array(codes, dtype=np.int32),
+            offsets,
+            error_labels,
+            deprel_vocab)
+
+    # from a list of conllu TokenLists. Multiword tokens and empty nodes are
+    # skipped, and a missing head ("_") is -1, as in seapass.reader, so that
+    # it never matches
+    @classmethod
+    def from_sents(cls, sents, deprel_vocab):
+        heads, deprels, lengths, error_labels = [], [], [], []
+        for sent in sents:
+            toks = [tok for tok in sent if isinstance(tok["id"], int)]
+            heads.extend(-1 if tok["head"] is None else tok["head"] for tok in toks)
+            deprels.extend(tok["deprel"] for tok in toks)
+            lengths.append(len(toks))
+            error_labels.append(sent.metadata.get("error_label", "_"))
+        return cls.from_columns(heads, deprels, lengths, error_labels, deprel_vocab)
+
+    # from a columnar seapass.reader.Treebank (read with at least the HEAD and
+    # DEPREL columns). Multiword tokens and empty nodes are skipped. Error
+    # labels are taken from the treebank metadata unless given
+    @classmethod
+    def from_treebank(cls, treebank, deprel_vocab, error_labels=None):
+        ids = np.frombuffer(treebank.column("id"), dtype=np.int32)
+        regular = ids >= 0
+        sent_ids = np.repeat(np.arange(len(treebank)), treebank.lengths())
+        lengths = np.bincount(sent_ids[regular], minlength=len(treebank))
+        heads = np.frombuffer(treebank.column("head"), dtype=np.int32)[regular]
+        deprels = [deprel for (deprel, keep) in zip(treebank.column("deprel"), regular) if keep]
+        if error_labels is None:
+            error_labels = [treebank.meta(i, "error_label", "_") for i in range(len(treebank))]
+        return cls.from_columns(heads, deprels, lengths, error_labels, deprel_vocab)
+
+    # straight from a .conllu file, reading only the HEAD and DEPREL columns.
+    # If the file has a sidecar (e.g. written by corrupt.py), error labels
+    # come from there and comments are not read at all
+    @classmethod
+    def from_file(cls, path, deprel_vocab):
+        columns = sidecar.load(path)
+        if columns is None:
+            treebank = reader.read(path, columns=["head", "deprel"], metadata=["error_label"])
+            return cls.from_treebank(treebank, deprel_vocab)
+        treebank = reader.read(path, columns=["head", "deprel"], metadata=False)
+        error_labels = [label or "_" for label in columns["error_label"]]
+        return cls.from_treebank(treebank, deprel_vocab, error_labels)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def lengths(self):
+        return np.diff(self.offsets)
+
+# score a whole parsed treebank against the gold one. Sentences of different
+# lengths can't be compared token by token: they are reported in
+# "mismatched" and get NaN scores instead of stopping the evaluation.
+# Returns a dict with per-sentence UAS/LAS arrays, micro (token-level) and
+# macro (sentence average) corpus scores, and micro scores by gold deprel and
+# by gold error_label
+def score(pred, gold):
+    assert len(pred) == len(gold), "Original and target inputs must be of same size."
+    n = len(gold)
+    lengths = gold.lengths()
+    matched = pred.lengths() == lengths
+    mismatched = np.flatnonzero(~matched)
+
+    # aligned token arrays, restricted to the sentences of the same length
+    gold_mask = np.repeat(matched, lengths)
+    pred_mask = np.repeat(matched, pred.lengths())
+    sent_ids = np.repeat(np.arange(n), lengths)[gold_mask]
+    u_correct = pred.heads[pred_mask] == gold.heads[gold_mask]
+    l_correct = u_correct & (pred.deprels[pred_mask] == gold.deprels[gold_mask])
+
+    # segmented reductions over sentences
+    u_sent = np.bincount(sent_ids, weights=u_correct, minlength=n)
+    l_sent = np.bincount(sent_ids, weights=l_correct, minlength=n)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        uas = np.where(matched, u_sent / lengths, np.nan)
+        las = np.where(matched, l_sent / lengths, np.nan)
+
+    tokens = u_correct.size
+    scores = {
+        "sentences": {"uas": uas, "las": las, "mismatched": mismatched},
+        "micro": {
+            "uas": u_correct.sum() / tokens if tokens else np.nan,
+            "las": l_correct.sum() / tokens if tokens else np.nan,
+            "tokens": int(tokens)},
+        "macro": {
+            "uas": np.nanmean(uas) if matched.any() else np.nan,
+            "las": np.nanmean(las) if matched.any() else np.nan,
+            "sentences": int(matched.sum())},
+    }
+
+    # breakdown by gold deprel
+    vocab = sorted(gold.deprel_vocab, key=gold.deprel_vocab.get)
+    gold_deprels = gold.deprels[gold_mask]
+    scores["by_deprel"] = breakdown(vocab, gold_deprels, u_correct, l_correct)
+
+    # breakdown by gold error label
+    labels, label_codes = np.unique(np.array(gold.error_labels, dtype=str), return_inverse=True)
+    token_labels = label_codes[sent_ids]
+    scores["by_error_label"] = breakdown([str(label) for label in labels], token_labels, u_correct, l_correct)
+    return scores
+
+# micro UAS/LAS for each group of tokens, groups given as integer codes
+def breakdown(names, codes, u_correct, l_correct):
+    tokens = np.bincount(codes, minlength=len(names))
+    u = np.bincount(codes, weights=u_correct, minlength=len(names))
+    l = np.bincount(codes, weights=l_correct, minlength=len(names))
+    return {
+        names[i]: {"uas": u[i] / tokens[i], "las": l[i] / tokens[i], "tokens": int(tokens[i])}
+        for i in range(len(names)) if tokens[i]}
+
+# per-sentence (UAS, LAS) of the parsed sentences l against the gold ones g,
+# both lists of conllu TokenLists. Sentences of different lengths are
+# reported and scored (nan, nan)
 def scorer(l,g):
-    assert len(l) == len(g), "Original and target inputs must be of same size."
-    scores = []
-    for i in range(len(l)):
-        u_mic = 0
-        l_mic = 0
-        s = l[i]
-        if len(s) != len(g[i]):
-            print("Original and target sentence not of same length")
-            break
-        for j in range(len(s)):
-            if s[j]['head'] == g[i][j]['head']:
-                u_mic += 1
-                if s[j]['deprel'] == g[i][j]['deprel']:
-                    l_mic += 1
-        uas = u_mic/len(s)
-        las = l_mic/len(s)
-        scores.append((uas,las))
-    return scores
\ No newline at end of file
+    vocab = {}
+    scores = score(TreebankArrays.from_sents(l, vocab), TreebankArrays.from_sents(g, vocab))
+    for i in scores["sentences"]["mismatched"]:
+        print("Original and target sentence {} not of same length".format(i))
+    return list(zip(scores["sentences"]["uas"].tolist(), scores["sentences"]["las"].tolist()))
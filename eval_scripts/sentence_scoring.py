@@ -1,20 +1,145 @@
 import argparse
-import conllu
-import pandas as pd
-from sentence_eval import scorer
-
-parser = argparse.ArgumentParser()
-parser.add_argument('test_path')
-parser.add_argument('pred_path')
-parser.add_argument('--outfile', default='out')
-args = parser.parse_args()
-    
-with open(args.test_path, 'r', encoding='utf-8') as t, open(args.pred_path, 'r', encoding='utf-8') as p:
-    tst, prd = t.read(), p.read()
-    test_sents, pred_sents = conllu.parse(tst), conllu.parse(prd)
-        
-scores = scorer(pred_sents,test_sents)
-results = pd.DataFrame(scores)
-results.columns =['UAS', 'LAS']
-file = f'evaluations/{args.outfile}.csv'
-results.to_csv(file)
\ No newline at end of file
+import os.path
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from sentence_eval import TreebankArrays, score
+from significance import compare
+from seapass import cache, instrument, lazy
+
+pd = lazy.module('pandas')
+
+# gold treebank of the worker processes, set once by init_worker instead of
+# being sent along with every prediction file
+worker_gold = None
+
+def init_worker(gold):
+    global worker_gold
+    worker_gold = gold
+
+# score one prediction file against the gold treebank of the worker
+def score_file(pred_path):
+    deprel_vocab = dict(worker_gold.deprel_vocab)
+    with instrument.timer('scoring.read'):
+        pred_sents = TreebankArrays.from_file(pred_path, deprel_vocab)
+    with instrument.timer('scoring.score'):
+        return score(pred_sents, worker_gold)
+
+# model and seed of a prediction file, from the named groups of name_pattern
+# matched against its path (model defaults to the file name)
+def describe(pred_path, name_pattern):
+    description = {'model': os.path.splitext(os.path.basename(pred_path))[0], 'seed': None}
+    match = re.search(name_pattern, pred_path) if name_pattern else None
+    if match:
+        description.update(match.groupdict())
+    return description
+
+# score many prediction files against the same gold treebank, parsed only
+# once, in a pool of worker processes. Returns a DataFrame with one row per
+# (prediction file, sentence) and one with the corpus scores of each file.
+# If reference is one of pred_paths, the corpus scores of the other files
+# also get significance tests (see significance.compare) against it
+def score_files(test_path, pred_paths, name_pattern=None, workers=1, reference=None, n_resamples=10000):
+    with instrument.timer('scoring.read'):
+        gold = TreebankArrays.from_file(test_path, {})
+    test = os.path.splitext(os.path.basename(test_path))[0]
+    if workers < 2:
+        init_worker(gold)
+        all_scores = list(map(score_file, pred_paths))
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker, initargs=(gold,)) as pool:
+            all_scores = list(pool.map(score_file, pred_paths))
+    sentence_rows = []
+    corpus_rows = []
+    for (pred_path, scores) in zip(pred_paths, all_scores):
+        description = describe(pred_path, name_pattern)
+        description['test'] = test
+        description['pred_path'] = pred_path
+        for i in scores['sentences']['mismatched']:
+            print(f'{pred_path}: original and target sentence {i} not of same length')
+        sentences = pd.DataFrame({
+            'sentence': range(len(gold)),
+            'UAS': scores['sentences']['uas'],
+            'LAS': scores['sentences']['las']})
+        sentence_rows.append(sentences.assign(**description))
+        corpus_rows.append(dict(
+            description,
+            micro_UAS=scores['micro']['uas'], micro_LAS=scores['micro']['las'],
+            macro_UAS=scores['macro']['uas'], macro_LAS=scores['macro']['las'],
+            tokens=scores['micro']['tokens'], sentences=scores['macro']['sentences'],
+            mismatched=len(scores['sentences']['mismatched'])))
+    columns = ['model', 'seed', 'test', 'pred_path']
+    sentences = pd.concat(sentence_rows, ignore_index=True)
+    sentences = sentences[columns + [c for c in sentences.columns if c not in columns]]
+    corpus = pd.DataFrame(corpus_rows)
+    if reference is not None:
+        ref = pred_paths.index(reference)
+        others = [k for k in range(len(pred_paths)) if k != ref]
+        for metric in ['uas', 'las']:
+            with instrument.timer('scoring.significance'):
+                tests = compare(
+                    all_scores[ref]['sentences'][metric],
+                    [all_scores[k]['sentences'][metric] for k in others],
+                    lengths=gold.lengths(),
+                    n_resamples=n_resamples)
+            for key in ['delta', 'delta_low', 'delta_high', 'p_value', 'p_ar']:
+                column = f'{metric.upper()}_{key}'
+                corpus[column] = float('nan')
+                corpus.loc[others, column] = [test[key] for test in tests]
+    return sentences, corpus
+
+# write a DataFrame in the columnar format given by the file extension
+def save_results(df, file):
+    if file.endswith('.feather'):
+        df.to_feather(file)
+    else:
+        df.to_parquet(file, index=False)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('test_path')
+    parser.add_argument('pred_path', nargs='+', help='one or more prediction files, all scored against test_path')
+    parser.add_argument('--outfile', default='out')
+    parser.add_argument('--results', help='columnar results file (.parquet or .feather) for several prediction files, default evaluations/OUTFILE.parquet; corpus scores go to the same name with -corpus')
+    parser.add_argument('--name_pattern', help='regular expression with named groups "model" and/or "seed" matched against prediction file paths, e.g. "(?P<model>[a-z0-9]+)-(?P<seed>[0-9]+)"')
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes')
+    parser.add_argument('--reference', help='one of the prediction files: compare all the others against it with paired bootstrap and approximate randomization tests (micro UAS/LAS)')
+    parser.add_argument('--resamples', type=int, default=10000, help='number of resamples for the significance tests')
+    cache.add_arguments(parser)
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    single = len(args.pred_path) == 1 and not args.results
+    if args.reference is not None and single:
+        parser.error('--reference needs several prediction files (or --results)')
+    if args.reference is not None and args.reference not in args.pred_path:
+        parser.error(f'--reference {args.reference} is not one of the prediction files')
+    cache.configure(args)
+    instrument.configure(args)
+
+    if single:
+        deprel_vocab = {}
+        with instrument.timer('scoring.read'):
+            test_sents = TreebankArrays.from_file(args.test_path, deprel_vocab)
+            pred_sents = TreebankArrays.from_file(args.pred_path[0], deprel_vocab)
+
+        with instrument.timer('scoring.score'):
+            scores = score(pred_sents, test_sents)
+        for i in scores['sentences']['mismatched']:
+            print(f'Original and target sentence {i} not of same length')
+        results = pd.DataFrame({'UAS': scores['sentences']['uas'], 'LAS': scores['sentences']['las']})
+        file = f'evaluations/{args.outfile}.csv'
+        results.to_csv(file)
+        print(f"micro UAS {scores['micro']['uas']:.4f} LAS {scores['micro']['las']:.4f}")
+        print(f"macro UAS {scores['macro']['uas']:.4f} LAS {scores['macro']['las']:.4f}")
+    else:
+        results = args.results or f'evaluations/{args.outfile}.parquet'
+        sentences, corpus = score_files(args.test_path, args.pred_path, args.name_pattern, args.workers, args.reference, args.resamples)
+        save_results(sentences, results)
+        (name, ext) = os.path.splitext(results)
+        save_results(corpus, f'{name}-corpus{ext}')
+        summary = ['model', 'seed', 'micro_UAS', 'micro_LAS', 'macro_UAS', 'macro_LAS']
+        if args.reference:
+            summary += ['LAS_delta', 'LAS_delta_low', 'LAS_delta_high', 'LAS_p_value', 'LAS_p_ar']
+        print(corpus[summary].to_string(index=False))
@@ -0,0 +1,106 @@
+import os.path
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from seapass import lazy
+
+np = lazy.module("numpy")
+
+# significance tests on sentence-level scores (e.g. the per-sentence UAS/LAS
+# of sentence_eval.score), comparing several systems against one reference at
+# once. All replicates are computed with matrix products: a replicate is a
+# row of weights over sentences (how many times each sentence was drawn, or
+# +-1 for approximate randomization), so that the metric of every replicate
+# of every system is weights @ scores.
+#
+# ref has shape (n_sentences,) and systems (n_systems, n_sentences). If
+# lengths (tokens per sentence) are given, the metric is the micro
+# (token-weighted) average, otherwise the macro (sentence) average.
+# Sentences that are NaN for the reference or any system are left out
+
+def _prepare(ref, systems, lengths):
+    ref = np.asarray(ref, dtype=np.float64)
+    systems = np.atleast_2d(np.asarray(systems, dtype=np.float64))
+    lengths = np.ones_like(ref) if lengths is None else np.asarray(lengths, dtype=np.float64)
+    keep = ~(np.isnan(ref) | np.isnan(systems).any(axis=0))
+    # per-sentence totals (e.g. number of correct heads) and weights
+    return ref[keep] * lengths[keep], systems[:, keep] * lengths[keep], lengths[keep]
+
+# replicates are computed in batches of (batch, n) matrices, which take about
+# BYTES_PER_CELL * batch * n bytes with their temporaries (int64 draws and
+# offsets, counts, float64 weights)
+BYTES_PER_CELL = 32
+MAX_BYTES = 256 << 20
+
+# number of replicates per batch: batch_size if given, otherwise as many as
+# fit in max_bytes for n sentences (at least one)
+def _batch_size(n, batch_size, max_bytes):
+    if batch_size is not None:
+        return batch_size
+    return max(1, max_bytes // (BYTES_PER_CELL * max(n, 1)))
+
+# (batch, n) matrices of how many times each sentence is drawn in each of
+# n_resamples bootstrap resamples, batch_size resamples at a time so that
+# memory does not grow with n_resamples
+def _resample_counts(n, n_resamples, rng, batch_size):
+    for start in range(0, n_resamples, batch_size):
+        batch = min(batch_size, n_resamples - start)
+        idx = rng.integers(0, n, size=(batch, n))
+        flat = idx + np.arange(batch)[:, None] * n
+        yield np.bincount(flat.ravel(), minlength=batch * n).reshape(batch, n).astype(np.float64)
+
+# paired bootstrap. Returns a dict of arrays with one value per system:
+# delta (system - reference metric), its (1 - alpha) percentile confidence
+# interval (delta_low, delta_high), the confidence interval of the system
+# metric (low, high) and the two-sided p-value of the null hypothesis
+# delta == 0 (from the bootstrap distribution shifted to mean 0)
+def paired_bootstrap(ref, systems, lengths=None, n_resamples=10000, alpha=0.05, seed=42, batch_size=None, max_bytes=MAX_BYTES):
+    ref, systems, lengths = _prepare(ref, systems, lengths)
+    batch_size = _batch_size(len(ref), batch_size, max_bytes)
+    rng = np.random.default_rng(seed)
+    # row 0: reference, then systems; last row: lengths
+    scores = np.vstack([ref, systems, lengths]).T
+    replicates = np.vstack([
+        counts @ scores for counts in _resample_counts(len(ref), n_resamples, rng, batch_size)])
+    metrics = replicates[:, :-1] / replicates[:, -1:]
+    deltas = metrics[:, 1:] - metrics[:, :1]
+    metric = systems.sum(axis=1) / lengths.sum()
+    delta = metric - ref.sum() / lengths.sum()
+    quantiles = [100 * alpha / 2, 100 * (1 - alpha / 2)]
+    delta_low, delta_high = np.percentile(deltas, quantiles, axis=0)
+    low, high = np.percentile(metrics[:, 1:], quantiles, axis=0)
+    extreme = (np.abs(deltas - delta) >= np.abs(delta)).sum(axis=0)
+    return {
+        "metric": metric,
+        "low": low,
+        "high": high,
+        "delta": delta,
+        "delta_low": delta_low,
+        "delta_high": delta_high,
+        "p_value": (extreme + 1) / (n_resamples + 1),
+    }
+
+# paired approximate randomization: each replicate swaps the reference and
+# system scores of a random half of the sentences. Returns the two-sided
+# p-values, one per system
+def approximate_randomization(ref, systems, lengths=None, n_resamples=10000, seed=42, batch_size=None, max_bytes=MAX_BYTES):
+    ref, systems, lengths = _prepare(ref, systems, lengths)
+    batch_size = _batch_size(len(ref), batch_size, max_bytes)
+    rng = np.random.default_rng(seed)
+    diffs = (systems - ref).T
+    delta = diffs.sum(axis=0)
+    extreme = np.zeros(len(systems))
+    for start in range(0, n_resamples, batch_size):
+        batch = min(batch_size, n_resamples - start)
+        signs = rng.choice([-1.0, 1.0], size=(batch, len(ref)))
+        extreme += (np.abs(signs @ diffs) >= np.abs(delta)).sum(axis=0)
+    return (extreme + 1) / (n_resamples + 1)
+
+# both tests at once, as a list of dicts (one per system) with the results of
+# paired_bootstrap and the approximate randomization p-value (p_ar)
+def compare(ref, systems, lengths=None, n_resamples=10000, alpha=0.05, seed=42, max_bytes=MAX_BYTES):
+    bootstrap = paired_bootstrap(ref, systems, lengths, n_resamples, alpha, seed, max_bytes=max_bytes)
+    p_ar = approximate_randomization(ref, systems, lengths, n_resamples, seed, max_bytes=max_bytes)
+    return [
+        dict({key: float(values[k]) for (key, values) in bootstrap.items()}, p_ar=float(p_ar[k]))
+        for k in range(len(p_ar))]
@@ -0,0 +1,26 @@
+import argparse
+import os.path
+from seapass import instrument, store
+
+# write a mix (.mix, see mix_treebanks.py --store) or a treebank store
+# (.store) as plain CoNLL-U, e.g. for training with MaChAmp, which reads
+# .conllu files. The output is the same file mix_treebanks.py writes without
+# --store
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("mix", nargs="+", help=".mix or .store files to export")
+    parser.add_argument("--output", required=False, help="output .conllu file (only with a single input; by default the .mix with the .conllu extension)")
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    if args.output and len(args.mix) > 1:
+        parser.error("--output only works with a single input")
+    instrument.configure(args)
+
+    for path in args.mix:
+        (name, ext) = os.path.splitext(path)
+        # a store is named after its treebank (x.conllu.store), which its
+        # default output would overwrite
+        if ext != ".mix" and not args.output:
+            parser.error("{} is not a .mix, give the output with --output".format(path))
+        store.export(path, args.output or name + ".conllu")
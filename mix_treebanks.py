@@ -1,7 +1,11 @@
-import conllu
 import argparse
+import json
+import os.path
 import random
 import math
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from seapass import cache, instrument, reader, shards, store
 
 # pud = 'sv_pud-ud'
 # lines = 'sv_lines-ud'
@@ -15,9 +19,7 @@ talbanken = 'sv_talbanken-ud'
 random.seed(42)
 
 def read_conllu(filename):
-    with open(filename) as f:
-        treebank = f.read()
-    return conllu.parse(treebank)
+    return reader.read_tokenlists(filename)
 
 def trim_treebank(treebank, trim):
     random.shuffle(treebank)
@@ -34,6 +36,8 @@ def shuffle_and_recombine(treebank_list, trim):
     # random.shuffle(output)
     uncorrupted = read_conllu(treebank_list[0])
     corrupted = read_conllu(treebank_list[1])
+    if corrupted and "variant_id" in corrupted[0].metadata:
+        corrupted = pick_variants(corrupted, uncorrupted)
     
     assert len(uncorrupted) == len(corrupted)
 
@@ -50,6 +54,72 @@ def shuffle_and_recombine(treebank_list, trim):
     random.shuffle(output)
     return output
 
+# the corrupted treebank can contain several variants of each sentence (see
+# corrupt.py --variants): pick one of them at random for each uncorrupted
+# sentence, so that the two treebanks are aligned again
+def pick_variants(corrupted, uncorrupted):
+    variants = {}
+    for sent in corrupted:
+        variants.setdefault(sent.metadata["sent_id"], []).append(sent)
+    return [random.choice(variants[sent.metadata["sent_id"]]) for sent in uncorrupted]
+
+# index-based version of shuffle_and_recombine: works on the OffsetIndexes of
+# the two treebanks instead of parsed sentences, shuffling lists of sentence
+# numbers. Shuffling a list consumes random the same way whatever its
+# elements, so the mix is the same that shuffle_and_recombine would produce.
+# Returns a list of (OffsetIndex, sentence number) pairs for save_indexed
+@instrument.timed("mix.shuffle_and_recombine")
+def shuffle_and_recombine_indices(index_list, trim):
+    uncorrupted_index = index_list[0]
+    corrupted_index = index_list[1]
+    uncorrupted = list(range(len(uncorrupted_index)))
+    corrupted = list(range(len(corrupted_index)))
+    if corrupted and corrupted_index.metadata["variant_id"][0] is not None:
+        corrupted = pick_variant_indices(corrupted_index, uncorrupted_index)
+
+    assert len(uncorrupted) == len(corrupted)
+
+    # same as filter_forbidden, on sentence lengths from the indexes
+    n_corrupted = len(corrupted)
+    corrupted = [c for (u, c) in zip(uncorrupted, corrupted) if corrupted_index.lengths[c] == uncorrupted_index.lengths[u]]
+    instrument.count("mix.length mismatches", n_corrupted - len(corrupted))
+
+    random.shuffle(uncorrupted)
+    random.shuffle(corrupted)
+
+    cutoff = math.floor(trim*len(uncorrupted))
+    if cutoff < len(corrupted):
+        output = [(corrupted_index, c) for c in corrupted[:cutoff]] + [(uncorrupted_index, u) for u in uncorrupted[cutoff:]]
+    else:
+        output = [(corrupted_index, c) for c in corrupted]
+    random.shuffle(output)
+    return output
+
+# same as pick_variants, on sentence numbers
+def pick_variant_indices(corrupted_index, uncorrupted_index):
+    variants = {}
+    for (c, sent_id) in enumerate(corrupted_index.metadata["sent_id"]):
+        variants.setdefault(sent_id, []).append(c)
+    return [random.choice(variants[sent_id]) for sent_id in uncorrupted_index.metadata["sent_id"]]
+
+# write a mix produced by shuffle_and_recombine_indices, copying the raw
+# sentences from the original files (no parsing or serialization)
+@instrument.timed("mix.save")
+def save_indexed(selection, file):
+    with open(file, 'wb') as f:
+        reader.copy_sentences(selection, f)
+
+# write a mix as an index list over the stores of its treebanks instead of
+# copying the sentences (see seapass.store). stores maps the indexes in the
+# selection to the paths of their stores. The .conllu extension of file
+# becomes .mix; with export, the CoNLL-U file is written from it as well
+def save_mix(selection, file, stores, export=False):
+    mix_path = os.path.splitext(file)[0] + '.mix'
+    store.write_mix(((stores[index], i) for (index, i) in selection), mix_path)
+    if export:
+        store.export(mix_path, file)
+    return mix_path
+
 def save_treebank(treebank, file):
     with open(file, 'w') as f:
         for sent in treebank:
@@ -62,6 +132,133 @@ def filter_forbidden(treebanks):
             corrupted.append(sent)
     return corrupted
 
+# weighted mixing of any number of treebanks (--source). Each source has a
+# weight (its share of the mix) and optionally a cap (the maximum number of
+# sentences taken from it). Sources are only indexed, never parsed: the
+# selection is made of sentence numbers and the mix is written by copying raw
+# sentences, so the treebanks never have to fit in memory
+
+# "path[:weight[:cap]]" -> (path, weight, cap). Weight defaults to 1, cap to
+# None (no cap)
+def parse_source(spec):
+    parts = spec.split(':')
+    numeric = 0
+    # the weight and cap are the trailing numeric parts, the path is the rest
+    while numeric < min(2, len(parts) - 1) and parts[-1 - numeric].replace('.', '', 1).isdigit():
+        numeric += 1
+    path = ':'.join(parts[:len(parts) - numeric])
+    values = parts[len(parts) - numeric:]
+    weight = float(values[0]) if values else 1.0
+    cap = int(values[1]) if len(values) > 1 else None
+    return (path, weight, cap)
+
+# index several treebanks at once, in a pool of worker processes if workers > 1
+def index_all(paths, workers=1):
+    metadata = ("sent_id", "variant_id")
+    if workers < 2:
+        return [reader.index(path, metadata) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(reader.index, paths, [metadata] * len(paths)))
+
+# number of sentences to take from each source: shares proportional to the
+# weights, out of size sentences, but never more than available (the number
+# of sentences of a source, or its cap). What a source can't take is shared
+# among the others. Without a size, the largest mix that keeps the exact
+# proportions. Rounding is by largest remainder, so that quotas add up
+def quotas(available, weights, size=None):
+    if size is None:
+        total = sum(weights)
+        size = min((math.floor(a * total / w) for (a, w) in zip(available, weights) if w > 0), default=0)
+    size = min(size, sum(a for (a, w) in zip(available, weights) if w > 0))
+    result = [0] * len(available)
+    active = [k for k in range(len(available)) if weights[k] > 0]
+    remaining = size
+    # sources that can't take their share take all they have
+    while active:
+        total = sum(weights[k] for k in active)
+        full = [k for k in active if remaining * weights[k] / total >= available[k]]
+        if not full:
+            break
+        for k in full:
+            result[k] = available[k]
+            remaining -= available[k]
+        active = [k for k in active if k not in full]
+    if active:
+        total = sum(weights[k] for k in active)
+        exact = {k: remaining * weights[k] / total for k in active}
+        for k in active:
+            result[k] = math.floor(exact[k])
+        left = remaining - sum(result[k] for k in active)
+        for k in sorted(active, key=lambda k: exact[k] - result[k], reverse=True)[:left]:
+            result[k] += 1
+    return result
+
+# pick quotas[k] random sentence numbers from each source k. With disjoint,
+# sentences are picked at most once across all the sources by sent_id (e.g.
+# a sentence and its corrupted version), sources coming first having priority;
+# a source may then get fewer sentences than its quota. Returns one array of
+# sentence numbers (in random order) per source
+def sample_sources(indices, quotas, rng, disjoint=False):
+    used = set()
+    selections = []
+    for (index, quota) in zip(indices, quotas):
+        if disjoint:
+            sent_ids = index.metadata["sent_id"]
+            candidates = [i for i in range(len(index)) if sent_ids[i] is None or sent_ids[i] not in used]
+            chosen = rng.sample(candidates, min(quota, len(candidates)))
+            used.update(sent_ids[i] for i in chosen)
+        else:
+            chosen = rng.sample(range(len(index)), quota)
+        selections.append(array('q', chosen))
+    return selections
+
+# interleave the selections of the sources in random order, as (index,
+# sentence number) pairs for save_indexed. At each position the source is
+# drawn with probability proportional to the number of its sentences still to
+# be placed, which makes every interleaving equally likely without building
+# and shuffling the whole list
+def interleave(indices, selections, rng):
+    remaining = [len(selection) for selection in selections]
+    total = sum(remaining)
+    while total:
+        r = rng.randrange(total)
+        k = 0
+        while r >= remaining[k]:
+            r -= remaining[k]
+            k += 1
+        remaining[k] -= 1
+        total -= 1
+        yield (indices[k], selections[k][remaining[k]])
+
+# mix one split of weighted sources into file. sources are (path, weight, cap)
+# tuples with their indices. With stores (see save_mix), the split is written
+# as an index list. Returns the manifest entry of the split: how many
+# sentences came from each source
+def weighted_mix(sources, indices, file, rng, size=None, disjoint=False, stores=None, export=False):
+    available = [len(index) if cap is None else min(cap, len(index)) for ((_, _, cap), index) in zip(sources, indices)]
+    weights = [weight for (_, weight, _) in sources]
+    if disjoint:
+        # there can't be more sentences than distinct sent_ids
+        sent_ids = set()
+        n_unnamed = 0
+        for index in indices:
+            sent_ids.update(index.metadata["sent_id"])
+            n_unnamed += index.metadata["sent_id"].count(None)
+        distinct = len(sent_ids - {None}) + n_unnamed
+        size = min(distinct, size if size is not None else sum(quotas(available, weights)))
+    split_quotas = quotas(available, weights, size)
+    selections = sample_sources(indices, split_quotas, rng, disjoint)
+    if stores is None:
+        save_indexed(interleave(indices, selections, rng), file)
+    else:
+        file = save_mix(interleave(indices, selections, rng), file, stores, export)
+    return {
+        'file': file,
+        'sentences': sum(len(selection) for selection in selections),
+        'sources': [
+            {'path': path, 'weight': weight, 'cap': cap, 'available': len(index), 'quota': quota, 'sentences': len(selection)}
+            for ((path, weight, cap), index, quota, selection) in zip(sources, indices, split_quotas, selections)]}
+
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
@@ -75,11 +272,60 @@ if __name__ == "__main__":
     parser.add_argument('--treebank_path', required=False, default='./data/', help='Path to the folder with all the treebanks.')
     # parser.add_argument('--train_trim', required=False, default=1000, help='The maximum number of sentences to take from a treebank in the train set.')
     # parser.add_argument('--test_dev_trim', required=False, default=100, help='The maximum number of sentences to take from a treebank in the test and dev sets.')
-    parser.add_argument('--trim', required=False, default=0.15, help='The % of corrupted sentences.')
-    parser.add_argument('--output_name', required=False, default='talbanken/sv-talbanken-ud-mix15', help='The core of the name for the output files.')
+    parser.add_argument('--trim', required=False, default='0.15', help='The %% of corrupted sentences. Several comma-separated values (e.g. 0.1,0.15,0.5) produce several mixes in one run.')
+    parser.add_argument('--output_name', required=False, default='talbanken/sv-talbanken-ud-mix15', help='The core of the name for the output files. With several trims, {} is replaced by the %% of corrupted sentences (e.g. talbanken/sv-talbanken-ud-mix{}).')
+    parser.add_argument('--source', action='append', help='Weighted mixing instead of --trim: a treebank as PATH[:WEIGHT[:CAP]], relative to --treebank_path, {split} standing for train, dev and test (e.g. talbanken/sv_talbanken-ud-{split}-corrupted.conllu:0.15). Can be repeated; sources missing for a split are left out of it.')
+    parser.add_argument('--size', required=False, help='With --source, number of sentences of each split, as SPLIT=N pairs (e.g. train=10000,dev=1000); by default the largest mix with the exact weights.')
+    parser.add_argument('--disjoint', action='store_true', help='With --source, never pick two sentences with the same sent_id (e.g. a sentence and its corrupted version).')
+    parser.add_argument('--seed', type=int, default=42, help='With --source, random seed.')
+    parser.add_argument('--workers', type=int, default=1, help='With --source, number of processes indexing the sources.')
+    parser.add_argument('--splits', default='test,dev,train', help='Comma-separated splits to write, e.g. to write them in parallel runs (the mixes are the same as when writing them all). With --source and only some splits, the manifest is named after them (e.g. -dev-manifest.json).')
+    parser.add_argument('--store', action='store_true', help='Write each split as an index list (.mix) over binary stores of the treebanks (.store, built once next to them) instead of copying the sentences. See seapass/store.py and export_mix.py.')
+    parser.add_argument('--export', action='store_true', help='With --store, also export each split to CoNLL-U.')
        
     
+    cache.add_arguments(parser)
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    cache.configure(args)
+    instrument.configure(args)
+    if args.export and not args.store:
+        parser.error('--export only works with --store')
+    splits = args.splits.split(',')
+    if not set(splits) <= {'test', 'dev', 'train'}:
+        parser.error('--splits can only contain test, dev and train')
+    
+    if args.source:
+        sizes = dict((split, int(n)) for (split, n) in (pair.split('=') for pair in args.size.split(','))) if args.size else {}
+        sources = [parse_source(spec) for spec in args.source]
+        paths = {}
+        for split in splits:
+            split_sources = [(args.treebank_path + path.format(split=split), weight, cap) for (path, weight, cap) in sources]
+            paths[split] = [source for source in split_sources if os.path.exists(shards.resolve(source[0]))]
+        # index all the sources at once
+        all_paths = sorted(set(path for split in paths for (path, _, _) in paths[split]))
+        with instrument.timer('mix.index'):
+            indices = dict(zip(all_paths, index_all([shards.resolve(path) for path in all_paths], args.workers)))
+        stores = None
+        if args.store:
+            with instrument.timer('mix.store'):
+                stores = {indices[path]: store.ensure(path, indices[path]) for path in all_paths}
+        manifest = {'seed': args.seed, 'disjoint': args.disjoint, 'splits': {}}
+        for split in ['test', 'dev', 'train']:
+            if split not in splits or not paths[split]:
+                continue
+            rng = random.Random('{}-{}'.format(args.seed, split))
+            file = args.treebank_path + args.output_name + '-' + split + '.conllu'
+            manifest['splits'][split] = weighted_mix(
+                paths[split], [indices[path] for (path, _, _) in paths[split]], file, rng, sizes.get(split), args.disjoint, stores, args.export)
+        manifest_name = args.output_name if len(set(splits)) == 3 else '-'.join([args.output_name] + [s for s in ['test', 'dev', 'train'] if s in splits])
+        with open(args.treebank_path + manifest_name + '-manifest.json', 'w') as f:
+            json.dump(manifest, f, indent=1)
+        exit()
+
+    trims = [float(trim) for trim in str(args.trim).split(',')]
+    if len(trims) > 1 and '{}' not in args.output_name:
+        parser.error('--output_name must contain {} when mixing with several trims')
     
     # if not args.lines and not args.talbanken:
     #     print('You must choose at least one treebank with more than just a test set!')
@@ -115,10 +361,33 @@ if __name__ == "__main__":
         
     # print(treebank_train_list, treebank_test_list, treebank_dev_list)
     
-    test_treebank = shuffle_and_recombine(treebank_test_list, float(args.trim))
-    dev_treebank = shuffle_and_recombine(treebank_dev_list, float(args.trim))
-    train_treebank = shuffle_and_recombine(treebank_train_list, float(args.trim))
-    
-    save_treebank(test_treebank, args.treebank_path + args.output_name + '-test.conllu')
-    save_treebank(dev_treebank, args.treebank_path + args.output_name + '-dev.conllu')
-    save_treebank(train_treebank, args.treebank_path + args.output_name + '-train.conllu')
+    # index each treebank once, then mix it as many times as needed. Corrupted
+    # treebanks written with corrupt.py --sharded are read from their shards
+    indices = {}
+    for path in treebank_test_list + treebank_dev_list + treebank_train_list:
+        with instrument.timer("mix.index"):
+            indices[path] = reader.index(shards.resolve(path), metadata=("sent_id", "variant_id"))
+    # with --store, the mixes are index lists over a store of each treebank
+    stores = None
+    if args.store:
+        with instrument.timer("mix.store"):
+            split_lists = {'test': treebank_test_list, 'dev': treebank_dev_list, 'train': treebank_train_list}
+            stores = {indices[path]: store.ensure(path, indices[path]) for split in splits for path in split_lists[split]}
+
+    for trim in trims:
+        # every mix gets the same random state as a run with only its trim
+        random.seed(42)
+        output_name = args.output_name.format(round(trim * 100))
+        
+        test_treebank = shuffle_and_recombine_indices([indices[path] for path in treebank_test_list], trim)
+        dev_treebank = shuffle_and_recombine_indices([indices[path] for path in treebank_dev_list], trim)
+        train_treebank = shuffle_and_recombine_indices([indices[path] for path in treebank_train_list], trim)
+        
+        for (split, treebank) in [('test', test_treebank), ('dev', dev_treebank), ('train', train_treebank)]:
+            if split not in splits:
+                continue
+            file = args.treebank_path + output_name + '-' + split + '.conllu'
+            if stores is None:
+                save_indexed(treebank, file)
+            else:
+                save_mix(treebank, file, stores, args.export)
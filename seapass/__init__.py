@@ -0,0 +1 @@
+# code shared by the preprocessing, mixing and evaluation scripts
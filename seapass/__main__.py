@@ -0,0 +1,64 @@
+import os.path
+import runpy
+import sys
+
+# single entry point for the scripts of the repository:
+#   python -m seapass COMMAND [ARGS...]
+# runs the script of COMMAND with ARGS exactly as if it was run directly
+# (python talbanken_scripts/corrupt.py ARGS...). Nothing but the standard
+# library is imported until a command is chosen, and heavy dependencies are
+# deferred further by the scripts themselves (see seapass.lazy), so that
+# --help is instant. python -m seapass run runs a pipeline (see
+# seapass.pipeline)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# command -> (script, relative to the repository root, and what it does)
+COMMANDS = {
+    "extract": ("swell_scripts/extract_sentence_pairs.py", "extract sentence-correction pairs from SweLL-gold"),
+    "filter": ("swell_scripts/filter.py", "keep the sentence pairs with only word order errors"),
+    "parse": ("swell_scripts/parse.py", "parse the corrected sentences with UDPipe 2"),
+    "transfer": ("swell_scripts/transfer_annotation.py", "transfer UD annotation from corrections to learner originals"),
+    "prune": ("swell_scripts/prune.py", "isolate the ungrammatical segments for targeted evaluation"),
+    "corrupt": ("talbanken_scripts/corrupt.py", "corrupt a treebank with synthetic word order errors"),
+    "mix": ("mix_treebanks.py", "mix normative and corrupted treebanks into splits"),
+    "export": ("export_mix.py", "export .mix index lists or stores to CoNLL-U"),
+    "leakage": ("check_leakage.py", "check training treebanks for sentences of the evaluation sets"),
+    "score": ("eval_scripts/sentence_scoring.py", "score parser predictions (UAS/LAS, significance tests)"),
+    "bench": ("bench_scripts/suite.py", "run the benchmark suite"),
+}
+
+def usage():
+    lines = ["usage: python -m seapass COMMAND [ARGS...]", "", "commands:"]
+    for (name, (_, description)) in COMMANDS.items():
+        lines.append("  {:<10} {}".format(name, description))
+    lines.append("  {:<10} {}".format("run", "run a pipeline, only the stages whose inputs or parameters changed"))
+    lines.append("")
+    lines.append("python -m seapass COMMAND --help for the arguments of a command")
+    return "\n".join(lines)
+
+# run the script of a command as __main__, with the script's folder first on
+# sys.path as when it is run directly (e.g. eval_scripts import each other)
+def run_command(name, args):
+    script = os.path.join(ROOT, COMMANDS[name][0])
+    sys.argv = [script] + list(args)
+    sys.path.insert(0, os.path.dirname(script))
+    runpy.run_path(script, run_name="__main__")
+
+def main(argv):
+    if not argv or argv[0] in ["-h", "--help"]:
+        print(usage())
+        return 0
+    (name, args) = (argv[0], argv[1:])
+    if name == "run":
+        from seapass import pipeline
+        return pipeline.main(args)
+    if name not in COMMANDS:
+        print(usage(), file=sys.stderr)
+        print("\nunknown command: {}".format(name), file=sys.stderr)
+        return 2
+    run_command(name, args)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,157 @@
+import atexit
+import hashlib
+import json
+import os
+import os.path
+import pickle
+import sys
+
+# persistent on-disk cache for parsed treebanks (and other things built from
+# a file, like offset indexes, or sentences parsed by UDPipe). Entries are pickles keyed by the file path,
+# its content hash and the options used to build them; the content hash is
+# only recomputed when the file size or mtime changes. The least recently
+# used entries are evicted when the total size goes over max_size.
+#
+# The cache lives in $SEAPASS_CACHE_DIR (default: ~/.cache/seapass), its size
+# is limited by $SEAPASS_CACHE_SIZE (in MB, default: 1024) and it can be
+# turned off with SEAPASS_NO_CACHE=1 or --no_cache (see add_arguments)
+
+class Cache:
+    def __init__(self, directory, max_size, enabled=True):
+        self.directory = directory
+        self.max_size = max_size
+        self.enabled = enabled
+        self.hits = 0
+        self.misses = 0
+
+    def _index_path(self):
+        return os.path.join(self.directory, "index.json")
+
+    def _entry_path(self, key):
+        return os.path.join(self.directory, key + ".pickle")
+
+    def _read_index(self):
+        try:
+            with open(self._index_path()) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    # write a file atomically, so that concurrent runs never see half of it
+    def _write_atomic(self, path, write):
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "wb") as f:
+            write(f)
+        os.replace(tmp_path, path)
+
+    # content hash of a file, reusing the stored one if the file size and
+    # mtime did not change
+    def content_hash(self, path):
+        path = os.path.abspath(path)
+        stat = os.stat(path)
+        index = self._read_index()
+        entry = index.get(path)
+        if entry and entry["size"] == stat.st_size and entry["mtime_ns"] == stat.st_mtime_ns:
+            return entry["hash"]
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        index[path] = {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns, "hash": sha.hexdigest()}
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_atomic(self._index_path(), lambda f: f.write(json.dumps(index).encode("utf-8")))
+        return sha.hexdigest()
+
+    # cache key for what kind (e.g. "Treebank") builds from path with options
+    def key(self, path, kind, options):
+        description = repr((os.path.abspath(path), self.content_hash(path), kind, options))
+        return hashlib.sha256(description.encode("utf-8")).hexdigest()
+
+    # cached value or None. Does not count as a miss, for callers that can do
+    # without the cache
+    def get(self, path, kind, options):
+        return self.get_key(self.key(path, kind, options))
+
+    # cached value of a key (see put), or None, for entries that are not
+    # built from a file (e.g. parsed sentences, see seapass.udpipe)
+    def get_key(self, key):
+        if not self.enabled:
+            return None
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError):
+            return None
+        os.utime(entry_path) # mark as recently used
+        self.hits += 1
+        return value
+
+    # cached value, or build() it and store it
+    def load(self, path, kind, options, build):
+        if not self.enabled:
+            return build()
+        value = self.get(path, kind, options)
+        if value is not None:
+            return value
+        self.misses += 1
+        value = build()
+        self.put(self.key(path, kind, options), value)
+        return value
+
+    # store a value. evict=False leaves eviction to the caller, e.g. once
+    # after many small entries instead of after each of them
+    def put(self, key, value, evict=True):
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_atomic(self._entry_path(key), lambda f: pickle.dump(value, f, pickle.HIGHEST_PROTOCOL))
+        if evict:
+            self.evict()
+
+    def _entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        paths = [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".pickle")]
+        return [(path, os.stat(path)) for path in paths]
+
+    # remove the least recently used entries until the cache fits in max_size
+    def evict(self):
+        entries = sorted(self._entries(), key=lambda entry: entry[1].st_mtime)
+        total = sum(stat.st_size for (_, stat) in entries)
+        for (path, stat) in entries:
+            if total <= self.max_size:
+                break
+            os.remove(path)
+            total -= stat.st_size
+
+    def clear(self):
+        for (path, _) in self._entries():
+            os.remove(path)
+        if os.path.exists(self._index_path()):
+            os.remove(self._index_path())
+
+    def size(self):
+        return sum(stat.st_size for (_, stat) in self._entries())
+
+    def report(self):
+        return "cache {}: {} hits, {} misses, {} entries, {:.1f}MB".format(
+            self.directory, self.hits, self.misses, len(self._entries()), self.size() / (1 << 20))
+
+default = Cache(
+    os.environ.get("SEAPASS_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "seapass")),
+    int(os.environ.get("SEAPASS_CACHE_SIZE", 1024)) << 20,
+    enabled=os.environ.get("SEAPASS_NO_CACHE", "") in ["", "0"])
+
+# add the cache options to a script's ArgumentParser
+def add_arguments(parser):
+    parser.add_argument("--no_cache", action="store_true", help="do not read or write the parsed treebank cache")
+    parser.add_argument("--clear_cache", action="store_true", help="empty the parsed treebank cache before running")
+    parser.add_argument("--cache_stats", action="store_true", help="print cache hit/miss statistics at the end of the run")
+
+# apply the options added by add_arguments
+def configure(args):
+    if args.clear_cache:
+        default.clear()
+    if args.no_cache:
+        default.enabled = False
+    if args.cache_stats:
+        atexit.register(lambda: print(default.report(), file=sys.stderr))
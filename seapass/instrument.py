@@ -0,0 +1,133 @@
+import atexit
+import cProfile
+import sys
+import time
+from collections import defaultdict
+from contextlib import nullcontext
+from functools import wraps
+
+# lightweight instrumentation of the hot paths of the scripts: named timers
+# (as context managers or decorators), counters and maxima, summarized in a
+# table at the end of the run. Everything is off by default and turned on by
+# --profile (see add_arguments); when off, a timer is a shared no-op context
+# manager and counters return right away, so instrumented code runs at
+# (almost) full speed. --profile_dump additionally dumps cProfile statistics,
+# to be read with pstats (python -m pstats FILE)
+#
+# Stages are named "<script>.<stage>", e.g. "corrupt.reindex"
+
+_NULL = nullcontext()
+
+class Profiler:
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.reset()
+
+    def reset(self):
+        self.times = defaultdict(float)
+        self.calls = defaultdict(int)
+        self.counters = defaultdict(int)
+        self.maxima = {}
+
+    # context manager timing a stage: with profiler.timer("corrupt.parse"):
+    def timer(self, name):
+        if not self.enabled:
+            return _NULL
+        return _Timer(self, name)
+
+    # decorator timing every call of a function
+    def timed(self, name):
+        def decorate(f):
+            @wraps(f)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return f(*args, **kwargs)
+                with _Timer(self, name):
+                    return f(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def count(self, name, n=1):
+        if self.enabled:
+            self.counters[name] += n
+
+    # keep track of the largest value seen, e.g. a recursion depth
+    def maximum(self, name, value):
+        if self.enabled and value > self.maxima.get(name, value - 1):
+            self.maxima[name] = value
+
+    # statistics collected so far, as plain dicts (e.g. to send them from a
+    # worker process back to the main one, see run)
+    def stats(self):
+        return {"times": dict(self.times), "calls": dict(self.calls), "counters": dict(self.counters), "maxima": dict(self.maxima)}
+
+    def merge(self, stats):
+        for (name, t) in stats["times"].items():
+            self.times[name] += t
+        for (name, n) in stats["calls"].items():
+            self.calls[name] += n
+        for (name, n) in stats["counters"].items():
+            self.counters[name] += n
+        for (name, value) in stats["maxima"].items():
+            self.maximum(name, value)
+
+    def report(self):
+        lines = ["{:<40} {:>10} {:>10} {:>10}".format("stage", "calls", "total s", "mean ms")]
+        for name in sorted(self.times, key=self.times.get, reverse=True):
+            lines.append("{:<40} {:>10} {:>10.3f} {:>10.3f}".format(
+                name, self.calls[name], self.times[name], 1000 * self.times[name] / self.calls[name]))
+        if self.counters or self.maxima:
+            lines.append("{:<40} {:>10}".format("counter", "value"))
+            for name in sorted(self.counters):
+                lines.append("{:<40} {:>10}".format(name, self.counters[name]))
+            for name in sorted(self.maxima):
+                lines.append("{:<40} {:>10}".format("max " + name, self.maxima[name]))
+        return "\n".join(lines)
+
+class _Timer:
+    __slots__ = ("profiler", "name", "start")
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.profiler.times[self.name] += time.perf_counter() - self.start
+        self.profiler.calls[self.name] += 1
+
+default = Profiler()
+timer = default.timer
+timed = default.timed
+count = default.count
+maximum = default.maximum
+
+# run f(*args) in a worker process with profiling on, and return its result
+# together with the statistics it collected, to be merged into default in the
+# main process
+def run(f, *args):
+    default.enabled = True
+    default.reset()
+    result = f(*args)
+    return (result, default.stats())
+
+# add the profiling options to a script's ArgumentParser
+def add_arguments(parser):
+    parser.add_argument("--profile", action="store_true", help="time the stages of the run and print a summary table at the end")
+    parser.add_argument("--profile_dump", metavar="FILE", help="also dump cProfile statistics to FILE (implies --profile)")
+
+# apply the options added by add_arguments
+def configure(args):
+    if not (args.profile or args.profile_dump):
+        return
+    default.enabled = True
+    atexit.register(lambda: print(default.report(), file=sys.stderr))
+    if args.profile_dump:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        def dump():
+            profiler.disable()
+            profiler.dump_stats(args.profile_dump)
+        atexit.register(dump)
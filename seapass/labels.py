@@ -0,0 +1,195 @@
+import fnmatch
+import re
+from seapass import lazy
+
+np = lazy.module("numpy")
+
+# bitmask encoding of SweLL correction labels and a small query language over
+# it. The correction labels of a sentence (e.g. "S-Adv,O-Cap", as written by
+# extract_sentence_pairs.py) become a single integer with one bit per label,
+# so that a predicate on labels is a few bitwise operations over an array of
+# masks, whatever the number of sentences (see Query). Label multiplicity is
+# not kept: "O-Cap,O-Cap" is the same as "O-Cap".
+#
+# The labels of the SweLL taxonomy have fixed bits, in the order of LABELS;
+# other labels get the next free bits as they are seen by a LabelIndex. Masks
+# are uint64, so there can be at most 64 labels
+
+LABELS = [
+    # orthographic
+    "O", "O-Cap", "O-Comp",
+    # lexical
+    "L-Der", "L-FL", "L-Ref", "L-W",
+    # morphological
+    "M-Adj/adv", "M-Case", "M-Def", "M-F", "M-Gend", "M-Num", "M-Other", "M-Verb",
+    # punctuation
+    "P-M", "P-R", "P-Sent", "P-W",
+    # syntactic
+    "S-Adv", "S-Clause", "S-Comp", "S-Ext", "S-FinV", "S-M", "S-Msubj", "S-Other", "S-R", "S-Type", "S-WO",
+    # other
+    "C", "Cit-FL", "Com!", "OBS!", "Unid", "X"]
+
+MAX_LABELS = 64
+
+class LabelIndex:
+    def __init__(self, labels=LABELS):
+        self.bits = {}
+        for label in labels:
+            self.bit(label)
+
+    # bit of a label, assigning the next free one to a new label
+    def bit(self, label):
+        if label not in self.bits:
+            if len(self.bits) == MAX_LABELS:
+                raise ValueError("more than {} correction labels, can't add {}".format(MAX_LABELS, label))
+            self.bits[label] = 1 << len(self.bits)
+        return self.bits[label]
+
+    # mask of a comma-separated label string (empty labels are ignored)
+    def encode(self, labels):
+        mask = 0
+        for label in labels.split(","):
+            if label:
+                mask |= self.bit(label)
+        return mask
+
+    def decode(self, mask):
+        return [label for (label, bit) in self.bits.items() if mask & bit]
+
+    # mask of all the labels matching shell-style patterns (e.g. S-*). A
+    # pattern without wildcards is a label, known or not
+    def expand(self, patterns):
+        mask = 0
+        for pattern in patterns:
+            if any(c in pattern for c in "*?["):
+                for (label, bit) in self.bits.items():
+                    if fnmatch.fnmatchcase(label, pattern):
+                        mask |= bit
+            else:
+                mask |= self.bit(pattern)
+        return mask
+
+    # masks of a sequence of label strings, as a uint64 array
+    def encode_all(self, label_strings):
+        return np.array([self.encode(labels) for labels in label_strings], dtype=np.uint64)
+
+    # number of masks each label is set in: {label: count}, in bit order
+    def counts(self, masks):
+        return {label: int(np.count_nonzero(masks & np.uint64(bit))) for (label, bit) in self.bits.items()}
+
+# predicates over an array of masks M with the mask L of their label
+# arguments
+PREDICATES = {
+    # at least one of the labels
+    "any": lambda masks, m: (masks & m) != 0,
+    # all of the labels (and maybe others)
+    "all": lambda masks, m: (masks & m) == m,
+    # some labels, all of them among the given ones
+    "only": lambda masks, m: (masks != 0) & ((masks & ~m) == 0),
+    # exactly the given labels
+    "exactly": lambda masks, m: masks == m,
+    # none of the labels
+    "none": lambda masks, m: (masks & m) == 0,
+}
+
+TOKEN = re.compile(r"\s*(?:(?P<label>[A-Za-z*?\[][\w*?\[\]/!.-]*)|(?P<op>[()&|,!]))")
+
+# a query over correction labels, e.g.
+#   only(S-Adv, S-FinV, S-WO, O-Cap) & !exactly(O-Cap)
+#   S-FinV & !O-Cap
+#   any(S-*) | (all(M-Def, M-Gend) & none(L-*))
+# made of the predicates in PREDICATES, with labels or shell-style patterns as
+# arguments, & (and), | (or), ! (not) and parentheses. A bare label or
+# pattern is short for any(...). Calling a Query on an array of masks (see
+# LabelIndex.encode_all) returns a boolean array
+class Query:
+    def __init__(self, text, index):
+        self.text = text
+        self.index = index
+        self.tokens = self._tokenize(text)
+        self.pos = 0
+        self.tree = self._expr()
+        if self.pos < len(self.tokens):
+            self._error("unexpected {}".format(self.tokens[self.pos][1]))
+
+    def _tokenize(self, text):
+        tokens = []
+        pos = 0
+        while text[pos:].strip():
+            match = TOKEN.match(text, pos)
+            if not match:
+                raise ValueError("invalid query {!r} at {!r}".format(text, text[pos:].strip()))
+            tokens.append(("label", match.group("label")) if match.group("label") else ("op", match.group("op")))
+            pos = match.end()
+        return tokens
+
+    def _error(self, message):
+        raise ValueError("invalid query {!r}: {}".format(self.text, message))
+
+    def _peek(self):
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else (None, None)
+
+    def _take(self, value=None):
+        token = self._peek()
+        if token[0] is None or (value is not None and token[1] != value):
+            self._error("expected {}".format(value or "more"))
+        self.pos += 1
+        return token
+
+    def _label(self):
+        (kind, value) = self._take()
+        if kind != "label":
+            self._error("expected a label, got {}".format(value))
+        return value
+
+    # expr := term ("|" term)*, term := factor ("&" factor)*
+    def _expr(self):
+        tree = self._term()
+        while self._peek() == ("op", "|"):
+            self._take()
+            tree = ("or", tree, self._term())
+        return tree
+
+    def _term(self):
+        tree = self._factor()
+        while self._peek() == ("op", "&"):
+            self._take()
+            tree = ("and", tree, self._factor())
+        return tree
+
+    # factor := "!" factor | "(" expr ")" | NAME "(" labels ")" | label
+    def _factor(self):
+        (kind, value) = self._take()
+        if (kind, value) == ("op", "!"):
+            return ("not", self._factor())
+        if (kind, value) == ("op", "("):
+            tree = self._expr()
+            self._take(")")
+            return tree
+        if kind != "label":
+            self._error("unexpected {}".format(value))
+        if self._peek() != ("op", "("):
+            return ("any", [value])
+        if value not in PREDICATES:
+            self._error("unknown predicate {}".format(value))
+        self._take("(")
+        labels = [self._label()]
+        while self._peek() == ("op", ","):
+            self._take()
+            labels.append(self._label())
+        self._take(")")
+        return (value, labels)
+
+    def _eval(self, tree, masks):
+        if tree[0] == "not":
+            return ~self._eval(tree[1], masks)
+        if tree[0] == "and":
+            return self._eval(tree[1], masks) & self._eval(tree[2], masks)
+        if tree[0] == "or":
+            return self._eval(tree[1], masks) | self._eval(tree[2], masks)
+        # patterns are expanded at evaluation time, so that they also match
+        # labels seen after the query was compiled
+        return PREDICATES[tree[0]](masks, np.uint64(self.index.expand(tree[1])))
+
+    def __call__(self, masks):
+        return self._eval(self.tree, masks)
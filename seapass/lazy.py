@@ -0,0 +1,23 @@
+import importlib
+import importlib.util
+import sys
+
+# deferred imports for the heavy dependencies (numpy, pandas): the module is
+# only loaded when one of its attributes is first used, so that e.g. --help
+# or a subcommand that does not need it (see seapass.__main__) does not pay
+# for importing it. Use as
+#   np = lazy.module("numpy")
+# in place of import numpy as np
+
+def module(name):
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ModuleNotFoundError("No module named '{}'".format(name), name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    lazy_module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = lazy_module
+    loader.exec_module(lazy_module)
+    return lazy_module
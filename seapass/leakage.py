@@ -0,0 +1,227 @@
+import hashlib
+import os.path
+import unicodedata
+from seapass import lazy, reader, shards, store
+
+np = lazy.module("numpy")
+
+# train/evaluation leakage and duplicate detection. Each sentence is
+# fingerprinted by
+#   - its normalized form sequence (exact duplicates)
+#   - its sorted bag of normalized forms, so that word order variants (e.g. a
+#     sentence and its corrupted version, see corrupt.py) collide
+#   - optionally, MinHash LSH band keys of its set of forms, for near
+#     duplicates: sentences whose sets of forms have a Jaccard similarity
+#     above about (1/bands)^(1/rows) share a band key with high probability
+# Forms are normalized by case folding, and punctuation tokens (and multiword
+# tokens/empty nodes) are left out. Fingerprints are 64 bits hashes.
+#
+# An Index holds the fingerprints of the evaluation treebanks (dev, test,
+# SweLL...) as sorted uint64 arrays. Training treebanks are then streamed
+# against it chunk by chunk (see check), so memory use is that of the
+# evaluation side plus 8 bytes per training sentence (for duplicates within
+# the training treebank), which scales to tens of millions of sentences
+
+KINDS = ["exact", "variant", "near"]
+
+# sentences (raw CoNLL-U blocks) of a treebank: a .conllu file, a shard
+# folder (see seapass.shards), a store or a mix (see seapass.store)
+def iter_blocks(path):
+    path = shards.resolve(path)
+    if shards.is_sharded(path):
+        for chunk_path in shards.chunk_paths(path):
+            yield from iter_blocks(chunk_path)
+    elif path.endswith((".mix", ".store")):
+        with store.open_treebank(path) as treebank:
+            for k in range(len(treebank)):
+                yield bytes(treebank[k]).decode("utf-8")
+    else:
+        with open(path, encoding="utf-8") as f:
+            yield from reader.iter_blocks(f)
+
+def is_punct(form):
+    return all(unicodedata.category(c).startswith("P") for c in form)
+
+# (sent_id, normalized forms) of a raw CoNLL-U block
+def normalize(block):
+    sent_id = None
+    forms = []
+    for line in block.split("\n"):
+        if line.startswith("#"):
+            if line.startswith("# sent_id = "):
+                sent_id = line[len("# sent_id = "):].strip()
+        elif line:
+            (token_id, form) = line.split("\t", 2)[:2]
+            if token_id.isdigit() and not is_punct(form):
+                forms.append(form.casefold())
+    return (sent_id, forms)
+
+def hash64(text):
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+# MinHash LSH: bands * rows multiply-shift hash functions over the 64 bits
+# hashes of the forms, and a key per band combining its rows
+class MinHash:
+    def __init__(self, bands=8, rows=8, seed=42):
+        self.bands = bands
+        self.rows = rows
+        rng = np.random.default_rng(seed)
+        # odd multipliers
+        self.a = rng.integers(0, 1 << 63, bands * rows, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+        self.b = rng.integers(0, 1 << 63, bands * rows, dtype=np.uint64)
+        self.mix = rng.integers(0, 1 << 63, rows, dtype=np.uint64) * np.uint64(2) + np.uint64(1)
+
+    # band keys of a chunk of sentences, given the hashes of all their forms
+    # (concatenated) and where each sentence starts: (n_sentences, bands)
+    def band_keys(self, token_hashes, starts):
+        with np.errstate(over="ignore"):
+            values = (self.a[:, None] * token_hashes[None, :] + self.b[:, None]) >> np.uint64(32)
+            signatures = np.minimum.reduceat(values, starts, axis=1)
+            signatures = signatures.reshape(self.bands, self.rows, len(starts))
+            keys = (signatures * self.mix[None, :, None]).sum(axis=1)
+        # keep bands apart
+        return (keys + np.arange(self.bands, dtype=np.uint64)[:, None] * np.uint64(0x9E3779B97F4A7C15)).T
+
+# fingerprints of the sentences of a treebank, in chunks: (sentence numbers,
+# sent_ids, exact, variant, near) with near None without minhash. Sentences
+# without forms (e.g. only punctuation) are left out
+def iter_fingerprints(path, minhash=None, chunk_size=2000):
+    numbers = []
+    sent_ids = []
+    token_lists = []
+    def flush():
+        exact = np.array([hash64(" ".join(forms)) for forms in token_lists], dtype=np.uint64)
+        variant = np.array([hash64(" ".join(sorted(forms))) for forms in token_lists], dtype=np.uint64)
+        near = None
+        if minhash is not None:
+            token_sets = [sorted(set(forms)) for forms in token_lists]
+            lengths = np.array([len(forms) for forms in token_sets], dtype=np.int64)
+            starts = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+            token_hashes = np.array([hash64(form) for forms in token_sets for form in forms], dtype=np.uint64)
+            near = minhash.band_keys(token_hashes, starts)
+        return (np.array(numbers, dtype=np.int64), sent_ids, exact, variant, near)
+    for (i, block) in enumerate(iter_blocks(path)):
+        (sent_id, forms) = normalize(block)
+        if not forms:
+            continue
+        numbers.append(i)
+        sent_ids.append(sent_id)
+        token_lists.append(forms)
+        if len(numbers) == chunk_size:
+            yield flush()
+            (numbers, sent_ids, token_lists) = ([], [], [])
+    if numbers:
+        yield flush()
+
+# sorted fingerprints with where they come from
+class SortedKeys:
+    def __init__(self, keys, owners):
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.owners = owners[order]
+
+    # for each query key, the position of its first match in the evaluation
+    # sentences (see Index), or -1
+    def lookup(self, queries):
+        if not len(self.keys):
+            return np.full(len(queries), -1, dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.keys, queries), len(self.keys) - 1)
+        return np.where(self.keys[positions] == queries, self.owners[positions], -1)
+
+# fingerprints of the evaluation treebanks
+class Index:
+    def __init__(self, paths, minhash=None, chunk_size=2000):
+        self.paths = list(paths)
+        self.minhash = minhash
+        files = []
+        numbers = []
+        self.sent_ids = []
+        keys = {kind: [] for kind in KINDS}
+        for (k, path) in enumerate(self.paths):
+            for (chunk_numbers, chunk_sent_ids, exact, variant, near) in iter_fingerprints(path, minhash, chunk_size):
+                files.append(np.full(len(chunk_numbers), k, dtype=np.int32))
+                numbers.append(chunk_numbers)
+                self.sent_ids.extend(chunk_sent_ids)
+                keys["exact"].append(exact)
+                keys["variant"].append(variant)
+                if near is not None:
+                    keys["near"].append(near)
+        # evaluation sentence p is sentence numbers[p] of paths[files[p]]
+        self.files = np.concatenate(files) if files else np.zeros(0, dtype=np.int32)
+        self.numbers = np.concatenate(numbers) if numbers else np.zeros(0, dtype=np.int64)
+        owners = np.arange(len(self.numbers), dtype=np.int64)
+        self.exact = SortedKeys(np.concatenate(keys["exact"]) if files else np.zeros(0, dtype=np.uint64), owners)
+        self.variant = SortedKeys(np.concatenate(keys["variant"]) if files else np.zeros(0, dtype=np.uint64), owners)
+        self.bands = []
+        if minhash is not None:
+            near = np.concatenate(keys["near"]) if files else np.zeros((0, minhash.bands), dtype=np.uint64)
+            self.bands = [SortedKeys(np.ascontiguousarray(near[:, j]), owners) for j in range(minhash.bands)]
+
+    def __len__(self):
+        return len(self.numbers)
+
+    # kind of overlap of each query sentence (index in KINDS, or -1) and the
+    # evaluation sentence it overlaps with (or -1)
+    def match(self, exact, variant, near=None):
+        kinds = np.full(len(exact), -1, dtype=np.int8)
+        matches = np.full(len(exact), -1, dtype=np.int64)
+        candidates = [(0, self.exact.lookup(exact)), (1, self.variant.lookup(variant))]
+        if near is not None:
+            candidates += [(2, band.lookup(np.ascontiguousarray(near[:, j]))) for (j, band) in enumerate(self.bands)]
+        # the strongest kind of overlap wins
+        for (kind, found) in candidates:
+            new = (kinds == -1) & (found >= 0)
+            kinds[new] = kind
+            matches[new] = found[new]
+        return (kinds, matches)
+
+# a row per overlap found, see check
+class Overlap:
+    __slots__ = ["number", "sent_id", "kind", "eval_path", "eval_number", "eval_sent_id"]
+
+    def __init__(self, number, sent_id, kind, eval_path, eval_number, eval_sent_id):
+        (self.number, self.sent_id, self.kind) = (number, sent_id, kind)
+        (self.eval_path, self.eval_number, self.eval_sent_id) = (eval_path, eval_number, eval_sent_id)
+
+# check a (training) treebank against an Index, streaming it. Returns
+# (number of sentences with forms, overlaps with the index, number of
+# sentences that repeat an earlier sentence of the treebank exactly)
+def check(path, index, chunk_size=2000):
+    n = 0
+    overlaps = []
+    own_keys = []
+    for (numbers, sent_ids, exact, variant, near) in iter_fingerprints(path, index.minhash, chunk_size):
+        n += len(numbers)
+        own_keys.append(exact)
+        (kinds, matches) = index.match(exact, variant, near)
+        for q in np.flatnonzero(kinds >= 0):
+            p = matches[q]
+            overlaps.append(Overlap(
+                int(numbers[q]), sent_ids[q], KINDS[kinds[q]],
+                index.paths[index.files[p]], int(index.numbers[p]), index.sent_ids[p]))
+    own_keys = np.concatenate(own_keys) if own_keys else np.zeros(0, dtype=np.uint64)
+    duplicates = len(own_keys) - len(np.unique(own_keys))
+    return (n, overlaps, duplicates)
+
+# copy a treebank to output without the given sentences (sentence numbers),
+# copying the raw sentences (see reader.copy_sentences)
+def drop(path, numbers, output):
+    dropped = set(numbers)
+    path = shards.resolve(path)
+    with open(output, "wb") as f:
+        if path.endswith((".mix", ".store")):
+            with store.open_treebank(path) as treebank:
+                selection = iter(treebank) if isinstance(treebank, store.Mix) else ((treebank, i) for i in range(len(treebank)))
+                reader.copy_sentences((pair for (k, pair) in enumerate(selection) if k not in dropped), f)
+        else:
+            treebank_index = reader.index(path)
+            reader.copy_sentences(((treebank_index, i) for i in range(len(treebank_index)) if i not in dropped), f)
+
+# output path of drop for a treebank: x-noleak.conllu for x.conllu, its shard
+# folder, x.mix or x.conllu.store
+def drop_path(path):
+    name = path.rstrip("/")
+    for ext in [".shards", ".store", ".mix", ".conllu"]:
+        if name.endswith(ext):
+            name = name[:-len(ext)]
+    return name + "-noleak.conllu"
@@ -0,0 +1,236 @@
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import os.path
+import subprocess
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from seapass import cache, shards
+from seapass.__main__ import COMMANDS
+
+# declarative pipeline runner (python -m seapass run). A pipeline is a JSON
+# file of named stages, each with
+#   - "command": a seapass command and its arguments (see seapass.__main__),
+#     or "argv": any other command line (e.g. UDPipe or MaChAmp)
+#   - "inputs" and "outputs": the files (or folders, e.g. shard folders) it
+#     reads and writes
+#   - optionally "foreach": {"name": [values...]}, which makes one stage per
+#     value, with {name} replaced by the value in the stage name, command,
+#     inputs and outputs (e.g. one corrupt stage per split)
+# Paths are relative to the folder of the pipeline file, where commands run.
+#
+# A stage depends on the stages whose outputs it reads. After a stage runs,
+# the content hashes of its inputs and outputs and its command are recorded
+# in <pipeline>.state.json; the next time it only runs again if its command
+# (parameters) or an input changed, or an output is missing or was changed
+# since. The script of a seapass command counts as an input, so editing e.g.
+# corrupt.py makes its stages stale. Stages that do not depend on each other
+# run in parallel (--jobs)
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def state_path(pipeline_path):
+    return os.path.splitext(pipeline_path)[0] + ".state.json"
+
+# expand the foreach stages of a pipeline: {name: stage}, with absolute paths
+def load(pipeline_path):
+    with open(pipeline_path) as f:
+        pipeline = json.load(f)
+    base = os.path.dirname(os.path.abspath(pipeline_path))
+    stages = {}
+    for (name, spec) in pipeline["stages"].items():
+        foreach = spec.get("foreach", {})
+        keys = list(foreach)
+        for values in itertools.product(*(foreach[key] for key in keys)):
+            bindings = dict(zip(keys, values))
+            def expand(value):
+                return value.format(**bindings) if bindings else value
+            stage_name = expand(name)
+            if stage_name in stages:
+                raise ValueError("duplicate stage {}".format(stage_name))
+            stage = {
+                "name": stage_name,
+                "inputs": [os.path.join(base, expand(path)) for path in spec.get("inputs", [])],
+                "outputs": [os.path.join(base, expand(path)) for path in spec.get("outputs", [])]}
+            if "command" in spec:
+                stage["command"] = [expand(arg) for arg in spec["command"]]
+                if stage["command"][0] not in COMMANDS:
+                    raise ValueError("stage {}: unknown command {}".format(stage_name, stage["command"][0]))
+                stage["inputs"].append(os.path.join(ROOT, COMMANDS[stage["command"][0]][0]))
+                stage["argv"] = [sys.executable, "-m", "seapass"] + stage["command"]
+            else:
+                stage["argv"] = [expand(arg) for arg in spec["argv"]]
+            stages[stage_name] = stage
+    return (base, stages)
+
+# names of the stages each stage depends on
+def dependencies(stages):
+    producers = {}
+    for stage in stages.values():
+        for path in stage["outputs"]:
+            producers[path] = stage["name"]
+    deps = {}
+    for stage in stages.values():
+        deps[stage["name"]] = set()
+        for path in stage["inputs"]:
+            # an input can be an output or inside an output folder
+            for (output, producer) in producers.items():
+                if path == output or path.startswith(output + os.sep):
+                    deps[stage["name"]].add(producer)
+        deps[stage["name"]].discard(stage["name"])
+    return deps
+
+# content hash of a file or folder (of all the files in it), None if missing
+def content_hash(path):
+    if os.path.isfile(path):
+        return cache.default.content_hash(path)
+    if not os.path.isdir(path):
+        return None
+    sha = hashlib.sha256()
+    for (directory, dirs, files) in os.walk(path):
+        dirs.sort()
+        for name in sorted(files):
+            file_path = os.path.join(directory, name)
+            sha.update(os.path.relpath(file_path, path).encode("utf-8"))
+            sha.update(cache.default.content_hash(file_path).encode("utf-8"))
+    return sha.hexdigest()
+
+def hashes(paths):
+    return {path: content_hash(path) for path in paths}
+
+# command line of a stage as recorded. The python executable is left out,
+# so that running from another environment does not make everything stale
+def recorded_argv(stage):
+    return stage["argv"][1:] if "command" in stage else stage["argv"]
+
+# why a stage has to run, or None if it is up to date
+def stale_reason(stage, record):
+    if record is None:
+        return "never run"
+    if record["argv"] != recorded_argv(stage):
+        return "parameters changed"
+    for (path, digest) in hashes(stage["inputs"]).items():
+        if digest is None:
+            return "missing input {}".format(path)
+        if record["inputs"].get(path) != digest:
+            return "input changed: {}".format(path)
+    for (path, digest) in hashes(stage["outputs"]).items():
+        if digest is None:
+            return "missing output {}".format(path)
+        if record["outputs"].get(path) != digest:
+            return "output changed: {}".format(path)
+    return None
+
+# the recorded state of a stage
+def record(stage):
+    return {
+        "argv": recorded_argv(stage),
+        "inputs": hashes(stage["inputs"]),
+        "outputs": hashes(stage["outputs"])}
+
+def run_stage(stage, base):
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([ROOT] + ([env["PYTHONPATH"]] if env.get("PYTHONPATH") else []))
+    start = time.perf_counter()
+    try:
+        returncode = subprocess.run(stage["argv"], cwd=base, env=env).returncode
+    except OSError as e:
+        print("{}: {}".format(stage["name"], e), file=sys.stderr)
+        returncode = 127
+    return (returncode, time.perf_counter() - start)
+
+# run the stages of a pipeline (only targets and what they depend on, if
+# given). Returns the names of the stages that failed
+def run(pipeline_path, targets=None, jobs=1, force=False, dry_run=False, log=sys.stderr):
+    (base, stages) = load(pipeline_path)
+    deps = dependencies(stages)
+    if targets:
+        unknown = [target for target in targets if target not in stages]
+        if unknown:
+            raise ValueError("unknown stages: {}".format(", ".join(unknown)))
+        selected = set()
+        todo = list(targets)
+        while todo:
+            name = todo.pop()
+            if name not in selected:
+                selected.add(name)
+                todo.extend(deps[name])
+        stages = {name: stage for (name, stage) in stages.items() if name in selected}
+    state_file = state_path(pipeline_path)
+    try:
+        with open(state_file) as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        state = {}
+
+    # stage name -> "done" (up to date), "ran" or "failed"
+    status = {}
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        while len(status) < len(stages):
+            n_status = len(status)
+            for (name, stage) in stages.items():
+                if name in status or name in running or not all(dep in status for dep in deps[name]):
+                    continue
+                if any(status[dep] == "failed" for dep in deps[name]):
+                    print("{}: skipped, a stage it depends on failed".format(name), file=log)
+                    status[name] = "failed"
+                    continue
+                upstream_ran = any(status[dep] == "ran" for dep in deps[name])
+                reason = "forced" if force else None
+                if reason is None and dry_run and upstream_ran:
+                    reason = "a stage it depends on would run"
+                if reason is None:
+                    reason = stale_reason(stage, state.get(name))
+                if reason is None:
+                    print("{}: up to date".format(name), file=log)
+                    status[name] = "done"
+                elif dry_run:
+                    print("{}: would run ({})".format(name, reason), file=log)
+                    status[name] = "ran"
+                else:
+                    print("{}: running ({})".format(name, reason), file=log)
+                    running[name] = pool.submit(run_stage, stage, base)
+            if not running:
+                if len(status) == n_status:
+                    raise ValueError("dependency cycle among stages {}".format(", ".join(sorted(set(stages) - set(status)))))
+                continue
+            (finished, _) = wait(running.values(), return_when=FIRST_COMPLETED)
+            for (name, future) in list(running.items()):
+                if future not in finished:
+                    continue
+                del running[name]
+                (returncode, elapsed) = future.result()
+                if returncode != 0:
+                    print("{}: FAILED (exit status {})".format(name, returncode), file=log)
+                    status[name] = "failed"
+                    state.pop(name, None)
+                    continue
+                missing = [path for path in stages[name]["outputs"] if not os.path.exists(path)]
+                if missing:
+                    print("{}: FAILED, outputs not written: {}".format(name, ", ".join(missing)), file=log)
+                    status[name] = "failed"
+                    state.pop(name, None)
+                    continue
+                print("{}: done in {:.1f}s".format(name, elapsed), file=log)
+                status[name] = "ran"
+                state[name] = record(stages[name])
+                shards.write_atomic(state_file, json.dumps(state, indent=1))
+    return [name for (name, result) in status.items() if result == "failed"]
+
+def main(argv):
+    parser = argparse.ArgumentParser(prog="python -m seapass run", description="run the stages of a pipeline whose inputs or parameters changed")
+    parser.add_argument("stages", nargs="*", help="stages to run, along with the stages they depend on (default: all)")
+    parser.add_argument("--pipeline", default="pipeline.json", help="pipeline file (default: pipeline.json)")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="maximum number of stages running at once (default: number of CPUs)")
+    parser.add_argument("--force", action="store_true", help="run the stages even if they are up to date")
+    parser.add_argument("--dry_run", action="store_true", help="only print what would run")
+    args = parser.parse_args(argv)
+    try:
+        failed = run(args.pipeline, args.stages, args.jobs, args.force, args.dry_run)
+    except ValueError as e:
+        parser.error(str(e))
+    return 1 if failed else 0
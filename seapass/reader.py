@@ -0,0 +1,348 @@
+import bisect
+import mmap as mmap_module
+import os.path
+import sys
+from array import array
+from conllu.models import SentenceList
+from conllu.parser import parse_comment_line, parse_token_and_metadata
+from seapass import cache as treebank_cache
+from seapass import instrument, shards, sidecar
+
+# fast columnar CoNLL-U reader. Instead of a dict per token (as conllu.parse
+# does), a treebank is stored column by column: interned strings for the text
+# columns, int arrays for ID and HEAD, and an offset array telling where each
+# sentence starts. conllu TokenLists are only built when a caller asks for
+# them
+
+COLUMNS = ["id", "form", "lemma", "upos", "xpos", "feats", "head", "deprel", "deps", "misc"]
+INT_COLUMNS = ["id", "head"]
+
+class Treebank:
+    # columns: names of the columns to keep (all of them by default), ID is
+    # always kept. metadata: True to keep all comments, False to drop them,
+    # or a collection of metadata keys (e.g. ["sent_id", "error_label"]) to
+    # keep only those
+    def __init__(self, columns=None, metadata=True):
+        self.columns = [c for c in COLUMNS if columns is None or c == "id" or c in columns]
+        self.data = {c: array("i") if c in INT_COLUMNS else [] for c in self.columns}
+        # token index -> raw ID, for multiword tokens and empty nodes (whose
+        # ID in the id column is -1)
+        self.special_ids = {}
+        # sentence i is made of tokens offsets[i] to offsets[i+1]
+        self.offsets = array("q", [0])
+        # raw comment lines of each sentence
+        self.comments = []
+        self.keep_metadata = metadata
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _keep_comment(self, line):
+        if self.keep_metadata is True:
+            return True
+        if not self.keep_metadata:
+            return False
+        return line[1:].split("=", 1)[0].strip() in self.keep_metadata
+
+    # add the sentences in an iterable of lines (str)
+    def add_lines(self, lines):
+        string_columns = [(COLUMNS.index(c), self.data[c]) for c in self.columns if c not in INT_COLUMNS]
+        ids = self.data["id"]
+        heads = self.data.get("head")
+        comments = []
+        in_sent = False
+        intern = sys.intern
+        for line in lines:
+            line = line.rstrip("\r\n")
+            if not line.strip():
+                if in_sent:
+                    self.offsets.append(len(ids))
+                    self.comments.append(comments)
+                comments = []
+                in_sent = False
+                continue
+            if line[0] == "#":
+                if self._keep_comment(line):
+                    comments.append(line)
+                continue
+            in_sent = True
+            cols = line.split("\t")
+            if cols[0].isdigit():
+                ids.append(int(cols[0]))
+            else:
+                self.special_ids[len(ids)] = cols[0]
+                ids.append(-1)
+            for (i, column) in string_columns:
+                column.append(intern(cols[i]))
+            if heads is not None:
+                heads.append(int(cols[6]) if cols[6].isdigit() else -1)
+        if in_sent:
+            self.offsets.append(len(ids))
+            self.comments.append(comments)
+
+    # number of tokens (multiword tokens and empty nodes included) of each
+    # sentence
+    def lengths(self):
+        return [self.offsets[i + 1] - self.offsets[i] for i in range(len(self))]
+
+    # values of a column for the i-th sentence (for the whole treebank if i
+    # is None)
+    def column(self, name, i=None):
+        if i is None:
+            return self.data[name]
+        return self.data[name][self.offsets[i]:self.offsets[i + 1]]
+
+    # metadata of the i-th sentence as a dict, as conllu would parse it
+    def metadata(self, i):
+        metadata = {}
+        for line in self.comments[i]:
+            for (key, value) in parse_comment_line(line):
+                metadata[key] = value
+        return metadata
+
+    # value of a single metadata field of the i-th sentence
+    def meta(self, i, key, default=None):
+        return self.metadata(i).get(key, default)
+
+    def _token_line(self, k):
+        cols = []
+        for c in COLUMNS:
+            if c == "id":
+                cols.append(self.special_ids.get(k) or str(self.data["id"][k]))
+            elif c == "head":
+                cols.append(str(self.data["head"][k]) if self.data["head"][k] >= 0 else "_")
+            else:
+                cols.append(self.data[c][k])
+        return "\t".join(cols)
+
+    # CoNLL-U block of the i-th sentence. start and end restrict it to a
+    # range of its tokens, metadata=False leaves the comments out. Only
+    # available if all columns were read
+    def serialize(self, i, start=None, end=None, metadata=True):
+        if len(self.columns) < len(COLUMNS):
+            raise ValueError("can't serialize a treebank read with column projection")
+        offset = self.offsets[i]
+        start = offset if start is None else offset + start
+        end = self.offsets[i + 1] if end is None else offset + end
+        lines = self.comments[i] if metadata else []
+        lines = lines + [self._token_line(k) for k in range(start, end)]
+        return "\n".join(lines) + "\n\n"
+
+    # the i-th sentence as a conllu TokenList
+    def to_tokenlist(self, i):
+        return parse_token_and_metadata(self.serialize(i))
+
+    def to_tokenlists(self):
+        return [self.to_tokenlist(i) for i in range(len(self))]
+
+# lines of a file, optionally through mmap so that the file content is not
+# copied in memory
+def read_lines(path, mmap=False):
+    if not mmap:
+        with open(path, encoding="utf-8") as f:
+            yield from f
+        return
+    with open(path, "rb") as f:
+        with mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_READ) as mm:
+            for line in iter(mm.readline, b""):
+                yield line.decode("utf-8")
+
+# read a .conllu file into a columnar Treebank. See Treebank for columns and
+# metadata. Goes through the on-disk cache (see seapass.cache) unless
+# cache=False
+def read(path, columns=None, metadata=True, mmap=False, cache=True):
+    def build():
+        with instrument.timer("reader.parse"):
+            treebank = Treebank(columns, metadata)
+            treebank.add_lines(read_lines(path, mmap))
+        return treebank
+    if not cache:
+        return build()
+    return treebank_cache.default.load(path, "Treebank", read_options(columns, metadata), build)
+
+# normalized read options, as used in cache keys
+def read_options(columns, metadata):
+    return (
+        None if columns is None else tuple(sorted(columns)),
+        metadata if isinstance(metadata, bool) else tuple(sorted(metadata)))
+
+# read a .conllu file into a conllu SentenceList of TokenLists, as
+# conllu.parse(f.read()) would
+def read_tokenlists(path, mmap=False, cache=True):
+    return SentenceList(read(path, mmap=mmap, cache=cache).to_tokenlists())
+
+# stream a .conllu file as a sequence of Treebanks of (at most) size
+# sentences each, so that memory use depends on size and not on the length of
+# the file. If the whole treebank is already in the cache (see read), it is
+# yielded as a single chunk instead
+def iter_chunks(path, size, columns=None, metadata=True, mmap=False):
+    treebank = treebank_cache.default.get(path, "Treebank", read_options(columns, metadata))
+    if treebank is not None:
+        yield treebank
+        return
+    lines = []
+    n = 0
+    for block in iter_blocks(read_lines(path, mmap)):
+        lines.extend(block.splitlines())
+        lines.append("")
+        n += 1
+        if n == size:
+            with instrument.timer("reader.parse"):
+                treebank = Treebank(columns, metadata)
+                treebank.add_lines(lines)
+            yield treebank
+            lines = []
+            n = 0
+    if lines:
+        with instrument.timer("reader.parse"):
+            treebank = Treebank(columns, metadata)
+            treebank.add_lines(lines)
+        yield treebank
+
+# raw CoNLL-U blocks of a .conllu file, as iter_blocks. If the treebank is
+# already in the cache they are serialized from there, otherwise they are
+# streamed from the file (without caching it, so that memory use does not
+# grow with the size of the treebank). Either way the blocks are the same
+# text, with "\n" line endings and ending with a single newline, since
+# corrupt.py --sharded hashes them
+def iter_cached_blocks(path):
+    treebank = treebank_cache.default.get(path, "Treebank", read_options(None, True))
+    if treebank is not None:
+        for i in range(len(treebank)):
+            yield treebank.serialize(i)[:-1]
+        return
+    # read_lines decodes UTF-8 whatever the locale, with universal newlines
+    yield from iter_blocks(read_lines(path))
+
+# lazily read a .conllu file one sentence at a time, without parsing it.
+# Yields the raw CoNLL-U block of each sentence (comments included)
+def iter_blocks(infile):
+    lines = []
+    for line in infile:
+        if line.strip():
+            lines.append(line)
+        elif lines:
+            yield "".join(lines)
+            lines = []
+    if lines:
+        yield "".join(lines)
+
+# byte-offset index of a .conllu file, built with a single scan and without
+# parsing the sentences: for each sentence its byte range in the file (the
+# comment and token lines, not the blank line after them), its number of
+# token lines and the values of the given metadata fields (None if missing)
+class OffsetIndex:
+    @instrument.timed("reader.index")
+    def __init__(self, path, metadata=("sent_id",)):
+        self.path = os.path.abspath(path)
+        self.starts = array("q")
+        self.ends = array("q")
+        self.lengths = array("i")
+        self.metadata = {key: [] for key in metadata}
+        prefixes = [("# {} = ".format(key).encode("utf-8"), key) for key in metadata]
+        with open(path, "rb") as f:
+            pos = 0
+            start, length, values = None, 0, {}
+            for line in f:
+                if line.strip():
+                    if start is None:
+                        start = pos
+                    if line[:1] == b"#":
+                        for (prefix, key) in prefixes:
+                            if line.startswith(prefix):
+                                values[key] = line[len(prefix):].strip().decode("utf-8")
+                    else:
+                        length += 1
+                elif start is not None:
+                    self._add(start, pos, length, values)
+                    start, length, values = None, 0, {}
+                pos += len(line)
+            if start is not None:
+                # last sentence not followed by a blank line, maybe not even
+                # by a newline
+                self._add(start, pos, length, values)
+
+    # from precomputed columns (e.g. a sidecar, see seapass.sidecar) instead
+    # of scanning the file
+    @classmethod
+    def from_columns(cls, path, starts, ends, lengths, metadata):
+        index = cls.__new__(cls)
+        index.path = os.path.abspath(path)
+        index.starts = array("q", starts)
+        index.ends = array("q", ends)
+        index.lengths = array("i", lengths)
+        index.metadata = {key: list(values) for (key, values) in metadata.items()}
+        return index
+
+    def _add(self, start, end, length, values):
+        self.starts.append(start)
+        self.ends.append(end)
+        self.lengths.append(length)
+        for (key, column) in self.metadata.items():
+            column.append(values.get(key))
+
+    def __len__(self):
+        return len(self.starts)
+
+    # (file, start, end) of the bytes of a sentence
+    def locate(self, i):
+        return (self.path, self.starts[i], self.ends[i])
+
+# index of a sharded treebank (see seapass.shards), made of the OffsetIndexes
+# of its chunks. Has the same lengths, metadata and locate as an OffsetIndex
+# of the concatenated chunks
+class ShardedIndex:
+    def __init__(self, parts):
+        self.parts = parts
+        # number of the first sentence of each part
+        self.firsts = array("q")
+        self.lengths = array("i")
+        self.metadata = {key: [] for key in (parts[0].metadata if parts else [])}
+        for part in parts:
+            self.firsts.append(len(self.lengths))
+            self.lengths.extend(part.lengths)
+            for (key, column) in self.metadata.items():
+                column.extend(part.metadata[key])
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def locate(self, i):
+        k = bisect.bisect_right(self.firsts, i) - 1
+        return self.parts[k].locate(i - self.firsts[k])
+
+# OffsetIndex of a .conllu file, from its sidecar if it has an up-to-date one
+# with the requested metadata, otherwise through the on-disk cache unless
+# cache=False. For a shard directory, the ShardedIndex of its chunks
+def index(path, metadata=("sent_id",), cache=True):
+    if shards.is_sharded(path):
+        return ShardedIndex([index(chunk, metadata, cache) for chunk in shards.chunk_paths(path)])
+    if all(key in sidecar.META_KEYS for key in metadata):
+        columns = sidecar.load(path)
+        if columns is not None:
+            return OffsetIndex.from_columns(
+                path, columns["start"], columns["end"], columns["tokens"], {key: columns[key] for key in metadata})
+    if not cache:
+        return OffsetIndex(path, metadata)
+    return treebank_cache.default.load(path, "OffsetIndex", tuple(metadata), lambda: OffsetIndex(path, metadata))
+
+# write the sentences in selection, a sequence of (OffsetIndex or
+# ShardedIndex, sentence number) pairs, to outfile (opened in binary mode) by
+# copying their raw bytes from the indexed files, each followed by a blank
+# line
+@instrument.timed("reader.copy_sentences")
+def copy_sentences(selection, outfile):
+    sources = {}
+    try:
+        for (index, i) in selection:
+            (path, start, end) = index.locate(i)
+            if path not in sources:
+                f = open(path, "rb")
+                sources[path] = (f, mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_READ))
+            block = sources[path][1][start:end]
+            outfile.write(block if block.endswith(b"\n") else block + b"\n")
+            outfile.write(b"\n")
+    finally:
+        for (f, mm) in sources.values():
+            mm.close()
+            f.close()
@@ -0,0 +1,68 @@
+import hashlib
+import json
+import os
+import os.path
+
+# sharded treebanks: a directory of chunk files (chunk-00000.conllu, ...)
+# plus a manifest.json describing them, written by corrupt.py --sharded so
+# that long runs can be resumed chunk by chunk. The manifest records the
+# input treebank and the options of the run, and for each finished chunk its
+# file, the number of its first sentence in the input, how many input
+# sentences it covers and the content hash of their raw CoNLL-U, so that a
+# resumed run only redoes the chunks whose input changed. Chunks are in input
+# order: concatenated, they are the same treebank a non-sharded run writes.
+#
+# The sharded version of <name>.conllu lives in <name>.conllu.shards/ (see
+# directory), and reader.index accepts either
+
+MANIFEST = "manifest.json"
+
+# shard directory of a treebank path
+def directory(path):
+    return path + ".shards"
+
+def is_sharded(path):
+    return os.path.isfile(os.path.join(path, MANIFEST))
+
+# the treebank itself if it exists, otherwise its shard directory if there is
+# one (e.g. a corrupted treebank only written as shards)
+def resolve(path):
+    if not os.path.exists(path) and is_sharded(directory(path)):
+        return directory(path)
+    return path
+
+def chunk_name(k):
+    return "chunk-{:05d}.conllu".format(k)
+
+def content_hash(blocks):
+    sha = hashlib.sha256()
+    for block in blocks:
+        sha.update(block.encode("utf-8"))
+    return sha.hexdigest()
+
+# manifest of a shard directory, None if there is none (or it is unreadable)
+def read_manifest(shard_dir):
+    try:
+        with open(os.path.join(shard_dir, MANIFEST)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# write a file atomically, so that an interrupted run never leaves half of it
+def write_atomic(path, text):
+    tmp_path = "{}.{}.tmp".format(path, os.getpid())
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+def write_manifest(shard_dir, manifest):
+    write_atomic(os.path.join(shard_dir, MANIFEST), json.dumps(manifest, indent=1))
+
+# paths of the chunk files of a finished sharded treebank, in order
+def chunk_paths(shard_dir):
+    manifest = read_manifest(shard_dir)
+    if manifest is None:
+        raise ValueError("{} is not a sharded treebank".format(shard_dir))
+    if not manifest["complete"]:
+        raise ValueError("{} is incomplete, resume the run that writes it first".format(shard_dir))
+    return [os.path.join(shard_dir, chunk["file"]) for chunk in manifest["chunks"]]
@@ -0,0 +1,93 @@
+import os
+import os.path
+
+# sentence-metadata sidecars: a TSV next to a treebank (<treebank>.meta.tsv)
+# with one row per sentence: its sent_id, the byte range of its lines in the
+# treebank (as in reader.OffsetIndex), its number of token lines, the number
+# of token lines of the sentence it was made from (source_tokens, e.g. the
+# uncorrupted sentence), its error_label and its variant_id. corrupt.py
+# writes one as it writes its output, so that length checks, filtering and
+# mixing can work on it without reading the treebank (see reader.index).
+#
+# The first line records the size and mtime of the treebank when the sidecar
+# was written: a sidecar that does not match its treebank any more is
+# ignored. Missing values are empty
+
+COLUMNS = ["sent_id", "start", "end", "tokens", "source_tokens", "error_label", "variant_id"]
+INT_COLUMNS = ["start", "end", "tokens", "source_tokens"]
+META_KEYS = ["sent_id", "error_label", "variant_id"]
+
+def path(treebank_path):
+    return treebank_path + ".meta.tsv"
+
+# number of token lines and metadata values (only META_KEYS) of a serialized
+# sentence
+def describe(block):
+    tokens = 0
+    values = {}
+    for line in block.split("\n"):
+        if line.startswith("#"):
+            (key, sep, value) = line[1:].partition("=")
+            if sep and key.strip() in META_KEYS:
+                values[key.strip()] = value.strip()
+        elif line.strip():
+            tokens += 1
+    return (tokens, values)
+
+# writes the sidecar of a treebank while the treebank itself is being written:
+# add() each serialized sentence in the order it is written, then close()
+# once the treebank is complete (and closed)
+class Writer:
+    def __init__(self, treebank_path):
+        self.treebank_path = treebank_path
+        self.tmp_path = "{}.{}.tmp".format(path(treebank_path), os.getpid())
+        self.f = open(self.tmp_path, "w", encoding="utf-8")
+        self.pos = 0
+
+    # block is the serialized sentence as written (blank line after it
+    # included), source_block the sentence it was made from, if any
+    def add(self, block, source_block=None):
+        size = len(block.encode("utf-8"))
+        content = block.rstrip("\n")
+        (tokens, values) = describe(content)
+        start = self.pos + (len(block) - len(block.lstrip("\n")))
+        end = start + len(content.lstrip("\n").encode("utf-8")) + 1
+        source_tokens = describe(source_block)[0] if source_block is not None else ""
+        row = [values.get("sent_id", ""), start, end, tokens, source_tokens, values.get("error_label", ""), values.get("variant_id", "")]
+        self.f.write("\t".join(str(value) for value in row) + "\n")
+        self.pos += size
+
+    def close(self):
+        self.f.close()
+        stat = os.stat(self.treebank_path)
+        with open(self.tmp_path, encoding="utf-8") as rows, open(self.tmp_path + "2", "w", encoding="utf-8") as out:
+            out.write("# size = {}\tmtime_ns = {}\n".format(stat.st_size, stat.st_mtime_ns))
+            out.write("\t".join(COLUMNS) + "\n")
+            for line in rows:
+                out.write(line)
+        os.remove(self.tmp_path)
+        os.replace(self.tmp_path + "2", path(self.treebank_path))
+
+# columns of the sidecar of a treebank as a dict of lists (ints for
+# INT_COLUMNS, None for missing values), or None if there is no sidecar or it
+# does not match the treebank
+def load(treebank_path):
+    try:
+        f = open(path(treebank_path), encoding="utf-8")
+    except OSError:
+        return None
+    with f:
+        header = f.readline()
+        stat = os.stat(treebank_path)
+        if header.strip() != "# size = {}\tmtime_ns = {}".format(stat.st_size, stat.st_mtime_ns):
+            return None
+        names = f.readline().rstrip("\n").split("\t")
+        columns = {name: [] for name in names}
+        for line in f:
+            for (name, value) in zip(names, line.rstrip("\n").split("\t")):
+                if value == "":
+                    value = None
+                elif name in INT_COLUMNS:
+                    value = int(value)
+                columns[name].append(value)
+    return columns
@@ -0,0 +1,290 @@
+import json
+import mmap as mmap_module
+import os
+import os.path
+import struct
+from array import array
+from conllu.parser import parse_token_and_metadata
+from seapass import instrument, reader
+
+# binary treebank stores: a treebank in a single file meant to be memory-
+# mapped, with O(1) random access to its sentences. A store holds
+#   - the raw CoNLL-U of each sentence (comments included, blank lines
+#     excluded), back to back
+#   - a sentence offset table: where each sentence starts in the raw text and
+#     in the token columns
+#   - fixed-width numeric token columns: id and head as int32 (-1 for
+#     multiword tokens/empty nodes and for "_"), upos and deprel as uint16
+#     codes into string tables
+# Sentences and columns are served as memoryviews of the mapped file, so
+# nothing is copied or parsed until a caller asks for it (see Store).
+#
+# Mixes (see mix_treebanks.py --store) are index lists over stores: for each
+# sentence of the mix, the store it comes from and its number there, so that
+# several mixes of the same treebanks share a single copy of the sentences.
+# export (or export_mix.py) writes a store or a mix as plain CoNLL-U, e.g. for
+# MaChAmp, byte for byte what mix_treebanks.py writes without --store.
+#
+# File layout: a 24 bytes preamble (magic, offset and length of the header),
+# the sections (each aligned to 8 bytes), and a JSON header at the end that
+# describes the sections. The store of <name>.conllu is <name>.conllu.store
+# (see path), and records the size and mtime of the files it was built from,
+# so that a stale store is rebuilt (see ensure)
+
+STORE_MAGIC = b"SEAPSTR1"
+MIX_MAGIC = b"SEAPMIX1"
+PREAMBLE = struct.Struct("<8sqq")
+CODED_COLUMNS = ["upos", "deprel"]
+
+# store path of a treebank
+def path(treebank_path):
+    return treebank_path + ".store"
+
+# write an array as a section of f, aligned to 8 bytes. Returns its
+# description for the header
+def _write_section(f, values):
+    f.write(b"\0" * (-f.tell() % 8))
+    offset = f.tell()
+    values.tofile(f)
+    return {"offset": offset, "typecode": values.typecode, "length": len(values)}
+
+# write the JSON header at the end of f and the preamble pointing to it
+def _finish(f, magic, header):
+    data = json.dumps(header).encode("utf-8")
+    offset = f.tell()
+    f.write(data)
+    f.seek(0)
+    f.write(PREAMBLE.pack(magic, offset, len(data)))
+
+# memory-map a file written with _finish: (file, mmap, header, sections as
+# typed memoryviews)
+def _open(file_path, magic):
+    f = open(file_path, "rb")
+    try:
+        mm = mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_READ)
+    except ValueError:
+        f.close()
+        raise ValueError("{} is not a {} file".format(file_path, magic.decode()))
+    (file_magic, offset, length) = PREAMBLE.unpack_from(mm)
+    if file_magic != magic:
+        mm.close()
+        f.close()
+        raise ValueError("{} is not a {} file".format(file_path, magic.decode()))
+    header = json.loads(mm[offset:offset + length])
+    buffer = memoryview(mm)
+    sections = {}
+    for (name, section) in header["sections"].items():
+        size = array(section["typecode"]).itemsize * section["length"]
+        sections[name] = buffer[section["offset"]:section["offset"] + size].cast(section["typecode"])
+    return (f, mm, buffer, header, sections)
+
+# size and mtime of the files an index reads from (see seapass.reader), to
+# tell whether a store built from them is still up to date
+def _fingerprint(index):
+    parts = index.parts if hasattr(index, "parts") else [index]
+    fingerprint = []
+    for part in parts:
+        stat = os.stat(part.path)
+        fingerprint.append([part.path, stat.st_size, stat.st_mtime_ns])
+    return fingerprint
+
+# build the store of a treebank at store_path from its index (an OffsetIndex
+# or ShardedIndex, see seapass.reader), copying each sentence from the
+# indexed files and parsing only its numeric columns
+@instrument.timed("store.build")
+def build(index, store_path):
+    offsets = array("q", [0])
+    text_offsets = array("q", [0])
+    columns = {"id": array("i"), "head": array("i"), "upos": array("H"), "deprel": array("H")}
+    tables = {name: {} for name in CODED_COLUMNS}
+    files = {}
+    tmp_path = "{}.{}.tmp".format(store_path, os.getpid())
+    try:
+        with open(tmp_path, "wb") as out:
+            out.write(b"\0" * PREAMBLE.size)
+            text_start = out.tell()
+            for i in range(len(index)):
+                (file_path, start, end) = index.locate(i)
+                if file_path not in files:
+                    f = open(file_path, "rb")
+                    files[file_path] = (f, mmap_module.mmap(f.fileno(), 0, access=mmap_module.ACCESS_READ))
+                block = files[file_path][1][start:end]
+                if not block.endswith(b"\n"):
+                    block += b"\n"
+                out.write(block)
+                text_offsets.append(out.tell() - text_start)
+                for line in block.decode("utf-8").split("\n"):
+                    if not line or line[0] == "#":
+                        continue
+                    cols = line.split("\t")
+                    columns["id"].append(int(cols[0]) if cols[0].isdigit() else -1)
+                    columns["head"].append(int(cols[6]) if cols[6].isdigit() else -1)
+                    for (name, k) in [("upos", 3), ("deprel", 7)]:
+                        columns[name].append(tables[name].setdefault(cols[k], len(tables[name])))
+                offsets.append(len(columns["id"]))
+            text_end = out.tell()
+            sections = {"offsets": _write_section(out, offsets), "text_offsets": _write_section(out, text_offsets)}
+            for (name, values) in columns.items():
+                sections[name] = _write_section(out, values)
+            _finish(out, STORE_MAGIC, {
+                "sentences": len(offsets) - 1,
+                "text": [text_start, text_end],
+                "sections": sections,
+                "tables": {name: list(table) for (name, table) in tables.items()},
+                "sources": _fingerprint(index)})
+        os.replace(tmp_path, store_path)
+    finally:
+        for (f, mm) in files.values():
+            mm.close()
+            f.close()
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+# the store of a treebank, built from its index if it is missing or older
+# than the treebank. Returns its path
+def ensure(treebank_path, index):
+    store_path = path(treebank_path)
+    try:
+        with Store(store_path) as store:
+            if store.header["sources"] == _fingerprint(index):
+                return store_path
+    except (OSError, ValueError):
+        pass
+    build(index, store_path)
+    return store_path
+
+# a memory-mapped store. store[i] is the raw CoNLL-U of the i-th sentence (a
+# memoryview, without the blank line after it), column(name, i) its values of
+# a numeric column, and locate(i) its byte range in the store, so that
+# reader.copy_sentences takes a Store as it takes an OffsetIndex. Views are
+# only valid until the store is closed
+class Store:
+    def __init__(self, store_path):
+        self.path = os.path.abspath(store_path)
+        (self._file, self._mmap, self._buffer, self.header, self._sections) = _open(store_path, STORE_MAGIC)
+        (self._text_start, _) = self.header["text"]
+        self.offsets = self._sections["offsets"]
+        self.text_offsets = self._sections["text_offsets"]
+        self.tables = self.header["tables"]
+
+    def __len__(self):
+        return self.header["sentences"]
+
+    def __getitem__(self, i):
+        if not -len(self) <= i < len(self):
+            raise IndexError("sentence {} out of range".format(i))
+        i %= len(self)
+        return self._buffer[self._text_start + self.text_offsets[i]:self._text_start + self.text_offsets[i + 1]]
+
+    def locate(self, i):
+        return (self.path, self._text_start + self.text_offsets[i], self._text_start + self.text_offsets[i + 1])
+
+    # number of tokens (multiword tokens and empty nodes included) of the
+    # i-th sentence
+    def length(self, i):
+        return self.offsets[i + 1] - self.offsets[i]
+
+    # values of a numeric column (id, head, upos or deprel) for the i-th
+    # sentence, or for the whole store if i is None. upos and deprel are
+    # codes, see decode
+    def column(self, name, i=None):
+        if i is None:
+            return self._sections[name]
+        return self._sections[name][self.offsets[i]:self.offsets[i + 1]]
+
+    # strings of the codes of a coded column
+    def decode(self, name, codes):
+        table = self.tables[name]
+        return [table[code] for code in codes]
+
+    # the i-th sentence as a conllu TokenList
+    def to_tokenlist(self, i):
+        return parse_token_and_metadata(bytes(self[i]).decode("utf-8"))
+
+    def close(self):
+        for view in list(self._sections.values()) + [self._buffer]:
+            view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# write a mix as an index list: selection is a sequence of (store path,
+# sentence number) pairs. Store paths are recorded relative to the mix
+@instrument.timed("store.write_mix")
+def write_mix(selection, mix_path):
+    stores = {}
+    store_numbers = array("i")
+    sentences = array("q")
+    for (store_path, i) in selection:
+        store_numbers.append(stores.setdefault(store_path, len(stores)))
+        sentences.append(i)
+    directory = os.path.dirname(os.path.abspath(mix_path))
+    tmp_path = "{}.{}.tmp".format(mix_path, os.getpid())
+    with open(tmp_path, "wb") as out:
+        out.write(b"\0" * PREAMBLE.size)
+        sections = {"stores": _write_section(out, store_numbers), "sentences": _write_section(out, sentences)}
+        _finish(out, MIX_MAGIC, {
+            "sentences": len(sentences),
+            "stores": [os.path.relpath(os.path.abspath(store_path), directory) for store_path in stores],
+            "sections": sections})
+    os.replace(tmp_path, mix_path)
+
+# a mix written by write_mix, over the stores it refers to. Iterating over it
+# yields (Store, sentence number) pairs, as reader.copy_sentences takes them,
+# and mix[k] is the raw CoNLL-U of its k-th sentence
+class Mix:
+    def __init__(self, mix_path):
+        (self._file, self._mmap, self._buffer, self.header, sections) = _open(mix_path, MIX_MAGIC)
+        self._sections = sections
+        directory = os.path.dirname(os.path.abspath(mix_path))
+        self.stores = [Store(os.path.join(directory, store_path)) for store_path in self.header["stores"]]
+        self.store_numbers = sections["stores"]
+        self.sentences = sections["sentences"]
+
+    def __len__(self):
+        return self.header["sentences"]
+
+    def __iter__(self):
+        for (k, i) in zip(self.store_numbers, self.sentences):
+            yield (self.stores[k], i)
+
+    def __getitem__(self, k):
+        return self.stores[self.store_numbers[k]][self.sentences[k]]
+
+    def close(self):
+        for store in self.stores:
+            store.close()
+        for view in list(self._sections.values()) + [self._buffer]:
+            view.release()
+        self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# a store or mix file, opened as a Store or Mix
+def open_treebank(file_path):
+    with open(file_path, "rb") as f:
+        magic = f.read(len(MIX_MAGIC))
+    return Mix(file_path) if magic == MIX_MAGIC else Store(file_path)
+
+# write a store or mix (opened or as a path) as plain CoNLL-U, each sentence
+# followed by a blank line
+@instrument.timed("store.export")
+def export(treebank, conllu_path):
+    opened = open_treebank(treebank) if isinstance(treebank, str) else treebank
+    try:
+        selection = iter(opened) if isinstance(opened, Mix) else ((opened, i) for i in range(len(opened)))
+        with open(conllu_path, "wb") as f:
+            reader.copy_sentences(selection, f)
+    finally:
+        if opened is not treebank:
+            opened.close()
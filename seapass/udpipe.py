@@ -0,0 +1,185 @@
+import asyncio
+import hashlib
+import json
+import urllib.error
+import urllib.parse
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from seapass import cache, instrument
+
+# asyncio client for the UDPipe 2 REST API
+# (https://lindat.mff.cuni.cz/services/udpipe/api-reference.php), used to
+# parse the corrected SweLL sentences (see swell_scripts/parse.py).
+# Sentences are already tokenized (tokens separated by spaces, one sentence
+# per request line), so they are sent as "horizontal" input and come back as
+# exactly one CoNLL-U sentence each. They are sent in batches bounded both in
+# number of sentences and in characters, with at most concurrency requests in
+# flight; failed requests (connection errors, timeouts, 429 and 5xx
+# responses) are retried with exponential backoff. Results are put back in
+# input order.
+#
+# Parsed sentences are kept in a content-addressed cache (see ParseCache), so
+# that a sentence is never sent twice with the same model and options
+
+DEFAULT_URL = "https://lindat.mff.cuni.cz/services/udpipe/api"
+DEFAULT_MODEL = "swedish-talbanken-ud-2.12-230717"
+
+class UDPipeError(Exception):
+    pass
+
+# cache of parsed sentences, as entries of the seapass cache (see
+# seapass.cache), so that --no_cache, --clear_cache and the size limit apply
+# to them too: one entry per sentence, keyed by the hash of the model, the
+# options and the sentence itself. Entries are the CoNLL-U of the sentence
+# without its sent_id, which depends on where the sentence is
+class ParseCache:
+    def __init__(self, store=None):
+        self.store = store if store is not None else cache.default
+        self.hits = 0
+
+    @staticmethod
+    def key(model, options, sentence):
+        return hashlib.sha256(json.dumps(["udpipe", model, options, sentence]).encode("utf-8")).hexdigest()
+
+    def get(self, key):
+        block = self.store.get_key(key)
+        if block is not None:
+            self.hits += 1
+        return block
+
+    # store the blocks of a batch. Old entries are not evicted, which means
+    # listing the whole cache, until evict is called at the end of a run
+    def put_all(self, items):
+        if not self.store.enabled:
+            return
+        for (key, block) in items:
+            self.store.put(key, block, evict=False)
+
+    def evict(self):
+        if self.store.enabled:
+            self.store.evict()
+
+# split a stream of (index, sentence) pairs into batches of at most
+# max_sentences sentences and max_chars characters (a longer sentence gets a
+# batch of its own)
+def batches(sentences, max_sentences=100, max_chars=20000):
+    batch = []
+    chars = 0
+    for (i, sentence) in sentences:
+        if batch and (len(batch) == max_sentences or chars + len(sentence) > max_chars):
+            yield batch
+            batch = []
+            chars = 0
+        batch.append((i, sentence))
+        chars += len(sentence) + 1
+    if batch:
+        yield batch
+
+# CoNLL-U of each sentence of a UDPipe result, without the comments that
+# depend on the request (newdoc, newpar, sent_id)
+def split_result(result):
+    blocks = []
+    for block in result.split("\n\n"):
+        lines = [line for line in block.split("\n") if line.strip()]
+        lines = [line for line in lines if not line.startswith(("# newdoc", "# newpar", "# sent_id"))]
+        if any(not line.startswith("#") for line in lines):
+            blocks.append("\n".join(lines) + "\n")
+    return blocks
+
+# the CoNLL-U of a sentence, with its sent_id (first comment line)
+def with_sent_id(block, sent_id):
+    return "# sent_id = {}\n{}\n".format(sent_id, block)
+
+class Client:
+    # options are extra fields of the request (tagger, parser...), retries
+    # the number of attempts after the first one for each batch
+    def __init__(self, url=DEFAULT_URL, model=DEFAULT_MODEL, options=None, concurrency=4, retries=3, timeout=60, backoff=1.0, parse_cache=None):
+        self.url = url.rstrip("/")
+        self.model = model
+        self.options = options if options is not None else {"tagger": "", "parser": ""}
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.cache = parse_cache if parse_cache is not None else ParseCache()
+        # urllib is blocking, requests run in a thread each
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._semaphore = None
+
+    def _post(self, sentences):
+        fields = dict(self.options, model=self.model, input="horizontal", data="\n".join(sentences) + "\n")
+        request = urllib.request.Request(self.url + "/process", data=urllib.parse.urlencode(fields).encode("utf-8"))
+        with urllib.request.urlopen(request, timeout=self.timeout) as response:
+            return json.loads(response.read().decode("utf-8"))["result"]
+
+    # CoNLL-U blocks of a batch of sentences, retrying failed requests
+    async def _request(self, sentences):
+        loop = asyncio.get_running_loop()
+        for attempt in range(self.retries + 1):
+            try:
+                async with self._semaphore:
+                    with instrument.timer("udpipe.request"):
+                        result = await loop.run_in_executor(self._executor, self._post, sentences)
+                blocks = split_result(result)
+                if len(blocks) != len(sentences):
+                    raise UDPipeError("sent {} sentences, got {} back".format(len(sentences), len(blocks)))
+                return blocks
+            except urllib.error.HTTPError as e:
+                # client errors (e.g. an unknown model) won't go away
+                if e.code != 429 and e.code < 500:
+                    raise UDPipeError("{} {}: {}".format(e.code, e.reason, e.read().decode("utf-8", "replace").strip()))
+                error = e
+            except (urllib.error.URLError, OSError, ValueError, KeyError) as e:
+                error = e
+            if attempt < self.retries:
+                instrument.count("udpipe.retries")
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise UDPipeError("request failed after {} attempts: {}".format(self.retries + 1, error))
+
+    # CoNLL-U blocks (without sent_id) of a batch of (index, sentence) pairs,
+    # only sending the sentences that are not in the cache
+    async def parse_batch(self, batch):
+        keys = [ParseCache.key(self.model, self.options, sentence) for (_, sentence) in batch]
+        blocks = [self.cache.get(key) for key in keys]
+        missing = [k for (k, block) in enumerate(blocks) if block is None]
+        instrument.count("udpipe.cached sentences", len(batch) - len(missing))
+        if missing:
+            parsed = await self._request([batch[k][1] for k in missing])
+            for (k, block) in zip(missing, parsed):
+                blocks[k] = block
+            self.cache.put_all((keys[k], blocks[k]) for k in missing)
+        return blocks
+
+    # parse a stream of sentences, yielding their CoNLL-U blocks (without
+    # sent_id) in input order. At most 2 batches per concurrent request are
+    # read ahead, so that memory use does not depend on the number of
+    # sentences. The cache is evicted once, at the end
+    async def parse(self, sentences, max_sentences=100, max_chars=20000):
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        pending = deque()
+        try:
+            for batch in batches(enumerate(sentences), max_sentences, max_chars):
+                pending.append(asyncio.ensure_future(self.parse_batch(batch)))
+                if len(pending) >= 2 * self.concurrency:
+                    for block in await pending.popleft():
+                        yield block
+            while pending:
+                for block in await pending.popleft():
+                    yield block
+        finally:
+            for task in pending:
+                task.cancel()
+            self.cache.evict()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+# parse sentences and write them to outfile as CoNLL-U, numbered from 1 in
+# input order. Returns the number of sentences
+async def parse_to_file(client, sentences, outfile, max_sentences=100, max_chars=20000):
+    n = 0
+    async for block in client.parse(sentences, max_sentences, max_chars):
+        n += 1
+        outfile.write(with_sent_id(block, n))
+    return n
@@ -1,7 +1,12 @@
 import xml.etree.ElementTree as ET
-import pandas as pd
+import csv
+import json
 import os
 import argparse
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from seapass import instrument
 
 #######################################################################
 
@@ -21,6 +26,8 @@ placeholder_map = {  # baseline "pseudonymization"
     'hemland': 'Polen',
     'plats': 'Renströmsgatan'
     }
+
+placeholder_prefixes = ['A-', 'B-', 'C-', 'D-']  # placeholders look like A-stad, B-stad...
     
 #######################################################################
 
@@ -100,25 +107,62 @@ def pair_up(source_dict: dict, target_dict: dict):
                 paired_up.append((sent, target_dict[k][i][0], k, labels))
     return paired_up
 
-def replace_placeholders(sentence: list, placeholder_map: dict, essay_id: str):
-    '''A function that replaces anonymized tokens with some mapping, and removes the essay ID and newline from the essay.
+def load_placeholder_map(file: str):
+    '''A function that reads a placeholder map from a JSON file, so that surrogates can be changed without touching the code.
+    
+    Args:
+        file (str): Path to a JSON file with an object mapping placeholders (without the A-/B-/C-/D- prefix) to surrogates, e.g. {"stad": "Berlin"}.
+        
+    Returns:
+        A dictionary mapping possible placeholders to other tokens.
+    '''
+    with open(file, encoding='utf-8') as f:
+        return json.load(f)
+
+def placeholder_lookup(placeholder_map: dict):
+    '''A function that expands a placeholder map into a lookup table from placeholder tokens, prefix included, to surrogates.
+    
+    Args:
+        placeholder_map (dict): A dictionary mapping possible placeholders to other tokens.
+        
+    Returns:
+        A dictionary mapping placeholder tokens (e.g. A-stad) to surrogates.
+    '''
+    return {prefix + placeholder: surrogate for placeholder, surrogate in placeholder_map.items() for prefix in placeholder_prefixes}
+
+def replace_placeholders(sentence: list, placeholder_map: dict, essay_id: str, lookup: dict = None):
+    '''A function that replaces anonymized tokens with some mapping, and removes the essay ID and newline from the essay, in a single pass over the sentence.
     
     Args:
         sentence (list): A sentence represented as a list of tokens.
         placeholder_map (dict): A dictionary mapping possible placeholders to other tokens.
         essay_id (str): The ID of the essay the sentence is from.
+        lookup (dict): The placeholder_lookup of placeholder_map, to avoid recomputing it for every sentence.
         
     Returns:
-        A list tuples of (original sentence, target sentence, essay ID).
+        A new list of tokens.
     '''
-    for i, word in enumerate(sentence):
-        if 'A-' in word or 'B-' in word or 'C-' in word or 'D-' in word:
-            try:
-                sentence[i] = placeholder_map[word[2:]]
-            except KeyError:
-                continue
-        sentence = [word for word in sentence if '␤' not in word and essay_id not in word]
-    return sentence
+    if lookup is None:
+        lookup = placeholder_lookup(placeholder_map)
+    return [lookup.get(word, word) for word in sentence if '␤' not in word and essay_id not in word]
+
+def replace_all(paired_up, placeholder_map: dict):
+    '''A function that replaces the placeholder tokens of a batch of sentence pairs, building the lookup table only once.
+    
+    Args:
+        paired_up: (original sentence, target sentence, essay ID, correction labels) tuples, as from pair_up or iter_pairs.
+        placeholder_map (dict): A dictionary mapping possible placeholders to other tokens.
+        
+    Yields:
+        Tuples of (original sentence, target sentence, essay ID, correction labels) as strings.
+    '''
+    lookup = placeholder_lookup(placeholder_map)
+    for sent1, sent2, essay_id, labels in paired_up:
+        yield (
+            ' '.join(replace_placeholders(sent1, placeholder_map, essay_id, lookup)),
+            ' '.join(replace_placeholders(sent2, placeholder_map, essay_id, lookup)),
+            essay_id,
+            ",".join(labels))
 
 def create_df(paired_up, placeholder_map):
     '''A function that creates a DataFrame out of the paired up sentences and replaces the placeholder tokens with naive surrogates.
@@ -130,39 +174,149 @@ def create_df(paired_up, placeholder_map):
     Returns:
         A pandas DataFrame with the original sentence, target sentence, and essay ID with undesirable elements removed.
     '''
-    sentence_pairs = []
-    for pair in paired_up:
-        essay_id = pair[2]
-        labels = pair[3]
-        sent1 = ' '.join(replace_placeholders(pair[0], placeholder_map, essay_id))
-        sent2 = ' '.join(replace_placeholders(pair[1], placeholder_map, essay_id))
-        
-        sentence_pairs.append((sent1, sent2, essay_id, ",".join(labels)))
+    import pandas as pd
+
+    sentence_pairs = list(replace_all(paired_up, placeholder_map))
 
     df = pd.DataFrame(sentence_pairs)
     df.columns = ['Source sentence', 'Target sentence', 'Essay ID', 'Correction labels']
     df.set_index("Source sentence", inplace=True)
     return df
             
+def iter_essays(file: str):
+    '''A function that streams the essays of a SweLL xml file with iterparse, clearing elements as soon as they have been read.
+    
+    Elements are handled in the same (document) order as get_essays and get_sent_dict.
+    
+    Args:
+        file (str): Path and name of the file.
+        
+    Yields:
+        Tuples of (essay ID, list of (sentence, correction labels)), sentences being lists of tokens.
+    '''
+    essay_id = None
+    essay_sents = []
+    sent = []
+    sent_err_labels = []
+    slots = {}
+    root = None
+    for event, elem in ET.iterparse(file, events=('start', 'end')):
+        if root is None:
+            root = elem
+        if event == 'start':
+            if elem.tag == 'text':
+                essay_id = elem.attrib['essay_id']
+                essay_sents = []
+                sent = []
+                sent_err_labels = []
+            elif essay_id is None or elem.tag == 'link':
+                continue
+            elif elem.tag == 'sentence':
+                if len(sent) > 0:
+                    essay_sents.append((sent, sent_err_labels))
+                    sent = []
+                    sent_err_labels = []
+            else:
+                # the text is only guaranteed to be there at the end event,
+                # keep a slot for it to preserve document order
+                slots[elem] = (sent, len(sent))
+                sent.append(None)
+                if "correction_label" in elem.attrib:
+                    sent_err_labels.append(elem.attrib["correction_label"])
+        elif elem.tag == 'text':
+            essay_sents.append((sent, sent_err_labels))
+            instrument.count('extract.essays')
+            yield essay_id, essay_sents
+            essay_id = None
+            root.clear()
+        elif elem in slots:
+            # fill the slot with the text and let go of the element
+            (slot_sent, i) = slots.pop(elem)
+            slot_sent[i] = elem.text
+
+def align_essays(source_essays, target_essays):
+    '''A function that aligns two streams of essays on their essay ID, reading from both alternately.
+    
+    Essays are yielded as soon as both versions have been read, so if source and target are in the same order only one essay per side is kept in memory.
+    
+    Args:
+        source_essays: (essay ID, sentences) tuples for the source essays, e.g. from iter_essays.
+        target_essays: (essay ID, sentences) tuples for the target essays.
+        
+    Yields:
+        Tuples of (essay ID, source sentences, target sentences).
+    '''
+    iterators = [iter(source_essays), iter(target_essays)]
+    pending = [{}, {}]
+    active = [True, True]
+    while any(active):
+        for side in [0, 1]:
+            if not active[side]:
+                continue
+            try:
+                essay_id, sents = next(iterators[side])
+            except StopIteration:
+                active[side] = False
+                continue
+            other = 1 - side
+            if essay_id in pending[other]:
+                other_sents = pending[other].pop(essay_id)
+                if side == 0:
+                    yield essay_id, sents, other_sents
+                else:
+                    yield essay_id, other_sents, sents
+            else:
+                pending[side][essay_id] = sents
+
+def iter_pairs(aligned_essays):
+    '''A function that pairs up the sentences of aligned essays, as pair_up does.
+    
+    Args:
+        aligned_essays: (essay ID, source sentences, target sentences) tuples, e.g. from align_essays.
+        
+    Yields:
+        Tuples of (original sentence, target sentence, essay ID, correction labels).
+    '''
+    for essay_id, source_sents, target_sents in aligned_essays:
+        if len(source_sents) == len(target_sents):
+            instrument.count('extract.pairs', len(source_sents))
+            for (sent, labels), (target_sent, _) in zip(source_sents, target_sents):
+                yield sent, target_sent, essay_id, labels
+        else:
+            instrument.count('extract.essays with different numbers of sentences')
+
+def write_pairs(pairs, placeholder_map, filename: str):
+    '''A function that writes sentence pairs to a TSV file as they come, in the same format as create_df + DataFrame.to_csv.
+    
+    Args:
+        pairs: (original sentence, target sentence, essay ID, correction labels) tuples, e.g. from iter_pairs.
+        placeholder_map (dict): A dictionary mapping possible placeholders to other tokens.
+        filename (str): The name for the output file.
+    '''
+    with open(filename, 'w', newline='') as f:
+        writer = csv.writer(f, delimiter='\t', lineterminator='\n')
+        writer.writerow(['Source sentence', 'Target sentence', 'Essay ID', 'Correction labels'])
+        writer.writerows(replace_all(pairs, placeholder_map))
+            
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
 
     parser.add_argument('source', help='The path to the sourceSweLL.xml file')
     parser.add_argument('target', help='The path to the targetSweLL.xml file')
     parser.add_argument('--filename', required=False, default='aligned_sentences.tsv', help='The name for the output file.')
+    parser.add_argument('--placeholder_map', required=False, help='A JSON file mapping placeholders to surrogates, replacing the built-in map.')
+    instrument.add_arguments(parser)
     
     args = parser.parse_args()
-     
-    source_essays = get_essays(args.source)
-    target_essays = get_essays(args.target)
+    instrument.configure(args)
     
-    source_dict = get_sent_dict(source_essays)
-    target_dict = get_sent_dict(target_essays)
-
-    paired_up = pair_up(source_dict, target_dict)
+    if args.placeholder_map:
+        placeholder_map = load_placeholder_map(args.placeholder_map)
     
-    df = create_df(paired_up, placeholder_map)
+    # stream both files, pairing up essays as soon as both versions are read
+    aligned = align_essays(iter_essays(args.source), iter_essays(args.target))
     
-    # save as a TSV file
-    df.to_csv(args.filename, sep='\t')
-    
\ No newline at end of file
+    # save as a TSV file (reading, pairing and writing are interleaved, see
+    # --profile_dump for a finer breakdown)
+    with instrument.timer('extract.extract_and_write'):
+        write_pairs(iter_pairs(aligned), placeholder_map, args.filename)
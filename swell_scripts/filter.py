@@ -1,20 +1,106 @@
-from sklearn.model_selection import train_test_split
-import csv  
+import argparse
+import csv
+import os.path
 import sys
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from seapass import instrument, labels, lazy
+
+np = lazy.module("numpy")
+
 # usage python filter.py PATH-TO-OUTPUT-OF-EXTRACT-SENTENCE-PAIRS.tsv
-# the output is a file called filtered.tsv
+# by default the output is a file called data/filtered.tsv, with the sentence
+# pairs that only contain word order errors (and maybe capitalization
+# corrections).
+#
+# The correction labels of each pair are encoded once as a bitmask (see
+# seapass/labels.py) and any number of filters (--filter NAME=QUERY, each
+# writing <output_dir>/NAME.tsv) are evaluated on whole chunks of pairs at
+# once, streaming the input. Per-label counts of the input and of each output
+# are printed at the end
 
-if __name__ == "__main__":
-    tsv = sys.argv[1]
-    with open(tsv) as infile:
+# the default filter, as it has always been: pairs whose labels are all
+# S-Adv, S-FinV, S-WO or O-Cap, but not a single O-Cap. It looks at the label
+# list as written, which masks do not keep: repeated O-Cap corrections
+# ("O-Cap,O-Cap") pass and empty labels ("S-Adv,") do not. So it is WO_ONLY
+# on the masks, plus a check of the label strings for those two cases.
+# WO_QUERY is the closest query, which drops "O-Cap,O-Cap" and keeps "S-Adv,"
+WO_ONLY = "only(S-Adv, S-FinV, S-WO, O-Cap)"
+WO_QUERY = WO_ONLY + " & !exactly(O-Cap)"
+
+def word_order_only(masks, label_strings, wo_only):
+    strings = np.array(label_strings, dtype=str)
+    as_written = (strings != "O-Cap") & ~np.char.startswith(strings, ",") & ~np.char.endswith(strings, ",") \
+        & (np.char.find(strings, ",,") < 0)
+    return wo_only(masks) & as_written
+
+# rows of a pair TSV, in chunks of (at most) size rows, skipping the header
+def iter_chunks(path, size):
+    with open(path, newline="") as infile:
+        rows = csv.reader(infile, delimiter="\t")
         # ignore column names
-        full = list(csv.reader(infile, delimiter="\t"))[1:]
-    filtered = []
-    for [src,trg,essay_id,lables_str] in full:
-        labels = lables_str.split(",")
-        if labels and all([label in ["S-Adv", "S-FinV", "S-WO", "O-Cap"] and labels != ["O-Cap"] for label in labels]):
-            filtered.append([src,trg,essay_id,lables_str])
-    with open("data/filtered.tsv", "w") as out_file:
-        writer = csv.writer(out_file, delimiter="\t")
-        writer.writerows(filtered)
\ No newline at end of file
+        next(rows, None)
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+# "name=query" -> (name, query)
+def parse_filter(spec):
+    (name, sep, query) = spec.partition("=")
+    if not sep or not name:
+        raise argparse.ArgumentTypeError("filters are NAME=QUERY, got {!r}".format(spec))
+    return (name, query)
+
+def print_counts(names, counts, file=sys.stderr):
+    used = [label for label in counts[0] if any(count[label] for count in counts)]
+    width = max([len(label) for label in used] + [len("label")])
+    print("{:<{}} ".format("label", width) + " ".join("{:>10}".format(name) for name in names), file=file)
+    for label in used:
+        print("{:<{}} ".format(label, width) + " ".join("{:>10}".format(count[label]) for count in counts), file=file)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tsv", help="output of extract_sentence_pairs.py")
+    parser.add_argument("--filter", type=parse_filter, action="append", help="NAME=QUERY: write the pairs whose correction labels match QUERY to OUTPUT_DIR/NAME.tsv, e.g. 'finv=S-FinV & !O-Cap' (see seapass/labels.py for the syntax). Can be repeated (default: filtered, the pairs with only word order errors, and maybe capitalization corrections, selected on the label lists as written; filtered='" + WO_QUERY + "' is the same on masks, except for repeated O-Cap corrections and empty labels)")
+    parser.add_argument("--output_dir", default="data", help="folder of the output files")
+    parser.add_argument("--chunk_size", type=int, default=10000, help="number of pairs filtered at once")
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.configure(args)
+
+    index = labels.LabelIndex()
+    filters = args.filter or [("filtered", None)]
+    try:
+        queries = [labels.Query(query, index) if query is not None else None for (_, query) in filters]
+    except ValueError as e:
+        parser.error(str(e))
+    wo_only = labels.Query(WO_ONLY, index)
+    outfiles = [open(os.path.join(args.output_dir, name + ".tsv"), "w") for (name, _) in filters]
+    writers = [csv.writer(outfile, delimiter="\t") for outfile in outfiles]
+    counts = [dict.fromkeys(index.bits, 0) for _ in range(len(filters) + 1)]
+    def add_counts(k, masks):
+        for (label, count) in index.counts(masks).items():
+            counts[k][label] = counts[k].get(label, 0) + count
+    try:
+        for rows in iter_chunks(args.tsv, args.chunk_size):
+            with instrument.timer("filter.encode"):
+                masks = index.encode_all(row[3] for row in rows)
+            add_counts(0, masks)
+            for (k, (query, writer)) in enumerate(zip(queries, writers)):
+                with instrument.timer("filter.query"):
+                    if query is None:
+                        selected = word_order_only(masks, [row[3] for row in rows], wo_only).nonzero()[0]
+                    else:
+                        selected = query(masks).nonzero()[0]
+                add_counts(k + 1, masks[selected])
+                with instrument.timer("filter.write"):
+                    writer.writerows(rows[i] for i in selected)
+    finally:
+        for outfile in outfiles:
+            outfile.close()
+    print_counts(["input"] + [name for (name, _) in filters], [{label: count.get(label, 0) for label in index.bits} for count in counts])
@@ -0,0 +1,58 @@
+import argparse
+import asyncio
+import csv
+import os.path
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from seapass import cache, instrument, udpipe
+
+# parse the corrected (target) sentences of the output of filter.py with
+# UDPipe 2 (see seapass/udpipe.py), writing them as CoNLL-U in the same order.
+# The result is what then gets manually fixed into trg_gold.conllu for
+# transfer_annotation.py. To try it out locally, run udpipe_server.py and
+# pass --url http://127.0.0.1:8001
+
+# the sentences of a column of a sentence-pair TSV, streamed (the header of
+# extract_sentence_pairs.py output, if any, is skipped)
+def iter_column(path, column):
+    with open(path, newline="") as f:
+        for (n, row) in enumerate(csv.reader(f, delimiter="\t")):
+            if n == 0 and row and row[0] == "Source sentence":
+                continue
+            if row:
+                yield row[column]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("tsv", help="sentence pairs, e.g. data/filtered.tsv from filter.py")
+    parser.add_argument("--output", default="data/swell/trg.conllu", help="output .conllu file")
+    parser.add_argument("--column", type=int, default=1, help="column of the sentences to parse (0: original, 1: target)")
+    parser.add_argument("--org_txt", help="also write the sentences of the other column (the original ones, by default) to this file, one per line, as transfer_annotation.py reads them")
+    parser.add_argument("--url", default=udpipe.DEFAULT_URL, help="UDPipe REST API")
+    parser.add_argument("--model", default=udpipe.DEFAULT_MODEL, help="UDPipe model")
+    parser.add_argument("--batch_size", type=int, default=100, help="maximum number of sentences per request")
+    parser.add_argument("--max_chars", type=int, default=20000, help="maximum number of characters per request")
+    parser.add_argument("--concurrency", type=int, default=4, help="maximum number of requests in flight")
+    parser.add_argument("--retries", type=int, default=3, help="number of retries of a failed request")
+    parser.add_argument("--timeout", type=float, default=60, help="timeout of a request, in seconds")
+    cache.add_arguments(parser)
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    cache.configure(args)
+    instrument.configure(args)
+
+    if args.org_txt:
+        with open(args.org_txt, "w") as f:
+            for sentence in iter_column(args.tsv, 1 - args.column):
+                f.write(sentence + "\n")
+
+    client = udpipe.Client(args.url, args.model, concurrency=args.concurrency, retries=args.retries, timeout=args.timeout)
+    try:
+        with open(args.output, "w") as outfile, instrument.timer("parse.parse"):
+            n = asyncio.run(udpipe.parse_to_file(client, iter_column(args.tsv, args.column), outfile, args.batch_size, args.max_chars))
+    except udpipe.UDPipeError as e:
+        sys.exit("parsing failed: {}".format(e))
+    finally:
+        client.close()
+    print("{} sentences parsed, {} from the cache".format(n, client.cache.hits), file=sys.stderr)
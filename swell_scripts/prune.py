@@ -1,6 +1,92 @@
 from argparse import ArgumentParser
-import conllu
+import csv
 import os.path
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from seapass import cache, instrument, lazy, reader, sidecar
+
+np = lazy.module("numpy")
+
+# (Treebank, sentence number) for each sentence of a stream of Treebank chunks
+def iter_sents(chunks):
+    for chunk in chunks:
+        for i in range(len(chunk)):
+            yield (chunk, i)
+
+# forms of a sentence as an array of integer IDs, shared through vocab (the
+# forms are interned, so equal forms get the same ID)
+def form_ids(forms, vocab):
+    return np.array([vocab.setdefault(form, len(vocab)) for form in forms], dtype=np.int64)
+
+# (start, end) of the error segment of a pair of sentences of the same length,
+# i.e. from the first to the last token (end excluded) whose forms differ.
+# None if the sentences are identical
+def err_span(trg_ids, org_ids):
+    diff = np.flatnonzero(trg_ids != org_ids)
+    if diff.size == 0:
+        return None
+    return (int(diff[0]), int(diff[-1]) + 1)
+
+# write the error segments of each pair of sentences of the trg_gold and
+# org_silver treebanks to <trg_gold>-pruned and <org_silver>-pruned, and their
+# spans to the <org_silver>-pruned-spans.tsv sidecar: for each segment, the
+# position of its sentence in the unpruned treebanks, its sent_id and its
+# start/end token range. Nothing in the repository reads the sidecar, it is
+# for mapping segments back to full sentences outside of it. The treebanks
+# are read in lockstep, batch_size sentences at a time. If org_silver has a sidecar
+# (e.g. written by corrupt.py), sent_ids come from there and its comments are
+# not read. Returns the number of segments
+@instrument.timed("prune.prune")
+def prune(trg_gold_path, org_silver_path, batch_size=1000):
+    (trg_name,ext) = os.path.splitext(trg_gold_path)
+    trg_outp = "{}-pruned{}".format(trg_name, ext)
+    (org_name,ext) = os.path.splitext(org_silver_path)
+    org_outp = "{}-pruned{}".format(org_name, ext)
+    # sidecar with the span of each error segment
+    spans_outp = "{}-pruned-spans.tsv".format(org_name)
+
+    org_meta = sidecar.load(org_silver_path)
+    trg_golds = iter_sents(reader.iter_chunks(trg_gold_path, batch_size))
+    org_silvers = iter_sents(reader.iter_chunks(org_silver_path, batch_size, metadata=org_meta is None))
+    vocab = {}
+    with open(trg_outp, "w") as trg_outf, open(org_outp, "w") as org_outf, open(spans_outp, "w") as spans_outf:
+        spans_writer = csv.writer(spans_outf, delimiter="\t", lineterminator="\n")
+        spans_writer.writerow(["sentence", "sent_id", "start", "end"])
+        n_segs = 0
+        for (k, ((trg_gold, i), (org_silver, j))) in enumerate(zip(trg_golds, org_silvers)):
+            trg_forms = trg_gold.column("form", i)
+            org_forms = org_silver.column("form", j)
+            # not supposed to happen but SweLL annoataion is not that perfect
+            if not (len(trg_forms) == len(org_forms)):
+                instrument.count("prune.length mismatches")
+                print(
+                    "skipping {} because org and trg are of different lengths"
+                    .format(" ".join(trg_forms))
+                )
+                continue
+            span = err_span(form_ids(trg_forms, vocab), form_ids(org_forms, vocab))
+            if span is None:
+                instrument.count("prune.identical pairs")
+                print(
+                    "skipping {} because org and trg are identical"
+                    .format(" ".join(trg_forms))
+                )
+                continue
+            (err_start, err_end) = span
+            # segments are separated by an extra newline
+            if n_segs:
+                trg_outf.write("\n")
+                org_outf.write("\n")
+            trg_outf.write(trg_gold.serialize(i, err_start, err_end, metadata=False))
+            org_outf.write(org_silver.serialize(j, err_start, err_end, metadata=False))
+            if org_meta is None:
+                sent_id = org_silver.meta(j, "sent_id", "_")
+            else:
+                sent_id = org_meta["sent_id"][k] or "_"
+            spans_writer.writerow([k, sent_id, err_start, err_end])
+            n_segs += 1
+    return n_segs
 
 if __name__ == "__main__":
     argparser = ArgumentParser()
@@ -11,45 +97,13 @@ if __name__ == "__main__":
         "org_silver",
         help="automatically parsed learner sentences treebank to be evaluated"
     )
+    argparser.add_argument(
+        "--batch_size", type=int, default=1000,
+        help="number of sentences read at once from each treebank")
+    cache.add_arguments(argparser)
+    instrument.add_arguments(argparser)
     args = argparser.parse_args()
+    cache.configure(args)
+    instrument.configure(args)
 
-    with open(args.trg_gold) as inf:
-        trg_golds = conllu.parse(inf.read())
-    with open(args.org_silver) as inf:
-        org_silvers = conllu.parse(inf.read())
-    
-    pairs = zip(trg_golds,org_silvers)
-    err_segs = []
-    for (i, (trg_gold, org_silver)) in enumerate(pairs):
-        # not supposed to happen but SweLL annoataion is not that perfect
-        if not (len(trg_gold) == len(org_silver)):
-            print(
-                "skipping {} because org and trg are of different lengths"
-                .format(" ".join([tok["form"] for tok in trg_gold]))
-            )
-            continue
-        err_start = 0
-        while trg_gold[err_start]["form"] == org_silver[err_start]["form"]:
-            err_start += 1
-        err_end = len(trg_gold) - 1
-        while trg_gold[err_end]["form"] == org_silver[err_end]["form"]:
-            err_end -= 1
-        err_segs.append(
-            (conllu.TokenList(trg_gold[err_start:err_end+1]), 
-            conllu.TokenList(org_silver[err_start:err_end+1])))
-    
-    (trg_err_segs, org_err_segs) = zip(*err_segs)
-
-    trg_err_str = "\n".join([seg.serialize() for seg in trg_err_segs])
-    (trg_name,ext) = os.path.splitext(args.trg_gold)
-    trg_outp = "{}-pruned{}".format(trg_name, ext)
-    with open(trg_outp, "w") as outf:
-        outf.write(trg_err_str)
-        
-    org_err_str = "\n".join([seg.serialize() for seg in org_err_segs])
-    (org_name,ext) = os.path.splitext(args.org_silver)
-    org_outp = "{}-pruned{}".format(org_name, ext)
-    with open(org_outp, "w") as outf:
-        outf.write(org_err_str)
-
-            
\ No newline at end of file
+    prune(args.trg_gold, args.org_silver, args.batch_size)
@@ -1,51 +1,129 @@
+import argparse
+import bisect
 import conllu
+import os.path
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from seapass import instrument, reader
+
+# positions of each (lowercased) form in a list of forms, in increasing order
+def positions_by_form(forms):
+    positions = {}
+    for (i, form) in enumerate(forms):
+        positions.setdefault(form.lower(), []).append(i)
+    return positions
+
+# min-cost matching between the positions of the occurrences of a form in the
+# original and in the target sentence, the cost being the distance between
+# matched positions. On a line the optimal matching never crosses, so with as
+# many occurrences on both sides it is just the k-th with the k-th, otherwise
+# a DP over positions picks which occurrences of the side with more of them
+# are left out (on ties, the later ones). Returns (org pos, trg pos) pairs
+def match_positions(org_positions, trg_positions):
+    if len(org_positions) == len(trg_positions):
+        return list(zip(org_positions, trg_positions))
+    swapped = len(org_positions) > len(trg_positions)
+    (short, long) = (trg_positions, org_positions) if swapped else (org_positions, trg_positions)
+    # cost[x][y]: cost of matching the first x of short within the first y
+    # of long
+    inf = float("inf")
+    cost = [[0] * (len(long) + 1)] + [[inf] * (len(long) + 1) for _ in short]
+    for x in range(1, len(short) + 1):
+        for y in range(x, len(long) + 1):
+            cost[x][y] = min(cost[x][y - 1], cost[x - 1][y - 1] + abs(short[x - 1] - long[y - 1]))
+    pairs = []
+    (x, y) = (len(short), len(long))
+    while x > 0:
+        if y > x and cost[x][y] == cost[x][y - 1]:
+            y -= 1
+        else:
+            pairs.append((long[y - 1], short[x - 1]) if swapped else (short[x - 1], long[y - 1]))
+            x -= 1
+            y -= 1
+    return pairs[::-1]
+
+# closest position to i in a sorted list of positions (the first one on ties)
+def closest(positions, i):
+    k = bisect.bisect_left(positions, i)
+    candidates = positions[max(k - 1, 0):k + 1]
+    return min(candidates, key=lambda d: abs(i - d))
 
 # transfer annotation from an annotated target TokenList to an unannotated
-# sentence in string form, assuming WORD ORDER ERRORS ONLY
+# sentence in string form, assuming WORD ORDER ERRORS ONLY. Tokens are
+# matched on their lowercased forms (wrong order can affect capitalization),
+# repeated forms through match_positions. trg_tokens is left untouched
+@instrument.timed("transfer.transfer_annotation")
 def transfer_annotation(trg_tokens, org_sent, meta={}):
     org_forms = org_sent.split()
+    trg_forms = [trg_token["form"] for trg_token in trg_tokens]
+    org_positions = positions_by_form(org_forms)
+    trg_positions = positions_by_form(trg_forms)
+    trg_to_org = {}
+    for (form, positions) in org_positions.items():
+        for (i, j) in match_positions(positions, trg_positions.get(form, [])):
+            trg_to_org[j] = i
+
     org_tokens = []
-    trg_tokens = trg_tokens.copy()
-    for (i,word) in enumerate(org_forms):
-        for (j,trg_token) in enumerate(trg_tokens):
-            if trg_token["misc"] and "Transferred=True" in trg_token["misc"]: # already used
-                continue
-            # lowercase bc wrong order can affect capitalization
-            if trg_token["form"].lower() == word.lower():
-                # build org_token by modifying indices of trg_token
-                org_token = trg_token.copy()
-                org_token["id"] = i + 1
-                try:
-                    if trg_token["deprel"].lower() not in ["root", "_"]:
-                        trg_dephead = trg_tokens[int(trg_token["head"]) - 1]
-                        # there might be more than one when a token is repeated, so...
-                        possible_depheads = [i for (i,org_form) in enumerate(org_forms) if org_form.lower() == trg_dephead["form"].lower()]
-                        # ...get the closest one (heuristic!)
-                        org_token["head"] = min(possible_depheads, key=lambda d: abs(i - d)) + 1
-                    else:
-                        org_token["head"] = 0
-                except Exception as e:
-                    print(e)
-                    print("transfer_annotation failed for sentence {}.".format(trg_tokens.metadata["sent_id"]))
-                    print("please check trg/uncorrupted file tokenization")
-
-                org_tokens.append(org_token)
-                trg_tokens[j]["misc"] = "Transferred=True"
-                break
+    for (j, i) in sorted(trg_to_org.items(), key=lambda match: match[1]):
+        trg_token = trg_tokens[j]
+        # build org_token by modifying indices of trg_token
+        org_token = trg_token.copy()
+        org_token["id"] = i + 1
+        try:
+            if trg_token["deprel"].lower() not in ["root", "_"]:
+                trg_dephead = int(trg_token["head"]) - 1
+                if trg_dephead in trg_to_org:
+                    org_token["head"] = trg_to_org[trg_dephead] + 1
+                else:
+                    # the head has no counterpart, get the closest token with
+                    # the same form (heuristic!)
+                    instrument.count("transfer.closest head fallbacks")
+                    possible_depheads = org_positions[trg_forms[trg_dephead].lower()]
+                    org_token["head"] = closest(possible_depheads, i) + 1
+            else:
+                org_token["head"] = 0
+        except Exception as e:
+            instrument.count("transfer.failures")
+            print(e)
+            print("transfer_annotation failed for sentence {}.".format(trg_tokens.metadata.get("sent_id")))
+            print("please check trg/uncorrupted file tokenization")
+
+        org_tokens.append(org_token)
     return conllu.TokenList(org_tokens, metadata=meta)
 
+# transfer_annotation over whole lists of target TokenLists and original
+# sentences, in a pool of worker processes if workers > 1. Results are in
+# input order
+def transfer_all(trg, org, meta={}, workers=1):
+    # worker processes are not profiled, only the pool as a whole
+    if workers < 2:
+        return [transfer_annotation(t, o, meta) for (t, o) in zip(trg, org)]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        chunksize = max(1, len(trg) // (4 * workers))
+        return list(pool.map(transfer_annotation, trg, org, repeat(meta), chunksize=chunksize))
+
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    instrument.add_arguments(parser)
+    args = parser.parse_args()
+    instrument.configure(args)
+
     with open("data/swell/org.txt") as f:
         org = f.readlines()
     # trg_gold.conllu is the result of automatically parsing trg.txt with 
     # UDPipe 2 and manually fixing the errors 
-    with open("data/swell/trg_gold.conllu") as f: 
-        trg_conllu = f.read()
-    trg = conllu.parse(trg_conllu)
-    # org_silver.conllu will need some minor fixes, the CoNLL-U validator
+    with instrument.timer("transfer.read"):
+        trg = reader.read_tokenlists("data/swell/trg_gold.conllu")
+    # org_silver.conllu might need some minor fixes, the CoNLL-U validator
     # helps finding most of the problems. This is due to the fact that we
-    # deal with repeated tokens through a heuristic (cf. line 23) 
-    with open ("data/swell/org_silver.conllu", "w") as f:
-        for i in range(len(trg)):
-            f.write(transfer_annotation(trg[i], org[i], meta=trg.metadata).serialize())
+    # deal with repeated tokens through a heuristic (cf. match_positions) 
+    with instrument.timer("transfer.transfer_all"):
+        org_silver = transfer_all(trg, org, meta=trg.metadata, workers=args.workers)
+    with open ("data/swell/org_silver.conllu", "w") as f, instrument.timer("transfer.write"):
+        for org_tokens in org_silver:
+            f.write(org_tokens.serialize())
@@ -0,0 +1,105 @@
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# local stand-in for the UDPipe 2 REST API, to develop and test the parsing
+# step (parse.py, seapass/udpipe.py) without sending anything to the real
+# service. It implements GET /models and POST /process with the same request
+# fields and JSON responses, for "horizontal" input (one pre-tokenized
+# sentence per line). The "parse" is fake but deterministic: every token
+# depends on the first one, which is the root. --fail_rate makes some
+# requests fail with 503 and --delay slows all of them down, to exercise the
+# retries and the concurrency of the client
+
+MODELS = ["swedish-talbanken-ud-2.12-230717"]
+
+# fake CoNLL-U parse of pre-tokenized sentences, as UDPipe returns it
+def fake_parse(data):
+    lines = ["# newdoc", "# newpar"]
+    sentences = [line.split() for line in data.split("\n") if line.strip()]
+    for (n, tokens) in enumerate(sentences, 1):
+        lines.append("# sent_id = {}".format(n))
+        lines.append("# text = {}".format(" ".join(tokens)))
+        for (i, form) in enumerate(tokens, 1):
+            (head, deprel) = (0, "root") if i == 1 else (1, "dep")
+            misc = "SpaceAfter=No" if i == len(tokens) else "_"
+            lines.append("\t".join([str(i), form, form.lower(), "X", "_", "_", str(head), deprel, "_", misc]))
+        lines.append("")
+    return "\n".join(lines) + "\n"
+
+class Handler(BaseHTTPRequestHandler):
+    def _respond(self, code, body, content_type="application/json"):
+        data = body.encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", content_type + "; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _fields(self):
+        (path, _, query) = self.path.partition("?")
+        fields = urllib.parse.parse_qs(query)
+        if self.command == "POST":
+            length = int(self.headers.get("Content-Length", 0))
+            fields.update(urllib.parse.parse_qs(self.rfile.read(length).decode("utf-8"), keep_blank_values=True))
+        return (path.rstrip("/"), {key: values[-1] for (key, values) in fields.items()})
+
+    def do_GET(self):
+        (path, _) = self._fields()
+        if path.endswith("/models"):
+            self._respond(200, json.dumps({"models": {model: ["tokenizer", "tagger", "parser"] for model in MODELS}, "default_model": MODELS[0]}))
+        else:
+            self._respond(404, "Not found\n", "text/plain")
+
+    def do_POST(self):
+        (path, fields) = self._fields()
+        self.server.requests += 1
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if not path.endswith("/process"):
+            self._respond(404, "Not found\n", "text/plain")
+        elif self.server.rng.random() < self.server.fail_rate:
+            self._respond(503, "Service temporarily unavailable\n", "text/plain")
+        elif fields.get("model", MODELS[0]) not in MODELS:
+            self._respond(400, "Unknown model '{}'\n".format(fields["model"]), "text/plain")
+        elif fields.get("input", "tokenize") != "horizontal":
+            self._respond(400, "Only horizontal input is supported by the stand-in server\n", "text/plain")
+        else:
+            model = fields.get("model", MODELS[0])
+            self._respond(200, json.dumps({"model": model, "acknowledgements": [], "result": fake_parse(fields.get("data", ""))}))
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+# start a stand-in server in a background thread (port 0 picks a free one).
+# Its URL is "http://127.0.0.1:{}".format(server.server_port); call
+# server.shutdown() when done
+def serve(port=0, fail_rate=0.0, delay=0.0, seed=42, verbose=False):
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.fail_rate = fail_rate
+    server.delay = delay
+    server.rng = random.Random(seed)
+    server.verbose = verbose
+    server.requests = 0
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8001, help="port to listen on (on localhost)")
+    parser.add_argument("--fail_rate", type=float, default=0.0, help="fraction of requests that fail with 503")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds before answering each request")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.fail_rate, args.delay, verbose=True)
+    print("UDPipe stand-in listening on http://127.0.0.1:{}".format(server.server_port), file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -3,10 +3,22 @@ import conllu
 import os.path
 import random
 import itertools
+import sys
+from array import array
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from conllu.parser import parse_dict_value
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+from seapass import cache, instrument, reader, shards, sidecar
 
 ADV_RELS = ["advmod", "advcl"]
 SUBJ_RELS = ["nsubj", "csubj"]
 SWELL_LABELS = ["S-Adv", "S-FinV", "S-WO"]
+# label weights, kinda based on SweLL freqs
+SWELL_WEIGHTS = [0.5, 0.4, 0.1]
+# --variants all: every possible variant of each sentence
+ALL_VARIANTS = "all"
 
 # return deprel without subtypes, e.g. nsubj:pass -> nsubj
 def base_deprel(deprel):
@@ -26,138 +38,591 @@ def is_imp(tok):
 def is_subj(tok):
     return base_deprel(tok["deprel"]) in SUBJ_RELS
 
-# give a token and the sentence it belongs to as a TokenList, return the 
-# token's syntactic head
-def dephead(token, sent):
-    return sent[token["head"] - 1]
+# dependency index of a sentence (TokenList), built once in a single
+# depth-first pass so that heads, children and subtrees of its tokens can be
+# looked up without rebuilding the tree for every query. Tokens are referred
+# to by their position in the sentence. Nodes are numbered in DFS preorder,
+# so that the subtree rooted in a token is a contiguous slice of the preorder
+class DepIndex:
+    def __init__(self, sent):
+        self.sent = sent
+        # token ID -> position, only for regular (integer ID) tokens
+        self.positions = {tok["id"]: i for (i, tok) in enumerate(sent) if isinstance(tok["id"], int)}
+        # children adjacency list, children in sentence order
+        self.children = [[] for _ in sent]
+        roots = []
+        for (i, tok) in enumerate(sent):
+            if not isinstance(tok["id"], int):
+                continue
+            if tok["head"] in self.positions:
+                self.children[self.positions[tok["head"]]].append(i)
+            else:
+                roots.append(i)
+        self.preorder = []
+        # subtree of the token at position i: preorder[start[i]:end[i]]
+        self.start = [0] * len(sent)
+        self.end = [0] * len(sent)
+        # span of the subtree of the token at position i: (min ID, max ID)
+        self.spans = [None] * len(sent)
+        for root in roots:
+            self._visit(root)
+
+    def _visit(self, root):
+        # iterative DFS, to be safe with very deep trees
+        stack = [(root, False)]
+        while stack:
+            (i, done) = stack.pop()
+            if done:
+                self.end[i] = len(self.preorder)
+                lo, hi = self.sent[i]["id"], self.sent[i]["id"]
+                for child in self.children[i]:
+                    lo = min(lo, self.spans[child][0])
+                    hi = max(hi, self.spans[child][1])
+                self.spans[i] = (lo, hi)
+                continue
+            self.start[i] = len(self.preorder)
+            self.preorder.append(i)
+            stack.append((i, True))
+            stack.extend((child, False) for child in reversed(self.children[i]))
+
+    # position of a token in the sentence
+    def position(self, token):
+        return self.positions[token["id"]]
+
+    # syntactic head of a token
+    def head(self, token):
+        return self.sent[self.positions[token["head"]]]
+
+    # dependents of a token, in sentence order
+    def dependents(self, token):
+        return [self.sent[child] for child in self.children[self.position(token)]]
 
-# return a list of all subtrees of a given TokenTree
-def all_subtrees(tree):
-    return [tree] + list(itertools.chain.from_iterable([all_subtrees(child) for child in tree.children]))
+    # positions (sorted) of the tokens in the subtree rooted in a token
+    def subtree(self, token):
+        i = self.position(token)
+        return sorted(self.preorder[self.start[i]:self.end[i]])
 
-# given a token and the tree for the sentence it belongs to, return the 
-# subtree rooted in the token
-def find_subtree(head, tree):
-    return [subtree for subtree in all_subtrees(tree) if subtree.token["id"] == head["id"]][0]
+    # (min ID, max ID) of the subtree rooted in a token
+    def span(self, token):
+        return self.spans[self.position(token)]
+
+    # tokens of the subtree rooted in a token, in sentence order
+    def yield_of(self, token):
+        return [self.sent[i] for i in self.subtree(token)]
+
+# give a token and the sentence it belongs to as a TokenList, return the 
+# token's syntactic head. If the sentence's DepIndex is given, use that
+def dephead(token, sent, index=None):
+    if index is not None:
+        return index.head(token)
+    return sent[token["head"] - 1]
 
 # given a sentence (as TokenList) and a (finite verb) token, recursively
 # find the subject (if the token does not directly have a subject dependent, 
 # e.g. because it is a conj or aux, go up to its parent and look for a subj
-# again)
-def find_subj(sent, finv):
-    subjs = [tok for tok in sent if tok["head"] == finv["id"] and is_subj(tok)]
+# again). depth is the number of steps up taken so far
+def find_subj(sent, finv, index=None, depth=0):
+    if index is None:
+        index = DepIndex(sent)
+    instrument.maximum("corrupt.find_subj depth", depth)
+    subjs = [tok for tok in index.dependents(finv) if is_subj(tok)]
     if subjs: # base case 1: found a subj
         return (subjs[0], finv) # there should always only be one subj
     if finv["deprel"] in ["root", "_"]: # base case 2: root
         return None
     # recursive case
-    return find_subj(sent, dephead(finv, sent))
+    return find_subj(sent, dephead(finv, sent, index), index, depth + 1)
 
 # given a token and the sentence it belongs to, return the TokenList
-# (segment) corresponding to the phrase/subtree rooted in the token
-def phrase(token, sent):
-    tree = sent.to_tree()
-    return conllu.parse(find_subtree(token, tree).serialize())[0] 
-
-def adjust_indices(sent):
-    # map old IDs to new, sequential ones
-    old_new = {}
-    new_sent = sent.copy()
-    for i in range(len(new_sent)): 
-        old_new[new_sent[i]["id"]] = i + 1
-    for i in range(len(new_sent)):
-        if not new_sent[i]["head"] == 0:  
-            new_sent[i]["head"] = old_new[new_sent[i]["head"]]
-        new_sent[i]["id"] = old_new[new_sent[i]["id"]]
-    
-    return new_sent
-        
-# move a phrase of a given sentence with respect to a pivot token.
-# Returns a new TokenList (does not adjust the indices just yet)
-def move_phrase(sent, phrase, pivot):
-    indices = [token["id"] for token in phrase]
-    # phrase range
-    start,end = min(indices),max(indices)
-    prefix = [token for token in sent if token["id"] < start and token["id"] != pivot["id"]]
-    postfix = [token for token in sent if token["id"] > end and token["id"] != pivot["id"]]
-    if end < pivot["id"]: # mv phrase to the right of the head
-        scrambled = prefix + [pivot] + phrase + postfix
-    else: # mv phrase to the left of the head 
-        scrambled = prefix + phrase + [pivot] + postfix
-
-    return scrambled
-
-def corrupt(sent):
-    # try corrupt sentence with S-Adv
-    try:
-        advs = [tok for tok in sent if base_deprel(tok["deprel"]) in ADV_RELS]
-        adv = random.choice(advs)
-        adv_phrase = phrase(adv, sent)
-        sadv_sent = move_phrase(sent,adv_phrase,dephead(adv,sent))
-    except:
-        sadv_sent = None
-    
-    # try corrupt sentence with S-FinV
-    try:
-        # select viable finite verbs (excludes imperatives bc they don't have
-        # an explicit subject)
-        finvs = [tok for tok in sent if is_finv(tok) and not is_imp(tok)]
-        finv = random.choice(finvs)
-        (subj, finv) = find_subj(sent, finv)
-        subj_phrase = phrase(subj, sent)
-        sfinv_sent = move_phrase(sent, subj_phrase, finv)
-    except:
-        sfinv_sent = None
-        
-    # simplistic strategy: just swap two adjacent tokens. This is far from 
-    # ideal and might result in errors that are quite unlikely, but it should
-    # never fail unless the sentence has length 1, in which case we have to
-    # leave it as it is
-    if len(sent) > 1:
-        i = random.randint(0,len(sent) - 2) # -2 cause randint is crazy
-        j = i + 1
-        swo_sent = sent.copy()
-        swo_sent[i] = sent[j]
-        swo_sent[j] = sent[i]
-    else:
-        swo_sent = sent
-
-    # select what label & sentence to use/keep, kinda based on SweLL freqs
-    if sadv_sent and sfinv_sent:
-        [label] = random.choices(SWELL_LABELS, [0.5, 0.4, 0.1])
-    elif sadv_sent and (not sfinv_sent):
-        label = "S-Adv"
-    elif (not sadv_sent) and sfinv_sent:
-        label = "S-FinV"
-    else:
+# (segment) corresponding to the phrase/subtree rooted in the token. Pass the
+# sentence's DepIndex when looking up several phrases of the same sentence
+@instrument.timed("corrupt.phrase")
+def phrase(token, sent, index=None):
+    if index is None:
+        index = DepIndex(sent)
+    return conllu.TokenList(index.yield_of(token))
+
+# compact representation of a sentence for the corruption operations: the
+# IDs and heads of its tokens as int arrays. A corruption is a permutation of
+# token positions (perm[k] is the position of the token that ends up k-th),
+# and re-indexing it is a single pass over the heads through the inverse
+# permutation, without copying any token. The conllu tokens are only touched
+# again when the chosen corruption is turned into a TokenList (see finalize)
+class CompactSent:
+    __slots__ = ("sent", "ids", "heads", "positions")
+
+    # positions maps token IDs to positions, e.g. the one of a DepIndex
+    def __init__(self, sent, positions=None):
+        self.sent = sent
+        self.ids = array("i", [tok["id"] for tok in sent])
+        self.heads = array("i", [tok["head"] or 0 for tok in sent])
+        if positions is None:
+            positions = {tok_id: i for (i, tok_id) in enumerate(self.ids)}
+        self.positions = positions
+
+    def __len__(self):
+        return len(self.ids)
+
+    def identity(self):
+        return array("i", range(len(self.ids)))
+
+    # move the phrase at the given (sorted) positions to the other side of
+    # the pivot token (a position). Tokens between the first and the last
+    # one of the phrase that are not part of it are left out, as they always
+    # were: callers only pass projective phrases
+    @instrument.timed("corrupt.move")
+    def move(self, phrase, pivot):
+        ids = self.ids
+        start = min(ids[i] for i in phrase)
+        end = max(ids[i] for i in phrase)
+        prefix = [i for i in range(len(ids)) if ids[i] < start and i != pivot]
+        postfix = [i for i in range(len(ids)) if ids[i] > end and i != pivot]
+        if end < ids[pivot]: # mv phrase to the right of the head
+            return array("i", prefix + [pivot] + phrase + postfix)
+        else: # mv phrase to the left of the head
+            return array("i", prefix + phrase + [pivot] + postfix)
+
+    # swap the tokens at positions i and i + 1
+    def swap(self, i):
+        perm = self.identity()
+        perm[i], perm[i + 1] = perm[i + 1], perm[i]
+        return perm
+
+    # heads of the permuted sentence, with IDs renumbered from 1 in the new
+    # order: new_head = inv_perm[old_head] + 1 (0 stays 0)
+    @instrument.timed("corrupt.reindex")
+    def reindex(self, perm):
+        inv_perm = array("i", [-1]) * len(self.ids)
+        for (k, i) in enumerate(perm):
+            inv_perm[i] = k
+        positions = self.positions
+        heads = self.heads
+        new_heads = array("i", [0]) * len(perm)
+        for (k, i) in enumerate(perm):
+            head = heads[i]
+            if head:
+                new_head = inv_perm[positions[head]]
+                if new_head < 0:
+                    raise KeyError(head)
+                new_heads[k] = new_head + 1
+        return new_heads
+
+# viable corruption sites of a sentence, listed in a single pass over it:
+# for S-Adv the (adverbial, head) position pairs of the adverbials that have
+# a head, for S-FinV the (subject, verb) position pairs of the finite
+# non-imperative verbs whose subject can be found, for S-WO the position of
+# the first token of each pair of adjacent tokens. Works on any sequence of
+# token dicts with the fields used by DepIndex, is_finv and is_imp
+def plan(sent, index):
+    sites = {label: [] for label in SWELL_LABELS}
+    for (i, tok) in enumerate(sent):
+        if not isinstance(tok["id"], int):
+            continue
+        if base_deprel(tok["deprel"]) in ADV_RELS and tok["head"] in index.positions:
+            sites["S-Adv"].append((i, index.positions[tok["head"]]))
+        if is_finv(tok) and not is_imp(tok):
+            try:
+                (subj, finv) = find_subj(sent, tok, index)
+            except:
+                continue
+            sites["S-FinV"].append((index.position(subj), index.position(finv)))
+    # different verbs can lead to the same (subject, verb) pair (find_subj
+    # goes up to the verb that has the subject), which would then be drawn
+    # more often
+    sites["S-FinV"] = list(dict.fromkeys(sites["S-FinV"]))
+    sites["S-WO"] = list(range(len(sent) - 1))
+    return sites
+
+# labels with at least one viable site in a plan
+def viable_labels(sites):
+    return [label for label in SWELL_LABELS if sites[label]]
+
+# permutation of a CompactSent corrupting it at a site of a plan
+def site_perm(compact, index, label, site):
+    if label == "S-WO":
+        return compact.swap(site)
+    (moved, pivot) = site
+    return compact.move(index.subtree(compact.sent[moved]), pivot)
+
+# corrupt a sentence. rng is the source of randomness, by default the global
+# random module, but it can be any random.Random instance (see sent_rng).
+# The viable sites of every error type are listed first (see plan) and only
+# the chosen corruption is built. The label is drawn among the viable ones,
+# kinda based on SweLL freqs, unless it is given (see assign_labels); either
+# way it falls back to S-WO if it has no viable site. S-WO (just swap two
+# adjacent tokens) is far from ideal and might result in errors that are
+# quite unlikely, but it never fails unless the sentence has length 1, in
+# which case we have to leave it as it is
+def corrupt(sent, rng=random, label=None):
+    with instrument.timer("corrupt.index"):
+        index = DepIndex(sent)
+        compact = CompactSent(sent, index.positions)
+    sites = plan(sent, index)
+
+    if label is None:
+        if not sites["S-Adv"]:
+            instrument.count("corrupt.S-Adv failures")
+        if not sites["S-FinV"]:
+            instrument.count("corrupt.S-FinV failures")
+        if sites["S-Adv"] and sites["S-FinV"]:
+            [label] = rng.choices(SWELL_LABELS, SWELL_WEIGHTS)
+        elif sites["S-Adv"] or sites["S-FinV"]:
+            label = "S-Adv" if sites["S-Adv"] else "S-FinV"
+        else:
+            instrument.count("corrupt.S-WO fallbacks")
+            label = "S-WO"
+    elif not sites[label] and label != "S-WO":
+        instrument.count("corrupt.S-WO fallbacks")
         label = "S-WO"
-    if label == "S-Adv":
-        scrambled_sent = sadv_sent
-    elif label == "S-FinV":
-        scrambled_sent = sfinv_sent
+    instrument.count("corrupt.label " + label)
+    if sites[label]:
+        perm = site_perm(compact, index, label, rng.choice(sites[label]))
     else:
-        scrambled_sent = swo_sent
-    adjusted_sent = adjust_indices(scrambled_sent)
+        perm = compact.identity()
+    return finalize(compact, perm, label)
 
-    # simplistically adjust case
-    for i in range(len(adjusted_sent)):
-        adjusted_sent[i]["form"] = adjusted_sent[i]["form"].lower() if adjusted_sent[i]["upos"] != "PROPN" else adjusted_sent[i]["form"]
+# turn a permutation of a CompactSent into a new TokenList with adjusted
+# indices, case and metadata. Tokens are copied, so the original sentence is
+# left untouched and the same tokens can be reused for several variants
+@instrument.timed("corrupt.finalize")
+def finalize(compact, perm, label, variant_id=None):
+    new_heads = compact.reindex(perm)
+    adjusted_sent = []
+    for (k, i) in enumerate(perm):
+        tok = compact.sent[i].copy()
+        tok["id"] = k + 1
+        tok["head"] = new_heads[k]
+        # simplistically adjust case
+        if tok["upos"] != "PROPN":
+            tok["form"] = tok["form"].lower()
+        adjusted_sent.append(tok)
     adjusted_sent[0]["form"] = adjusted_sent[0]["form"].title()
     
     # generate metadata
     scrambled_str = " ".join([token["form"] for token in adjusted_sent])
-    meta = sent.metadata
+    meta = compact.sent.metadata
     scrambled_meta = meta.copy()
     scrambled_meta["uncorrupted_text"] = meta["text"]
     scrambled_meta["text"] = scrambled_str
     scrambled_meta["error_label"] = label 
+    if variant_id is not None:
+        scrambled_meta["variant_id"] = str(variant_id)
 
     return conllu.TokenList(adjusted_sent, metadata=scrambled_meta)
 
+# return up to n distinct corrupted variants of a sentence (all of them if n
+# is None), from a single analysis of the sentence. Duplicate word orders
+# are removed by comparing the permutations, keeping the first label that
+# produced them. When sampling, labels are chosen with SWELL_WEIGHTS among
+# those that still have unused moves. Each variant gets a variant_id
+def corrupt_variants(sent, n=None, rng=random):
+    index = DepIndex(sent)
+    compact = CompactSent(sent, index.positions)
+    sites = plan(sent, index)
+    moves = {}
+    seen = {compact.identity().tobytes()}
+    for label in SWELL_LABELS:
+        moves[label] = []
+        for site in sites[label]:
+            move = site_perm(compact, index, label, site)
+            key = move.tobytes()
+            if key not in seen:
+                seen.add(key)
+                moves[label].append(move)
+
+    if n is None:
+        chosen = [(label, move) for label in SWELL_LABELS for move in moves[label]]
+    else:
+        chosen = []
+        while len(chosen) < n:
+            labels = [label for label in SWELL_LABELS if moves[label]]
+            if not labels:
+                break
+            weights = [SWELL_WEIGHTS[SWELL_LABELS.index(label)] for label in labels]
+            [label] = rng.choices(labels, weights)
+            move = moves[label].pop(rng.randrange(len(moves[label])))
+            chosen.append((label, move))
+    # sentences of length 1 can't be corrupted, leave them as they are
+    if not chosen:
+        chosen = [("S-WO", compact.identity())]
+
+    return [finalize(compact, move, label, variant_id) for (variant_id, (label, move)) in enumerate(chosen)]
+
+# bitmask of the labels with a viable site in a sentence (bit k for
+# SWELL_LABELS[k])
+def viable_mask(sites):
+    return sum(1 << k for (k, label) in enumerate(SWELL_LABELS) if sites[label])
+
+# viable_mask of every sentence of a treebank, from a planning pass that only
+# reads the columns plan needs (see seapass.reader) instead of parsing whole
+# sentences
+def plan_treebank(path, batch_size=1000):
+    masks = array("B")
+    columns = ["id", "head", "deprel", "feats"]
+    for chunk in reader.iter_chunks(path, batch_size, columns, metadata=False):
+        with instrument.timer("corrupt.plan"):
+            ids = chunk.column("id")
+            heads = chunk.column("head")
+            deprels = chunk.column("deprel")
+            feats = chunk.column("feats")
+            for i in range(len(chunk)):
+                sent = []
+                for k in range(chunk.offsets[i], chunk.offsets[i + 1]):
+                    sent.append({
+                        "id": ids[k] if ids[k] >= 0 else chunk.special_ids[k],
+                        "head": heads[k] if heads[k] >= 0 else None,
+                        "deprel": deprels[k],
+                        "feats": parse_dict_value(feats[k])})
+                masks.append(viable_mask(plan(sent, DepIndex(sent))))
+    return masks
+
+# split n into integer counts proportional to weights (largest remainder)
+def apportion(n, weights):
+    total = sum(weights)
+    shares = [n * weight / total for weight in weights]
+    counts = [int(share) for share in shares]
+    by_remainder = sorted(range(len(weights)), key=lambda k: counts[k] - shares[k])
+    for k in by_remainder[:n - sum(counts)]:
+        counts[k] += 1
+    return counts
+
+# assign an error label to each sentence so that the treebank as a whole
+# follows weights as closely as the viable sites allow. masks are the
+# viable_masks of the sentences. Sentences that only allow S-Adv (S-FinV)
+# get it first, then sentences that allow both fill what is left of the
+# S-Adv and S-FinV targets, and all the others get S-WO, which is always
+# viable. Returns the labels and the target counts
+def assign_labels(masks, weights=SWELL_WEIGHTS, seed=42):
+    rng = random.Random(seed)
+    (adv, finv) = (1 << SWELL_LABELS.index("S-Adv"), 1 << SWELL_LABELS.index("S-FinV"))
+    targets = apportion(len(masks), weights)
+    (adv_target, finv_target, _) = targets
+    groups = {mask: [] for mask in [adv, finv, adv | finv]}
+    for (i, mask) in enumerate(masks):
+        if mask & (adv | finv):
+            groups[mask & (adv | finv)].append(i)
+    for group in groups.values():
+        rng.shuffle(group)
+    labels = ["S-WO"] * len(masks)
+    adv_only = groups[adv][:adv_target]
+    finv_only = groups[finv][:finv_target]
+    both = groups[adv | finv]
+    # split the sentences that allow both in proportion to what is missing
+    (adv_need, finv_need) = (adv_target - len(adv_only), finv_target - len(finv_only))
+    if adv_need + finv_need > len(both):
+        n_adv = min(adv_need, round(len(both) * adv_need / (adv_need + finv_need)))
+        n_adv = max(n_adv, len(both) - finv_need)
+    else:
+        n_adv = adv_need
+    n_finv = min(finv_need, len(both) - n_adv)
+    for i in adv_only + both[:n_adv]:
+        labels[i] = "S-Adv"
+    for i in finv_only + both[n_adv:n_adv + n_finv]:
+        labels[i] = "S-FinV"
+    return (labels, targets)
+
+# return a RNG for the index-th sentence of a treebank. Depends only on the
+# base seed and on the index, so that the output does not depend on how
+# sentences are split into batches or distributed among workers
+def sent_rng(seed, index):
+    return random.Random("{}-{}".format(seed, index))
+
+# group an iterable into lists of (at most) size elements
+def batched(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        batch = list(itertools.islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+# corrupt a batch of (index, raw sentence) pairs and return, for each of
+# them, the list of its serialized corrupted sentences. This is what each
+# worker process runs. If variants is given, each sentence yields several
+# variants (see corrupt_variants) instead of a single corrupted sentence;
+# ALL_VARIANTS means all of the possible ones. labels, if given, are the error labels of
+# the sentences of the batch (see assign_labels)
+def corrupt_batch(batch, seed, variants=None, labels=None):
+    outsents = []
+    for (k, (i, insent)) in enumerate(batch):
+        with instrument.timer("corrupt.parse"):
+            sent = conllu.parse(insent)[0]
+        if variants is None:
+            outsent = corrupt(sent, sent_rng(seed, i), labels and labels[k])
+            with instrument.timer("corrupt.serialize"):
+                outsents.append([outsent.serialize()])
+        else:
+            serialized = []
+            for outsent in corrupt_variants(sent, None if variants == ALL_VARIANTS else variants, sent_rng(seed, i)):
+                with instrument.timer("corrupt.serialize"):
+                    serialized.append(outsent.serialize())
+            outsents.append(serialized)
+    return outsents
+
+# write the corrupted sentences of a batch (as returned by corrupt_batch) to
+# outfile, and describe them in a sidecar.Writer if one is given
+def write_batch(batch, outsents, outfile, meta=None):
+    for ((_, insent), sent_outsents) in zip(batch, outsents):
+        for outsent in sent_outsents:
+            outfile.write(outsent)
+            if meta is not None:
+                meta.add(outsent, insent)
+
+# corrupt batches of (index, raw sentence) pairs, yielding (batch, serialized
+# corrupted sentences) in input order. With more than one worker, batches are
+# handed to a process pool, keeping at most 2 batches per worker in flight so
+# that memory use depends on the batch size and not on the size of the
+# treebank. When profiling, the statistics of the workers are merged into the
+# main process. labels, if given, are the error labels of all the sentences
+# of the treebank (see assign_labels)
+def corrupt_batches(batches, seed=42, workers=1, variants=None, labels=None):
+    def batch_labels(batch):
+        return labels and [labels[i] for (i, _) in batch]
+    if workers < 2:
+        for batch in batches:
+            yield (batch, corrupt_batch(batch, seed, variants, batch_labels(batch)))
+        return
+    profiling = instrument.default.enabled
+    def collect(batch, future):
+        if not profiling:
+            return (batch, future.result())
+        (outsents, stats) = future.result()
+        instrument.default.merge(stats)
+        return (batch, outsents)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = deque()
+        for batch in batches:
+            if profiling:
+                pending.append((batch, pool.submit(instrument.run, corrupt_batch, batch, seed, variants, batch_labels(batch))))
+            else:
+                pending.append((batch, pool.submit(corrupt_batch, batch, seed, variants, batch_labels(batch))))
+            if len(pending) >= 2 * workers:
+                yield collect(*pending.popleft())
+        while pending:
+            yield collect(*pending.popleft())
+
+# corrupt a whole treebank, streaming its raw sentence blocks (e.g. from
+# reader.iter_blocks) to outfile in batches of batch_size sentences (see
+# corrupt_batches). Sentences are written in input order whatever the number
+# of workers. If meta (a sidecar.Writer) is given, the sidecar is written
+# along with the treebank
+def corrupt_treebank(blocks, outfile, seed=42, batch_size=1000, workers=1, variants=None, meta=None, labels=None):
+    for (batch, outsents) in corrupt_batches(batched(enumerate(blocks), batch_size), seed, workers, variants, labels):
+        write_batch(batch, outsents, outfile, meta)
+
+# corrupt a whole treebank as corrupt_treebank, but writing each batch to its
+# own chunk file in shard_dir (see seapass.shards) and recording it in the
+# manifest as soon as it is done, so that an interrupted run can be resumed.
+# With resume, chunks already in the manifest are kept if they were made with
+# the same options from the same input sentences (same content hash), and
+# only the others are corrupted again. No RNG state needs to be saved: each
+# sentence's RNG only depends on the seed and on its index (see sent_rng).
+# Assigned labels, if any, count as input of their chunk.
+# Returns the number of chunks that were (re)computed
+def corrupt_sharded(blocks, shard_dir, seed=42, batch_size=1000, workers=1, variants=None, resume=False, inpath=None, labels=None):
+    os.makedirs(shard_dir, exist_ok=True)
+    options = {"seed": seed, "batch_size": batch_size, "variants": variants, "exact_labels": labels is not None}
+    previous = shards.read_manifest(shard_dir)
+    # chunk files of the previous run, to remove those that are not reused
+    previous_files = set(chunk["file"] for chunk in previous["chunks"]) if previous else set()
+    if resume and previous is not None and previous["options"] != options:
+        print("options changed since the last run, corrupting everything again", file=sys.stderr)
+    done = {}
+    if resume and previous is not None and previous["options"] == options:
+        done = {chunk["first"]: chunk for chunk in previous["chunks"]}
+    manifest = {"input": inpath and os.path.abspath(inpath), "options": options, "complete": False, "chunks": []}
+    # chunks of the manifest by first sentence. Reusable chunks of the
+    # previous run stay in it until they turn out to be stale, so that they
+    # survive another interruption
+    chunks = dict(done)
+    hashes = {}
+    visited = set()
+
+    def save_manifest():
+        manifest["chunks"] = [chunks[first] for first in sorted(chunks)]
+        shards.write_manifest(shard_dir, manifest)
+
+    # batches that need to be corrupted, keeping the others as they are
+    def stale(batches):
+        for batch in batches:
+            (first, _) = batch[0]
+            input_hash = shards.content_hash(block for (_, block) in batch)
+            if labels is not None:
+                input_hash = shards.content_hash([input_hash] + [labels[i] for (i, _) in batch])
+            visited.add(first)
+            chunk = done.get(first)
+            if chunk and chunk["input_hash"] == input_hash and chunk["sentences"] == len(batch) \
+                    and os.path.exists(os.path.join(shard_dir, chunk["file"])):
+                continue
+            chunks.pop(first, None)
+            hashes[first] = input_hash
+            yield batch
+
+    n_done = 0
+    batches = batched(enumerate(blocks), batch_size)
+    for (batch, outsents) in corrupt_batches(stale(batches), seed, workers, variants, labels):
+        (first, _) = batch[0]
+        name = shards.chunk_name(first // batch_size)
+        chunk_path = os.path.join(shard_dir, name)
+        shards.write_atomic(chunk_path, "".join(itertools.chain.from_iterable(outsents)))
+        # sidecar of the chunk (see reader.index)
+        meta = sidecar.Writer(chunk_path)
+        for ((_, insent), sent_outsents) in zip(batch, outsents):
+            for outsent in sent_outsents:
+                meta.add(outsent, insent)
+        meta.close()
+        chunks[first] = {
+            "file": name,
+            "first": first,
+            "sentences": len(batch),
+            "input_hash": hashes.pop(first)}
+        save_manifest()
+        n_done += 1
+    # e.g. chunks past the end of a treebank that got shorter
+    for first in set(chunks) - visited:
+        del chunks[first]
+    for name in previous_files - set(chunk["file"] for chunk in chunks.values()):
+        for path in [os.path.join(shard_dir, name), sidecar.path(os.path.join(shard_dir, name))]:
+            if os.path.exists(path):
+                os.remove(path)
+    manifest["complete"] = True
+    save_manifest()
+    return n_done
+
+# --variants: a positive number or "all"
+def variants_arg(value):
+    if value == ALL_VARIANTS:
+        return ALL_VARIANTS
+    try:
+        n = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError("expected a number or '{}', got {!r}".format(ALL_VARIANTS, value))
+    if n < 1:
+        raise argparse.ArgumentTypeError("the number of variants must be at least 1, got {}".format(n))
+    return n
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("treebank", help=".conllu treebank to be corrupted")
+    parser.add_argument("--seed", type=int, default=42, help="base seed, each sentence gets its own RNG derived from it and from the sentence index")
+    parser.add_argument("--batch_size", type=int, default=1000, help="number of sentences corrupted in one go by a worker")
+    parser.add_argument("--workers", type=int, default=1, help="number of worker processes")
+    parser.add_argument("--variants", type=variants_arg, default=None, help="number of distinct corrupted variants per sentence, or 'all' for all the possible ones (default: a single corrupted sentence)")
+    parser.add_argument("--exact_labels", action="store_true", help="plan the viable corruptions of all sentences first and assign error labels so that the whole treebank follows the label weights, instead of drawing a label per sentence")
+    parser.add_argument("--label_weights", type=lambda s: [float(w) for w in s.split(",")], default=SWELL_WEIGHTS, help="with --exact_labels, comma-separated weights of {} (default: {})".format(", ".join(SWELL_LABELS), ",".join(str(w) for w in SWELL_WEIGHTS)))
+    parser.add_argument("--sharded", action="store_true", help="write the output as one chunk file per batch in <output>.shards/, with a manifest, instead of a single file")
+    parser.add_argument("--resume", action="store_true", help="with --sharded, keep the chunks of a previous (interrupted) run whose input did not change")
+    cache.add_arguments(parser)
+    instrument.add_arguments(parser)
     args = parser.parse_args()
+    if args.resume and not args.sharded:
+        parser.error("--resume only works with --sharded")
+    if args.exact_labels and args.variants is not None:
+        parser.error("--exact_labels does not work with --variants")
+    if len(args.label_weights) != len(SWELL_LABELS):
+        parser.error("--label_weights needs one weight per label ({})".format(", ".join(SWELL_LABELS)))
+    cache.configure(args)
+    instrument.configure(args)
 
     inpath = args.treebank
     # the output treebank is created in the same folder as the original one,
@@ -165,12 +630,22 @@ if __name__ == "__main__":
     (name,ext) = os.path.splitext(inpath) 
     outpath = "{}-corrupted{}".format(name,ext)
 
-    with open(inpath) as infile, open(outpath, "w") as outfile:
-        intext = infile.read()
-    
-        insents = conllu.parse(intext)
-    
-        for insent in insents:
-            outsent = corrupt(insent)
-            outfile.write(outsent.serialize())
+    labels = None
+    if args.exact_labels:
+        (labels, targets) = assign_labels(plan_treebank(inpath, args.batch_size), args.label_weights, args.seed)
+        for (label, target) in zip(SWELL_LABELS, targets):
+            n = labels.count(label)
+            shortfall = " ({} short)".format(target - n) if n < target else ""
+            print("{}: {} sentences, target {}{}".format(label, n, target, shortfall), file=sys.stderr)
 
+    blocks = reader.iter_cached_blocks(inpath)
+    if args.sharded:
+        n_done = corrupt_sharded(blocks, shards.directory(outpath), args.seed, args.batch_size, args.workers, args.variants, args.resume, inpath, labels)
+        print("{} chunks corrupted".format(n_done), file=sys.stderr)
+    else:
+        # the sidecar (see seapass.sidecar) is written along with the output,
+        # and completed once the output is closed
+        meta = sidecar.Writer(outpath)
+        with open(outpath, "w") as outfile:
+            corrupt_treebank(blocks, outfile, args.seed, args.batch_size, args.workers, args.variants, meta, labels)
+        meta.close()
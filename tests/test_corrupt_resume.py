@@ -0,0 +1,70 @@
+import os
+import os.path
+import subprocess
+import sys
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.append(ROOT)
+from seapass import cache, reader, shards
+
+TREEBANK = os.path.join(ROOT, "data", "corrupted_talbanken", "sv_talbanken-ud-test.conllu")
+
+# corrupt.py --sharded on treebank, with the parsed treebank cache in
+# cache_dir. Returns the number of chunks it corrupted
+def corrupt_sharded(treebank, cache_dir, *args):
+    env = dict(os.environ, SEAPASS_CACHE_DIR=str(cache_dir))
+    env.pop("SEAPASS_NO_CACHE", None)
+    result = subprocess.run(
+        [sys.executable, os.path.join(ROOT, "talbanken_scripts", "corrupt.py"), str(treebank), "--sharded", "--batch_size", "100"] + list(args),
+        env=env, capture_output=True, text=True, check=True)
+    return int(result.stderr.strip().splitlines()[-1].split()[0])
+
+def chunk_contents(shard_dir):
+    contents = []
+    for path in shards.chunk_paths(shard_dir):
+        with open(path, "rb") as f:
+            contents.append(f.read())
+    return contents
+
+def copy_treebank(path, crlf):
+    with open(TREEBANK, "rb") as f:
+        data = f.read()
+    with open(path, "wb") as f:
+        f.write(data.replace(b"\n", b"\r\n") if crlf else data)
+
+# the blocks of a treebank are the same text whether they come from the
+# cache or from the file, including for CRLF files
+@pytest.mark.parametrize("crlf", [False, True])
+def test_cached_blocks(tmp_path, monkeypatch, crlf):
+    treebank = tmp_path / "t.conllu"
+    copy_treebank(treebank, crlf)
+    monkeypatch.setattr(cache.default, "directory", str(tmp_path / "cache"))
+    monkeypatch.setattr(cache.default, "enabled", True)
+    uncached = list(reader.iter_cached_blocks(str(treebank)))
+    reader.read(str(treebank))
+    assert list(reader.iter_cached_blocks(str(treebank))) == uncached
+
+# resuming a complete run redoes nothing, whether the input treebank is in
+# the cache (its blocks are then serialized from there) or not
+@pytest.mark.parametrize("crlf", [False, True])
+def test_resume_cached_and_uncached(tmp_path, monkeypatch, crlf):
+    treebank = tmp_path / "t.conllu"
+    copy_treebank(treebank, crlf)
+    cache_dir = tmp_path / "cache"
+    shard_dir = shards.directory(str(tmp_path / "t-corrupted.conllu"))
+
+    n_chunks = corrupt_sharded(treebank, cache_dir)
+    assert n_chunks == len(reader.OffsetIndex(str(treebank))) // 100 + 1
+    uncached = chunk_contents(shard_dir)
+    assert corrupt_sharded(treebank, cache_dir, "--resume") == 0
+
+    monkeypatch.setattr(cache.default, "directory", str(cache_dir))
+    monkeypatch.setattr(cache.default, "enabled", True)
+    reader.read(str(treebank))
+    assert cache.default.get(str(treebank), "Treebank", reader.read_options(None, True)) is not None
+    assert corrupt_sharded(treebank, cache_dir, "--resume") == 0
+
+    # and both paths corrupt the same sentences the same way
+    assert corrupt_sharded(treebank, cache_dir) == n_chunks
+    assert chunk_contents(shard_dir) == uncached
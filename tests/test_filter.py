@@ -0,0 +1,62 @@
+import csv
+import os
+import os.path
+import subprocess
+import sys
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+FILTER = os.path.join(ROOT, "swell_scripts", "filter.py")
+
+LABELS = [
+    "S-Adv", "S-FinV,O-Cap", "S-WO,S-Adv,S-FinV", "O-Cap", "O-Cap,O-Cap", "O-Cap,O-Cap,S-WO",
+    "S-Adv,", ",", "", "S-Adv,L-W", "L-W", "S-FinV,S-FinV", "s-adv", "S-WO,M-Def,O-Cap",
+    ",S-Adv", "S-Adv,,S-WO", " S-Adv", "O-Cap,", ",O-Cap", "O-Cap,S-WO,O-Cap", "S-*", "O-Cap ", "S-WO,S-WO,S-WO"]
+
+def write_fixture(path):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f, delimiter="\t", lineterminator="\n")
+        writer.writerow(["Source sentence", "Target sentence", "Essay ID", "Correction labels"])
+        for (k, label_string) in enumerate(LABELS):
+            writer.writerow(["källa {}".format(k), "mål {}".format(k), "essay{}".format(k % 3), label_string])
+
+# filter.py before label masks, verbatim
+def old_filter(tsv, output):
+    with open(tsv) as infile:
+        full = list(csv.reader(infile, delimiter="\t"))[1:]
+    filtered = []
+    for [src,trg,essay_id,lables_str] in full:
+        labels = lables_str.split(",")
+        if labels and all([label in ["S-Adv", "S-FinV", "S-WO", "O-Cap"] and labels != ["O-Cap"] for label in labels]):
+            filtered.append([src,trg,essay_id,lables_str])
+    with open(output, "w") as out_file:
+        writer = csv.writer(out_file, delimiter="\t")
+        writer.writerows(filtered)
+
+def run_filter(tsv, output_dir, *args):
+    subprocess.run([sys.executable, FILTER, str(tsv), "--output_dir", str(output_dir), "--chunk_size", "4"] + list(args),
+        check=True, capture_output=True)
+
+def read(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+# the default filter writes exactly what the original filter wrote
+def test_default_is_the_original_filter(tmp_path):
+    tsv = tmp_path / "pairs.tsv"
+    write_fixture(tsv)
+    old_filter(tsv, tmp_path / "old.tsv")
+    run_filter(tsv, tmp_path)
+    assert read(tmp_path / "filtered.tsv") == read(tmp_path / "old.tsv")
+
+# the query version differs on repeated O-Cap corrections and empty labels
+def test_query_differences(tmp_path):
+    tsv = tmp_path / "pairs.tsv"
+    write_fixture(tsv)
+    run_filter(tsv, tmp_path)
+    run_filter(tsv, tmp_path, "--filter", "wo=only(S-Adv, S-FinV, S-WO, O-Cap) & !exactly(O-Cap)")
+    with open(tmp_path / "filtered.tsv") as f:
+        default = set(row[3] for row in csv.reader(f, delimiter="\t"))
+    with open(tmp_path / "wo.tsv") as f:
+        query = set(row[3] for row in csv.reader(f, delimiter="\t"))
+    assert default - query == {"O-Cap,O-Cap"}
+    assert query - default == {"S-Adv,", ",S-Adv", "S-Adv,,S-WO"}